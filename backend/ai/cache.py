@@ -0,0 +1,191 @@
+"""
+Response cache for /api/explain.
+
+Keys are built from the language, the submitted code byte for byte, and
+the error text with volatile parts (temp paths, line/column numbers,
+addresses) stripped. The code is not normalized: a hit returns the cached
+corrected_code, which has to be the caller's own code with the fix, not
+another submitter's comments and layout. Entries expire after
+a TTL and are evicted LRU once the cache is full. The storage backend is
+pluggable: "memory" keeps entries per process, "sqlite" shares them between
+workers on the same machine.
+"""
+import hashlib
+import json
+import os
+import re
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.getenv("CODESNAP_EXPLAIN_CACHE_BACKEND", "memory")
+CACHE_TTL = float(os.getenv("CODESNAP_EXPLAIN_CACHE_TTL", str(24 * 3600)))
+CACHE_SIZE = int(os.getenv("CODESNAP_EXPLAIN_CACHE_SIZE", "5000"))
+CACHE_PATH = os.getenv(
+    "CODESNAP_EXPLAIN_CACHE_PATH",
+    os.path.join(tempfile.gettempdir(), "codesnap-explain-cache.sqlite3"),
+)
+
+_STRING = r'"""[\s\S]*?"""|\'\'\'[\s\S]*?\'\'\'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+_PY_TOKENS = re.compile(rf"({_STRING})|#[^\n]*")
+_C_TOKENS = re.compile(
+    r'("(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`)'
+    r"|(?:\s|//[^\n]*|/\*[\s\S]*?\*/)+"
+)
+
+_ERROR_NOISE = [
+    # Directory part of absolute paths (temp dirs differ per run)
+    (re.compile(r'(?:[A-Za-z]:)?(?:[\\/][^\s\\/"\'():]+)+[\\/](?=[^\s\\/"\'])'), ""),
+    (re.compile(r"\bline \d+"), "line N"),
+    (re.compile(r"(\.\w+|\]|>):\d+(?::\d+)?"), r"\1:N"),
+    (re.compile(r"^\s*\d+\s*\|", re.MULTILINE), " |"),
+    (re.compile(r"0x[0-9a-fA-F]+"), "0x?"),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def normalize_code(language: str, code: str) -> str:
+    """Drop comments and whitespace that cannot change meaning."""
+    if language == "python":
+        # Indentation is significant, so only trailing space and blank lines go.
+        code = _PY_TOKENS.sub(lambda m: m.group(1) or "", code)
+        return "\n".join(line.rstrip() for line in code.splitlines() if line.strip())
+
+    # Runs of whitespace and comments collapse to one space; literals stay.
+    return _C_TOKENS.sub(lambda m: m.group(1) or " ", code).strip()
+
+
+def normalize_error(error: str) -> str:
+    for pattern, replacement in _ERROR_NOISE:
+        error = pattern.sub(replacement, error)
+    return error.strip()
+
+
+def cache_key(language: str, code: str, error: str) -> str:
+    digest = hashlib.sha256()
+    for part in (language.lower(), code, normalize_error(error)):
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class MemoryBackend:
+    """In-process LRU with per-entry expiry."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: dict):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteBackend:
+    """SQLite file shared by all workers on a host; LRU by last access."""
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS explain_cache ("
+            " key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._db.execute("CREATE INDEX IF NOT EXISTS explain_cache_accessed ON explain_cache (accessed)")
+
+    def get(self, key: str) -> dict | None:
+        now = time.time()
+        with self._lock:
+            row = self._db.execute(
+                "SELECT value FROM explain_cache WHERE key = ? AND expires >= ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            self._db.execute("UPDATE explain_cache SET accessed = ? WHERE key = ?", (now, key))
+        return json.loads(row[0])
+
+    def set(self, key: str, value: dict):
+        now = time.time()
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO explain_cache (key, value, expires, accessed) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value), now + self.ttl, now),
+            )
+            self._db.execute("DELETE FROM explain_cache WHERE expires < ?", (now,))
+            self._db.execute(
+                "DELETE FROM explain_cache WHERE key IN ("
+                " SELECT key FROM explain_cache ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._db.execute("SELECT COUNT(*) FROM explain_cache").fetchone()[0]
+
+
+class ExplainCache:
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, language: str, code: str, error: str) -> dict | None:
+        if self.backend is None:
+            return None
+        value = self.backend.get(cache_key(language, code, error))
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def set(self, language: str, code: str, error: str, value: dict):
+        if self.backend is not None:
+            self.backend.set(cache_key(language, code, error), value)
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "backend": CACHE_BACKEND,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "entries": len(self.backend) if self.backend is not None else 0,
+        }
+
+
+def _make_backend():
+    if CACHE_BACKEND == "sqlite":
+        return SqliteBackend(CACHE_PATH, CACHE_SIZE, CACHE_TTL)
+    if CACHE_BACKEND == "memory":
+        return MemoryBackend(CACHE_SIZE, CACHE_TTL)
+    return None
+
+
+explain_cache = ExplainCache(_make_backend())
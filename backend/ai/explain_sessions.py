@@ -0,0 +1,271 @@
+"""
+Explain sessions: incremental /api/explain for the edit-run-explain loop.
+
+A session is opened with POST /api/explain/session, which returns a random
+id; requests name it in session_id. Holding the id is what makes a session
+yours, so an id the server did not issue, or one that expired, is refused
+(UnknownSession) rather than started. The last submission (code, error)
+and its answer are kept per session, and the next explain in the session is
+answered against them:
+
+- When the code now matches the previous corrected_code (comments and
+  whitespace aside) and there is no error, or still the error that fix was
+  for, the fix has been applied: the answer is local and says so, once.
+- When only part of the file changed, the prompt carries the changed hunks
+  (a unified diff), the lines around the reported error and the previous
+  error and explanation instead of the whole file. The model answers with
+  find/replace edits which are applied to the new code to build
+  corrected_code; if they do not apply, the full prompt is sent instead.
+- Otherwise (first submission, another language, most of the file
+  rewritten) the usual full prompt is sent.
+
+Textbook errors still go to the local rules first. Sessions expire after
+CODESNAP_EXPLAIN_SESSION_TTL and are evicted LRU beyond
+CODESNAP_EXPLAIN_MAX_SESSIONS or CODESNAP_EXPLAIN_SESSIONS_MAX_BYTES.
+"""
+import asyncio
+import difflib
+import os
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from ai import groq_client
+from ai.cache import normalize_code, normalize_error
+from ai.rules import explain_locally, parse_error
+
+SESSION_TTL = float(os.getenv("CODESNAP_EXPLAIN_SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.getenv("CODESNAP_EXPLAIN_MAX_SESSIONS", "10000"))
+MAX_BYTES = int(os.getenv("CODESNAP_EXPLAIN_SESSIONS_MAX_BYTES", str(64 * 1024 * 1024)))
+# Send the incremental prompt only while diff and context stay under this share of the code
+DIFF_RATIO = float(os.getenv("CODESNAP_EXPLAIN_DIFF_RATIO", "0.5"))
+CONTEXT_LINES = 3
+# How much of the previous explanation goes back upstream
+PREVIOUS_EXPLANATION_CHARS = 400
+
+
+class UnknownSession(LookupError):
+    """A session id this server did not issue, or one that has expired."""
+
+
+@dataclass(eq=False)
+class Submission:
+    language: str
+    code: str
+    # The error `result` explains
+    error: str
+    result: dict
+    # The last answer was the local "fix applied" note, so the next one is not
+    noted: bool = False
+    last_used: float = field(default_factory=time.monotonic)
+
+    def chars(self) -> int:
+        return len(self.code) + len(self.error) + sum(len(str(v)) for v in self.result.values())
+
+
+def _fix_applied(previous: Submission, code: str, error: str) -> dict | None:
+    if previous.noted:
+        return None
+    language = previous.language.lower()
+    fixed = normalize_code(language, previous.result.get("corrected_code", ""))
+    if fixed == normalize_code(language, previous.code) or fixed != normalize_code(language, code):
+        return None
+    if not error.strip():
+        explanation = ("Your code now includes the fix from the previous explanation "
+                       "and no error was reported, so there is nothing left to fix.")
+    elif normalize_error(error) == normalize_error(previous.error):
+        explanation = ("Your code now includes the fix from the previous explanation, but this error "
+                       "is from before that change. Run the code again and ask again if it still fails.")
+    else:
+        return None
+    return {
+        "explanation": explanation,
+        "corrected_code": code,
+        "learning_tip": previous.result.get("learning_tip", ""),
+    }
+
+
+def _diff(before: str, after: str) -> str:
+    return "\n".join(difflib.unified_diff(
+        before.splitlines(), after.splitlines(), "before", "after", n=CONTEXT_LINES, lineterm=""
+    ))
+
+
+def _context(language: str, code: str, error: str) -> str:
+    """The lines around the reported error, or "" when it names no line."""
+    diag = parse_error(language, error)
+    if diag is None or not diag.line:
+        return ""
+    lines = code.split("\n")
+    start = max(0, diag.line - 1 - CONTEXT_LINES)
+    end = min(len(lines), diag.line + CONTEXT_LINES)
+    if start >= end:
+        return ""
+    return f"(lines {start + 1}-{end})\n" + "\n".join(lines[start:end])
+
+
+class ExplainSessionStore:
+    def __init__(self, ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS,
+                 max_bytes: int = MAX_BYTES, diff_ratio: float = DIFF_RATIO):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.diff_ratio = diff_ratio
+        self.total_chars = 0
+        self.opened = 0
+        self.requests = 0
+        self.local = 0
+        self.fixes_applied = 0
+        self.incremental = 0
+        self.incremental_fallbacks = 0
+        self.full = 0
+        # Characters of code the incremental prompts covered, and what they sent instead
+        self.code_chars = 0
+        self.sent_chars = 0
+        self.evictions = 0
+        self._sessions: OrderedDict[str, Submission] = OrderedDict()
+
+    def open(self) -> str:
+        """A new, empty session; its id is unguessable."""
+        session_id = secrets.token_urlsafe(24)
+        # Holds no submission yet (see get)
+        self._put(session_id, Submission("", "", "", {}))
+        self.opened += 1
+        return session_id
+
+    def get(self, session_id: str) -> Submission | None:
+        """
+        The session's last submission, or None before its first. Raises
+        UnknownSession for an id that was not issued or has expired.
+        """
+        self._expire()
+        previous = self._sessions.get(session_id)
+        if previous is None:
+            raise UnknownSession(session_id)
+        self._sessions.move_to_end(session_id)
+        previous.last_used = time.monotonic()
+        return previous if previous.language else None
+
+    def discard(self, session_id: str) -> bool:
+        previous = self._sessions.pop(session_id, None)
+        if previous is None:
+            return False
+        self.total_chars -= previous.chars()
+        return True
+
+    def _put(self, session_id: str, submission: Submission):
+        self.discard(session_id)
+        self._sessions[session_id] = submission
+        self.total_chars += submission.chars()
+        # Never evict the only (current) session
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self.total_chars > self.max_bytes
+        ):
+            _, evicted = self._sessions.popitem(last=False)
+            self.total_chars -= evicted.chars()
+            self.evictions += 1
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session_id, previous = next(iter(self._sessions.items()))
+            if previous.last_used >= deadline:
+                break
+            self.discard(session_id)
+            self.evictions += 1
+
+    def _record(self, session_id: str, previous: Submission | None, language: str, code: str,
+                error: str, result: dict, noted: bool):
+        if not groq_client.answered(result):
+            # Keep what the session had; this answer is no context for the next one
+            return
+        if noted:
+            self._put(session_id, Submission(language, code, previous.error, previous.result, noted=True))
+        else:
+            self._put(session_id, Submission(language, code, error, result))
+
+    async def _answer(self, previous: Submission | None, language: str, code: str, error: str,
+                      user: str) -> tuple[dict | None, bool]:
+        """
+        (result, noted) without the full prompt, or (None, False) when only
+        the full prompt will do.
+        """
+        result = await asyncio.to_thread(explain_locally, language, code, error)
+        if result is not None:
+            self.local += 1
+            return result, False
+        if previous is None or previous.language != language:
+            return None, False
+
+        result = _fix_applied(previous, code, error)
+        if result is not None:
+            self.fixes_applied += 1
+            return result, True
+
+        diff = _diff(previous.code, code)
+        context = _context(language, code, error)
+        if not code.strip() or len(diff) + len(context) > self.diff_ratio * len(code):
+            return None, False
+        result = await groq_client.explain_change(
+            language, code, error, diff, context,
+            previous.error, previous.result.get("explanation", "")[:PREVIOUS_EXPLANATION_CHARS], user,
+        )
+        if result is None:
+            self.incremental_fallbacks += 1
+            return None, False
+        self.incremental += 1
+        self.code_chars += len(code)
+        self.sent_chars += len(diff) + len(context)
+        return result, False
+
+    async def explain(self, session_id: str, language: str, code: str, error: str, user: str) -> dict:
+        """explain_error within a session; the same response dict. Raises UnknownSession."""
+        previous = self.get(session_id)
+        self.requests += 1
+        result, noted = await self._answer(previous, language, code, error, user)
+        if result is None:
+            self.full += 1
+            result = await groq_client.explain_error(language, code, error, user)
+        self._record(session_id, previous, language, code, error, result, noted)
+        return result
+
+    async def explain_stream(self, session_id: str, language: str, code: str, error: str, user: str):
+        """
+        explain_error_stream within a session. Local and incremental answers
+        are short, so they arrive as whole fields followed by "done".
+        """
+        previous = self.get(session_id)
+        self.requests += 1
+        result, noted = await self._answer(previous, language, code, error, user)
+        if result is None:
+            self.full += 1
+            async for kind, data in groq_client.explain_error_stream(language, code, error, user):
+                if kind == "done":
+                    result = data
+                yield kind, data
+        else:
+            for name, text in result.items():
+                yield "field", {"field": name, "delta": text}
+            yield "done", result
+        if result is not None:
+            self._record(session_id, previous, language, code, error, result, noted)
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "opened": self.opened,
+            "bytes": self.total_chars,
+            "max_bytes": self.max_bytes,
+            "requests": self.requests,
+            "local": self.local,
+            "fixes_applied": self.fixes_applied,
+            "incremental": self.incremental,
+            "incremental_fallbacks": self.incremental_fallbacks,
+            "full": self.full,
+            "incremental_sent_ratio": self.sent_chars / self.code_chars if self.code_chars else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+explain_sessions = ExplainSessionStore()
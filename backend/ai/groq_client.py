@@ -1,34 +1,278 @@
+import asyncio
+import hashlib
 import json
+import logging
+import math
 import os
+import random
+import time
 
 from dotenv import load_dotenv
-from groq import Groq
+
+from ai.cache import explain_cache
+from ai.json_stream import JsonFieldStream
+from ai.scheduler import FairScheduler, RateLimited, request_tokens
+from ai.singleflight import SingleFlight
+from monitoring.metrics import Counter, Histogram
 
 # Load env here (CRITICAL)
 load_dotenv(".env.local")
 
+logger = logging.getLogger(__name__)
+
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
 
 # ✅ Use a VERIFIED Groq model
 MODEL = "llama-3.1-8b-instant"
 
-client: Groq | None = None
-if GROQ_API_KEY:
-  client = Groq(api_key=GROQ_API_KEY)
+# Upstream limits: at most GROQ_MAX_CONCURRENCY completions in flight per
+# process, each over a kept-alive connection from one shared pool. Which
+# waiting call goes next is up to the scheduler (ai/scheduler.py).
+GROQ_MAX_CONCURRENCY = int(os.getenv("CODESNAP_GROQ_MAX_CONCURRENCY", "16"))
+GROQ_TIMEOUT = float(os.getenv("CODESNAP_GROQ_TIMEOUT", "60"))
+GROQ_CONNECT_TIMEOUT = float(os.getenv("CODESNAP_GROQ_CONNECT_TIMEOUT", "5"))
+GROQ_KEEPALIVE = float(os.getenv("CODESNAP_GROQ_KEEPALIVE", "30"))
+GROQ_MAX_RETRIES = int(os.getenv("CODESNAP_GROQ_MAX_RETRIES", "3"))
+GROQ_BACKOFF_BASE = float(os.getenv("CODESNAP_GROQ_BACKOFF_BASE", "0.5"))
+GROQ_BACKOFF_MAX = float(os.getenv("CODESNAP_GROQ_BACKOFF_MAX", "8"))
+
+
+def _make_client():
+    # The SDK and its HTTP stack are imported here, on first use, not at startup.
+    import httpx
+    from groq import AsyncGroq
+
+    timeout = httpx.Timeout(GROQ_TIMEOUT, connect=GROQ_CONNECT_TIMEOUT)
+    http_client = httpx.AsyncClient(
+        timeout=timeout,
+        limits=httpx.Limits(
+            max_connections=GROQ_MAX_CONCURRENCY,
+            max_keepalive_connections=GROQ_MAX_CONCURRENCY,
+            keepalive_expiry=GROQ_KEEPALIVE,
+        ),
+    )
+    # Retries are ours (jittered, semaphore released while backing off).
+    return AsyncGroq(api_key=GROQ_API_KEY, http_client=http_client, timeout=timeout, max_retries=0)
+
+
+# AsyncGroq | None; see get_client()
+client = None
+
+
+def configured() -> bool:
+    """True when a GROQ_API_KEY is set; does not import the SDK."""
+    return bool(GROQ_API_KEY)
+
+
+def get_client():
+    """Shared AsyncGroq client, created on first use. None without an API key."""
+    global client
+    if client is None and GROQ_API_KEY:
+        client = _make_client()
+    return client
+
+
+def warm_up():
+    """Import the SDK and build the client ahead of the first request."""
+    get_client()
+
+
+scheduler = FairScheduler(GROQ_MAX_CONCURRENCY)
+
+# Calls that name no user share one set of buckets
+ANONYMOUS = "anonymous"
+
+# Identical prompts that arrive while one is already in flight share its answer.
+inflight = SingleFlight()
+
+in_use = 0
+retries = 0
+streams = 0
+first_token_seconds = 0.0
+# Incremental explains that failed upstream and fell back to the full prompt
+change_errors = 0
+
+UPSTREAM_LATENCY = Histogram(
+    "codesnap_groq_request_seconds", "Upstream Groq call latency per attempt.", ("mode", "outcome")
+)
+FIRST_TOKEN_LATENCY = Histogram(
+    "codesnap_groq_first_token_seconds", "Time from starting a streamed completion to its first token."
+)
+TOKENS = Counter("codesnap_groq_tokens_total", "Tokens billed by Groq.", ("type",))
+
+
+def _retryable() -> tuple[type[Exception], ...]:
+    # APIConnectionError includes timeouts; other 4xx are not retried.
+    from groq import APIConnectionError, InternalServerError, RateLimitError
+
+    return RateLimitError, InternalServerError, APIConnectionError
+
+
+def _outcome(error: Exception) -> str:
+    from groq import APIStatusError
+
+    if isinstance(error, APIStatusError):
+        return str(error.status_code)
+    return type(error).__name__
+
+
+def _count_tokens(usage):
+    if usage is not None:
+        TOKENS.inc("prompt", amount=usage.prompt_tokens or 0)
+        TOKENS.inc("completion", amount=usage.completion_tokens or 0)
 
 
-def explain_error(language: str, code: str, error: str):
+def _backoff(attempt: int, error: Exception) -> float:
+    """Honour Retry-After when the API sends one, else full-jitter exponential."""
+    from groq import APIStatusError
+
+    if isinstance(error, APIStatusError):
+        try:
+            return min(float(error.response.headers["retry-after"]), GROQ_BACKOFF_MAX)
+        except (KeyError, ValueError):
+            pass
+    return random.uniform(0, min(GROQ_BACKOFF_MAX, GROQ_BACKOFF_BASE * 2 ** attempt))
+
+
+async def _wait_to_retry(attempt: int, error: Exception):
+    from groq import RateLimitError
+
+    delay = _backoff(attempt, error)
+    if isinstance(error, RateLimitError):
+        # The limit is the account's, so every queued call holds off, not just this one
+        scheduler.pause(delay)
+    else:
+        await asyncio.sleep(delay)
+
+
+async def _create(request: dict, user: str, priority: str):
+    global in_use, retries
+    client = get_client()
+    tokens = request_tokens(request["messages"], request["max_tokens"])
+    for attempt in range(GROQ_MAX_RETRIES + 1):
+        try:
+            async with scheduler.slot(user, priority, tokens, charge=attempt == 0):
+                in_use += 1
+                started = time.perf_counter()
+                try:
+                    completion = await client.chat.completions.create(**request)
+                except Exception as e:
+                    UPSTREAM_LATENCY.observe(time.perf_counter() - started, "completion", _outcome(e))
+                    raise
+                finally:
+                    in_use -= 1
+            UPSTREAM_LATENCY.observe(time.perf_counter() - started, "completion", "ok")
+            _count_tokens(completion.usage)
+            return completion
+        except _retryable() as e:
+            if attempt == GROQ_MAX_RETRIES:
+                raise
+            retries += 1
+            await _wait_to_retry(attempt, e)
+
+
+async def chat_completion(messages: list[dict], temperature: float, max_tokens: int,
+                          user: str = ANONYMOUS, priority: str = "chat") -> str:
     """
-    Call Groq via the official Python SDK to explain an error and provide a fix.
-    Always returns a dict with: explanation, corrected_code, learning_tip.
+    Send one chat completion to Groq and return the message text.
+    Concurrent calls with the same model, messages and parameters are
+    coalesced into a single upstream request, scheduled for whoever asked
+    first; if it fails, every waiting caller gets the same exception and
+    handles it on its own. Raises RateLimited when the scheduler refuses.
+    """
+    request = {
+        "model": MODEL,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+    }
+    key = hashlib.sha256(json.dumps(request, sort_keys=True).encode("utf-8")).hexdigest()
+
+    async def call() -> str:
+        completion = await _create({**request, "stream": False}, user, priority)
+        return completion.choices[0].message.content
+
+    return await inflight.do(key, call)
+
+
+async def stream_chat_completion(messages: list[dict], temperature: float, max_tokens: int,
+                                 user: str = ANONYMOUS, priority: str = "chat"):
+    """
+    Async generator of message text deltas as Groq produces them.
+    Streams are never coalesced. Retryable errors are retried only until
+    the first token has been yielded; after that they propagate.
     """
-    if not GROQ_API_KEY or client is None:
-        return {
-            "explanation": "Groq API key not configured.",
-            "corrected_code": code,
-            "learning_tip": "Set your GROQ_API_KEY environment variable.",
-        }
+    global in_use, retries, streams, first_token_seconds
+    request = {
+        "model": MODEL,
+        "messages": messages,
+        "temperature": temperature,
+        "max_tokens": max_tokens,
+        "stream": True,
+    }
+    client = get_client()
+    tokens = request_tokens(messages, max_tokens)
+    started = time.perf_counter()
+    first_token = False
+    for attempt in range(GROQ_MAX_RETRIES + 1):
+        try:
+            async with scheduler.slot(user, priority, tokens, charge=attempt == 0):
+                in_use += 1
+                attempt_started = time.perf_counter()
+                outcome = "ok"
+                try:
+                    stream = await client.chat.completions.create(**request)
+                    try:
+                        async for chunk in stream:
+                            # Groq reports usage on the last chunk under x_groq
+                            x_groq = getattr(chunk, "x_groq", None)
+                            _count_tokens(getattr(x_groq, "usage", None))
+                            delta = chunk.choices[0].delta.content if chunk.choices else None
+                            if not delta:
+                                continue
+                            if not first_token:
+                                first_token = True
+                                streams += 1
+                                first_token_seconds += time.perf_counter() - started
+                                FIRST_TOKEN_LATENCY.observe(time.perf_counter() - started)
+                            yield delta
+                    finally:
+                        await stream.close()
+                    return
+                except BaseException as e:
+                    # GeneratorExit/CancelledError: the client went away mid-stream
+                    outcome = _outcome(e) if isinstance(e, Exception) else "cancelled"
+                    raise
+                finally:
+                    in_use -= 1
+                    UPSTREAM_LATENCY.observe(time.perf_counter() - attempt_started, "stream", outcome)
+        except _retryable() as e:
+            if first_token or attempt == GROQ_MAX_RETRIES:
+                raise
+            retries += 1
+            await _wait_to_retry(attempt, e)
+
+
+def upstream_stats() -> dict:
+    return {
+        "max_concurrency": GROQ_MAX_CONCURRENCY,
+        "in_use": in_use,
+        "retries": retries,
+        "streams": streams,
+        "avg_first_token_ms": first_token_seconds / streams * 1000 if streams else 0.0,
+        "change_errors": change_errors,
+        "coalescing": inflight.stats(),
+        "scheduler": scheduler.stats(),
+    }
+
+
+async def aclose():
+    """Close pooled upstream connections (app shutdown)."""
+    if client is not None:
+        await client.close()
+
 
+def _explain_messages(language: str, code: str, error: str) -> list[dict]:
     prompt = f"""
 Return ONLY valid JSON. No markdown. No extra text.
 
@@ -46,49 +290,255 @@ Code:
 Error:
 {error}
 """
+    return [
+        {
+            "role": "system",
+            "content": "You are a strict JSON-only API. Respond ONLY with valid JSON.",
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        },
+    ]
+
+
+def _change_messages(language: str, error: str, diff: str, context: str,
+                     previous_error: str, previous_explanation: str) -> list[dict]:
+    prompt = f"""
+Return ONLY valid JSON. No markdown. No extra text.
+
+{{
+  "explanation": "Explain the error clearly for a beginner",
+  "edits": [{{"find": "exact text from the current code", "replace": "what it becomes"}}],
+  "learning_tip": "One short learning tip"
+}}
+
+Language: {language}
+
+The student is fixing this program step by step. Last time the error was:
+{previous_error or "(none)"}
+
+and it was explained as:
+{previous_explanation}
+
+Their changes since then (unified diff):
+{diff or "(no changes)"}
+
+Current code around the error:
+{context}
+
+Current error:
+{error}
+
+"edits" must turn the current code into a corrected version. Each "find"
+must appear exactly once in the current code. Use [] if nothing needs to change.
+"""
+    return [
+        {
+            "role": "system",
+            "content": "You are a strict JSON-only API. Respond ONLY with valid JSON.",
+        },
+        {
+            "role": "user",
+            "content": prompt,
+        },
+    ]
+
+
+def _apply_edits(code: str, edits) -> str | None:
+    """code with each find/replace applied, or None if one does not match exactly once."""
+    if not isinstance(edits, list):
+        return None
+    for edit in edits:
+        if not isinstance(edit, dict):
+            return None
+        find, replace = edit.get("find"), edit.get("replace")
+        if not isinstance(find, str) or not isinstance(replace, str) or not find or code.count(find) != 1:
+            return None
+        code = code.replace(find, replace)
+    return code
+
+
+def _explain_result(data: dict, code: str) -> dict:
+    # Ensure all expected keys are present
+    return {
+        "explanation": data.get(
+            "explanation", "The AI did not return an explanation."
+        ),
+        "corrected_code": data.get("corrected_code", code),
+        "learning_tip": data.get(
+            "learning_tip", "Try to understand why this error happened and how the fix works."
+        ),
+    }
+
+
+def _parse_envelope(content: str) -> dict:
+    # SAFE JSON extraction (Groq may add whitespace around JSON)
+    start = content.find("{")
+    end = content.rfind("}") + 1
+    json_text = content[start:end]
+
+    return json.loads(json_text)
+
+
+def _not_configured(code: str) -> dict:
+    return {
+        "explanation": "Groq API key not configured.",
+        "corrected_code": code,
+        "learning_tip": "Set your GROQ_API_KEY environment variable.",
+    }
+
+
+def _rate_limited(code: str, e: RateLimited) -> dict:
+    return {
+        "explanation": "Too many AI requests right now, so this one was not sent.",
+        "corrected_code": code,
+        "learning_tip": f"Try again in about {math.ceil(e.retry_after)} seconds.",
+    }
+
+
+def answered(result: dict) -> bool:
+    """False for the stand-in answers given when the LLM could not be asked."""
+    return result.get("explanation") not in (
+        "Groq API key not configured.",
+        "Too many AI requests right now, so this one was not sent.",
+        "Internal AI processing error.",
+    )
+
+
+def _processing_error(code: str, e: Exception) -> dict:
+    # Safe fallback to avoid breaking the frontend
+    return {
+        "explanation": "Internal AI processing error.",
+        "corrected_code": code,
+        "learning_tip": str(e),
+    }
+
+
+async def explain_error(language: str, code: str, error: str, user: str = ANONYMOUS):
+    """
+    Call Groq via the official async Python SDK to explain an error and provide a fix.
+    Always returns a dict with: explanation, corrected_code, learning_tip.
+    Successful answers are cached, so repeats skip the LLM entirely.
+    Explanations are scheduled ahead of tutor chat.
+    """
+    cached = explain_cache.get(language, code, error)
+    if cached is not None:
+        return cached
+
+    if not configured():
+        return _not_configured(code)
+
+    try:
+        content = await chat_completion(
+            _explain_messages(language, code, error),
+            temperature=0.2,
+            max_tokens=512,
+            user=user,
+            priority="explain",
+        )
+        result = _explain_result(_parse_envelope(content), code)
+        explain_cache.set(language, code, error, result)
+        return result
+
+    except RateLimited as e:
+        return _rate_limited(code, e)
+    except Exception as e:
+        return _processing_error(code, e)
+
+
+async def explain_change(language: str, code: str, error: str, diff: str, context: str,
+                         previous_error: str, previous_explanation: str, user: str = ANONYMOUS) -> dict | None:
+    """
+    Incremental variant of explain_error for an explain session: the prompt
+    carries the diff since the previous submission, the lines around the
+    error and a summary of the previous answer instead of the whole file,
+    and the model answers with edits that are applied here to build
+    corrected_code. Returns None when the answer cannot be used, so the
+    caller can fall back to explain_error.
+    """
+    global change_errors
+    cached = explain_cache.get(language, code, error)
+    if cached is not None:
+        return cached
+
+    if not configured():
+        return _not_configured(code)
 
     try:
-        chat_completion = client.chat.completions.create(
-            model=MODEL,
-            messages=[
-                {
-                    "role": "system",
-                    "content": "You are a strict JSON-only API. Respond ONLY with valid JSON.",
-                },
-                {
-                    "role": "user",
-                    "content": prompt,
-                },
-            ],
+        content = await chat_completion(
+            _change_messages(language, error, diff, context, previous_error, previous_explanation),
             temperature=0.2,
             max_tokens=512,
-            stream=False,
+            user=user,
+            priority="explain",
         )
+        data = _parse_envelope(content)
+    except RateLimited as e:
+        return _rate_limited(code, e)
+    except Exception:
+        change_errors += 1
+        logger.warning("Incremental explain failed; falling back to the full prompt", exc_info=True)
+        return None
 
-        content = chat_completion.choices[0].message.content
+    corrected = _apply_edits(code, data.get("edits"))
+    if corrected is None or "explanation" not in data:
+        return None
+    result = _explain_result({**data, "corrected_code": corrected}, code)
+    explain_cache.set(language, code, error, result)
+    return result
 
-        # SAFE JSON extraction (Groq may add whitespace around JSON)
-        start = content.find("{")
-        end = content.rfind("}") + 1
-        json_text = content[start:end]
 
-        data = json.loads(json_text)
+async def explain_error_stream(language: str, code: str, error: str, user: str = ANONYMOUS):
+    """
+    Streaming variant of explain_error. Yields ("queued", {"position",
+    "estimated_wait_ms"}) first when the call has to wait for the scheduler,
+    then ("field", {"field", "delta"}) as each JSON string field is
+    generated, then ("done", result) with the same dict explain_error would
+    have returned.
+    """
+    cached = explain_cache.get(language, code, error)
+    if cached is not None:
+        for field, text in cached.items():
+            yield "field", {"field": field, "delta": text}
+        yield "done", cached
+        return
+
+    if not configured():
+        yield "done", _not_configured(code)
+        return
+
+    messages = _explain_messages(language, code, error)
+    queued = scheduler.estimate(user, "explain", request_tokens(messages, 512))
+    if queued["estimated_wait_ms"] > 0:
+        yield "queued", queued
 
-        # Ensure all expected keys are present
-        return {
-            "explanation": data.get(
-                "explanation", "The AI did not return an explanation."
-            ),
-            "corrected_code": data.get("corrected_code", code),
-            "learning_tip": data.get(
-                "learning_tip", "Try to understand why this error happened and how the fix works."
-            ),
-        }
+    parser = JsonFieldStream()
+    content = []
+    try:
+        async for delta in stream_chat_completion(
+            messages,
+            temperature=0.2,
+            max_tokens=512,
+            user=user,
+            priority="explain",
+        ):
+            content.append(delta)
+            for field, text in parser.feed(delta):
+                yield "field", {"field": field, "delta": text}
+        try:
+            data = _parse_envelope("".join(content))
+        except ValueError:
+            # Truncated or malformed; keep whatever fields were complete enough to show.
+            if not parser.fields:
+                raise
+            data = parser.fields
+        result = _explain_result(data, code)
+        if parser.done:
+            explain_cache.set(language, code, error, result)
+        yield "done", result
 
+    except RateLimited as e:
+        yield "done", _rate_limited(code, e)
     except Exception as e:
-        # Safe fallback to avoid breaking the frontend
-        return {
-            "explanation": "Internal AI processing error.",
-            "corrected_code": code,
-            "learning_tip": str(e),
-        }
+        yield "done", _processing_error(code, e)
@@ -0,0 +1,132 @@
+"""
+Incremental parser for the JSON envelope returned by /explain prompts.
+
+The model streams an object like {"explanation": "...", "corrected_code":
+"...", "learning_tip": "..."} a few characters at a time. JsonFieldStream
+consumes those chunks and reports decoded text for each top-level string
+field as soon as it arrives, so the explanation can be shown before the
+corrected code has been generated. Anything before the opening brace is
+ignored, and non-string values are skipped.
+"""
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class JsonFieldStream:
+    def __init__(self):
+        self.fields: dict[str, str] = {}
+        self._state = "start"
+        self._key: list[str] = []
+        self._field: str | None = None
+        self._hex = ""
+        self._high_surrogate: int | None = None
+        # Skipping a non-string value: nesting depth and string state
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+
+    @property
+    def done(self) -> bool:
+        return self._state == "end"
+
+    def feed(self, chunk: str) -> list[tuple[str, str]]:
+        """Consume a chunk; return (field, text) deltas in arrival order."""
+        deltas: list[tuple[str, str]] = []
+        for ch in chunk:
+            text = self._step(ch)
+            if text:
+                if deltas and deltas[-1][0] == self._field:
+                    deltas[-1] = (self._field, deltas[-1][1] + text)
+                else:
+                    deltas.append((self._field, text))
+                self.fields[self._field] += text
+        return deltas
+
+    def _step(self, ch: str) -> str | None:
+        state = self._state
+        if state == "start":
+            if ch == "{":
+                self._state = "key_wait"
+        elif state == "key_wait":
+            if ch == '"':
+                self._key = []
+                self._state = "key"
+            elif ch == "}":
+                self._state = "end"
+        elif state == "key":
+            if ch == "\\":
+                self._state = "key_escape"
+            elif ch == '"':
+                self._state = "colon"
+            else:
+                self._key.append(ch)
+        elif state == "key_escape":
+            self._key.append(_ESCAPES.get(ch, ch))
+            self._state = "key"
+        elif state == "colon":
+            if ch == ":":
+                self._state = "value_wait"
+        elif state == "value_wait":
+            if ch == '"':
+                self._field = "".join(self._key)
+                self.fields[self._field] = ""
+                self._state = "string"
+            elif not ch.isspace():
+                self._depth = 1 if ch in "[{" else 0
+                self._in_string = False
+                self._escaped = False
+                self._state = "other"
+        elif state == "string":
+            if ch == "\\":
+                self._state = "escape"
+            elif ch == '"':
+                self._state = "after_value"
+            else:
+                return ch
+        elif state == "escape":
+            if ch == "u":
+                self._hex = ""
+                self._state = "unicode"
+            else:
+                self._state = "string"
+                return _ESCAPES.get(ch, ch)
+        elif state == "unicode":
+            self._hex += ch
+            if len(self._hex) == 4:
+                self._state = "string"
+                return self._codepoint(int(self._hex, 16))
+        elif state == "other":
+            self._skip_value(ch)
+        elif state == "after_value":
+            if ch == ",":
+                self._state = "key_wait"
+            elif ch == "}":
+                self._state = "end"
+        return None
+
+    def _codepoint(self, code: int) -> str | None:
+        if 0xD800 <= code < 0xDC00:
+            self._high_surrogate = code
+            return None
+        if 0xDC00 <= code < 0xE000 and self._high_surrogate is not None:
+            code = 0x10000 + ((self._high_surrogate - 0xD800) << 10) + (code - 0xDC00)
+        self._high_surrogate = None
+        return chr(code)
+
+    def _skip_value(self, ch: str):
+        if self._in_string:
+            if self._escaped:
+                self._escaped = False
+            elif ch == "\\":
+                self._escaped = True
+            elif ch == '"':
+                self._in_string = False
+        elif ch == '"':
+            self._in_string = True
+        elif ch in "[{":
+            self._depth += 1
+        elif ch in "]}" and self._depth:
+            self._depth -= 1
+        elif self._depth == 0 and ch == ",":
+            self._state = "key_wait"
+        elif self._depth == 0 and ch == "}":
+            self._state = "end"
@@ -0,0 +1,469 @@
+"""
+Local fast path for /explain.
+
+Textbook errors (a missing indent, a misspelt name, a forgotten semicolon)
+are recognised from the compiler/interpreter output that routes/run.py
+returns, and answered from a rule library without calling the LLM. Each
+rule pairs a message pattern with a templated explanation and tip and a
+mechanical fix; a rule only answers when its fix applies cleanly to the
+submitted code and the fixed code then passes an in-process check
+(compile() for Python; for C, Java and JavaScript, literals and comments
+closed and brackets balanced); otherwise the caller falls through to
+explain_error. No compiler is started for a fix. Parsing a large Python
+file still takes a while, so callers on the event loop use a thread.
+
+Rules are indexed by (language, error kind) so a lookup only tries the few
+rules that can possibly match.
+"""
+import builtins
+import difflib
+import re
+import warnings
+from dataclasses import dataclass
+from typing import Callable
+
+
+@dataclass
+class Diagnostic:
+    kind: str
+    message: str
+    line: int | None
+    column: int | None = None
+    detail: str = ""
+
+
+@dataclass
+class Rule:
+    language: str
+    kind: str
+    pattern: re.Pattern
+    fix: Callable[[list[str], Diagnostic, re.Match], tuple[list[str], dict] | None]
+    explanation: str
+    tip: str
+
+
+# --- Parsing the error text --------------------------------------------------
+
+_PY_EXCEPTION = re.compile(r"^(\w+(?:Error|Exception|Warning)): (.*)$", re.MULTILINE)
+_PY_LOCATION = re.compile(r'^\s*File "[^"]*", line (\d+)', re.MULTILINE)
+_GCC_ERROR = re.compile(r"^[^:\n]+:(\d+):(\d+): (?:fatal )?error: (.*)$", re.MULTILINE)
+_JAVAC_ERROR = re.compile(r"^[^:\n]+\.java:(\d+): error: (.*)$", re.MULTILINE)
+_JS_EXCEPTION = re.compile(r"^(\w*Error): (.*)$", re.MULTILINE)
+_JS_LOCATION = re.compile(r"^\s+at (?:.*?\()?(?:\[eval\]|[^\s():]+\.[cm]?js):(\d+):(\d+)", re.MULTILINE)
+_JS_HEADER = re.compile(r"^(?:\[eval\]|[^\s:]+\.[cm]?js):(\d+)$", re.MULTILINE)
+
+
+def _parse_python(error: str) -> Diagnostic | None:
+    exceptions = _PY_EXCEPTION.findall(error)
+    if not exceptions:
+        return None
+    kind, message = exceptions[-1]
+    locations = _PY_LOCATION.findall(error)
+    return Diagnostic(kind, message, int(locations[-1]) if locations else None)
+
+
+def _parse_c(error: str) -> Diagnostic | None:
+    match = _GCC_ERROR.search(error)
+    if match is None:
+        return None
+    # gcc uses typographic quotes in UTF-8 locales
+    message = match.group(3).replace("‘", "'").replace("’", "'")
+    return Diagnostic("error", message, int(match.group(1)), int(match.group(2)))
+
+
+def _parse_java(error: str) -> Diagnostic | None:
+    match = _JAVAC_ERROR.search(error)
+    if match is None:
+        return None
+    following = error[match.end():].split("\n")[1:]
+    detail = []
+    for text in following:
+        if _JAVAC_ERROR.match(text):
+            break
+        detail.append(text)
+    column = None
+    if len(detail) > 1 and detail[1].strip() == "^":
+        column = detail[1].index("^") + 1
+    return Diagnostic("error", match.group(2), int(match.group(1)), column, "\n".join(detail))
+
+
+def _parse_javascript(error: str) -> Diagnostic | None:
+    match = _JS_EXCEPTION.search(error)
+    if match is None:
+        return None
+    location = _JS_LOCATION.search(error)
+    if location is not None:
+        return Diagnostic(match.group(1), match.group(2), int(location.group(1)), int(location.group(2)))
+    header = _JS_HEADER.search(error)
+    return Diagnostic(match.group(1), match.group(2), int(header.group(1)) if header else None)
+
+
+_PARSERS = {
+    "python": _parse_python,
+    "c": _parse_c,
+    "java": _parse_java,
+    "javascript": _parse_javascript,
+}
+
+
+# --- Mechanical fixes ----------------------------------------------------------
+
+_IDENTIFIER = re.compile(r"[A-Za-z_$][\w$]*")
+
+_KEYWORDS = {
+    "c": {
+        "auto", "break", "case", "char", "const", "continue", "default", "do", "double",
+        "else", "enum", "extern", "float", "for", "goto", "if", "int", "long", "register",
+        "return", "short", "signed", "sizeof", "static", "struct", "switch", "typedef",
+        "union", "unsigned", "void", "volatile", "while", "include", "define",
+    },
+}
+
+_KNOWN_NAMES = {
+    "python": set(dir(builtins)),
+    "javascript": {
+        "console", "Math", "JSON", "Number", "String", "Array", "Object", "Boolean",
+        "Map", "Set", "Promise", "Date", "Error", "parseInt", "parseFloat", "isNaN",
+        "setTimeout", "setInterval", "clearTimeout", "process", "require", "undefined",
+    },
+    "java": {
+        "System", "String", "Integer", "Double", "Math", "Scanner", "ArrayList", "List",
+        "HashMap", "Map", "Arrays", "println", "print", "printf", "length", "size",
+        "charAt", "equals", "nextInt", "nextLine", "parseInt", "add", "get", "put",
+    },
+    "c": {"printf", "scanf", "puts", "putchar", "getchar", "malloc", "free", "strlen", "NULL"},
+}
+
+
+def _indent_of(text: str) -> str:
+    return text[: len(text) - len(text.lstrip())]
+
+
+def _previous_code_line(lines: list[str], index: int) -> int | None:
+    for i in range(index - 1, -1, -1):
+        if lines[i].strip():
+            return i
+    return None
+
+
+def _closest(language: str, name: str, lines: list[str]) -> str | None:
+    """The one plausible intended name for a misspelt identifier, if any."""
+    candidates = set(_IDENTIFIER.findall("\n".join(lines))) | _KNOWN_NAMES.get(language, set())
+    candidates -= _KEYWORDS.get(language, set())
+    candidates.discard(name)
+    matches = difflib.get_close_matches(name, candidates, n=2, cutoff=0.75)
+    if len(matches) == 2 and difflib.SequenceMatcher(None, name, matches[0]).ratio() == \
+            difflib.SequenceMatcher(None, name, matches[1]).ratio():
+        return None
+    return matches[0] if matches else None
+
+
+def _replace_name(lines: list[str], line: int | None, old: str, new: str) -> list[str] | None:
+    """
+    Every use of the undefined name `old` renamed to `new`, as a whole word
+    and not as a member after ".". None unless the reported line uses it.
+    """
+    if line is None or not 1 <= line <= len(lines):
+        return None
+    pattern = re.compile(rf"(?<![\w$.]){re.escape(old)}(?![\w$])")
+    if pattern.search(lines[line - 1]) is None:
+        return None
+    return [pattern.sub(new, text) for text in lines]
+
+
+def _strip_line_comment(text: str) -> tuple[str, str]:
+    """Split off a trailing // comment that is not inside a string literal."""
+    for match in re.finditer(r"//", text):
+        if text.count('"', 0, match.start()) % 2 == 0:
+            return text[: match.start()], text[match.start():]
+    return text, ""
+
+
+def _append_semicolon(text: str) -> str:
+    code, comment = _strip_line_comment(text)
+    stripped = code.rstrip()
+    return stripped + ";" + code[len(stripped):] + comment
+
+
+def _fix_expected_block(lines, diag, match):
+    if diag.line is None or not 1 < diag.line <= len(lines):
+        return None
+    header = int(match.group("header")) - 1 if match.group("header") else _previous_code_line(lines, diag.line - 1)
+    if header is None or not lines[header].rstrip().endswith(":"):
+        return None
+    base = _indent_of(lines[header])
+    fixed = list(lines)
+    fixed[diag.line - 1] = base + ("\t" if "\t" in base else "    ") + lines[diag.line - 1].lstrip()
+    return fixed, {"header": header + 1}
+
+
+def _fix_unexpected_indent(lines, diag, match):
+    if diag.line is None or not 1 <= diag.line <= len(lines):
+        return None
+    previous = _previous_code_line(lines, diag.line - 1)
+    base = _indent_of(lines[previous]) if previous is not None else ""
+    if previous is not None and lines[previous].rstrip().endswith(":"):
+        return None
+    fixed = list(lines)
+    fixed[diag.line - 1] = base + lines[diag.line - 1].lstrip()
+    return fixed, {}
+
+
+def _fix_unindent(lines, diag, match):
+    if diag.line is None or not 1 <= diag.line <= len(lines):
+        return None
+    width = len(_indent_of(lines[diag.line - 1]).expandtabs())
+    previous = _previous_code_line(lines, diag.line - 1)
+    if previous is None:
+        return None
+    # Snap to the nearest level used so far; on a tie stay in the current block.
+    levels = {_indent_of(text) for text in lines[: diag.line - 1] if text.strip()}
+    base = min(
+        levels,
+        key=lambda indent: (abs(len(indent.expandtabs()) - width), indent != _indent_of(lines[previous])),
+    )
+    fixed = list(lines)
+    fixed[diag.line - 1] = base + lines[diag.line - 1].lstrip()
+    return fixed, {}
+
+
+def _fix_misspelt_name(language):
+    def fix(lines, diag, match):
+        name = match.group("name")
+        groups = match.groupdict()
+        if groups.get("module"):
+            return [f"import {groups['module']}"] + lines, {"suggestion": f"import {groups['module']}"}
+        suggestion = groups.get("suggestion")
+        if not suggestion or suggestion in _KEYWORDS.get(language, set()):
+            suggestion = _closest(language, name, lines)
+        if suggestion is None:
+            return None
+        fixed = _replace_name(lines, diag.line, name, suggestion)
+        return (fixed, {"suggestion": suggestion}) if fixed is not None else None
+    return fix
+
+
+def _fix_gcc_semicolon(lines, diag, match):
+    if diag.line is None or not 1 <= diag.line <= len(lines):
+        return None
+    text = lines[diag.line - 1]
+    column = (diag.column or 1) - 1
+    if not text[:column].strip():
+        # Error reported at the start of the next statement: the previous
+        # statement is the one without a semicolon.
+        previous = _previous_code_line(lines, diag.line - 1)
+        if previous is None:
+            return None
+        fixed = list(lines)
+        fixed[previous] = _append_semicolon(lines[previous])
+        return fixed, {"statement_line": previous + 1}
+    fixed = list(lines)
+    fixed[diag.line - 1] = text[:column].rstrip() + "; " + text[column:]
+    return fixed, {"statement_line": diag.line}
+
+
+def _fix_javac_semicolon(lines, diag, match):
+    if diag.line is None or not 1 <= diag.line <= len(lines):
+        return None
+    text = lines[diag.line - 1]
+    fixed = list(lines)
+    code, _ = _strip_line_comment(text)
+    if diag.column is not None and diag.column - 1 < len(code.rstrip()):
+        column = diag.column - 1
+        fixed[diag.line - 1] = text[:column] + ";" + text[column:]
+    else:
+        fixed[diag.line - 1] = _append_semicolon(text)
+    return fixed, {"statement_line": diag.line}
+
+
+def _fix_javac_symbol(lines, diag, match):
+    symbol = re.search(r"symbol:\s+(?P<what>\w+) (?P<name>[\w$]+)", diag.detail)
+    if symbol is None:
+        return None
+    name = symbol.group("name")
+    suggestion = _closest("java", name, lines)
+    if suggestion is None:
+        return None
+    fixed = _replace_name(lines, diag.line, name, suggestion)
+    if fixed is None:
+        return None
+    return fixed, {"name": name, "what": symbol.group("what"), "suggestion": suggestion}
+
+
+# --- Rule library -------------------------------------------------------------
+
+RULES = [
+    Rule(
+        "python", "IndentationError",
+        re.compile(r"expected an indented block(?: after .*? on line (?P<header>\d+))?"),
+        _fix_expected_block,
+        "Python uses indentation to decide which statements belong to a block. "
+        "Line {header} ends with a colon, so the line after it must be indented, "
+        "but line {line} starts at the same level.",
+        "After any line ending in ':' (if, for, while, def, class), indent the body by 4 spaces.",
+    ),
+    Rule(
+        "python", "IndentationError",
+        re.compile(r"unexpected indent"),
+        _fix_unexpected_indent,
+        "Line {line} is indented further than the line before it, but nothing "
+        "opened a new block there. Python treats extra indentation as an error "
+        "because indentation is part of the syntax.",
+        "Only indent after a line that ends with ':'; statements in the same block line up exactly.",
+    ),
+    Rule(
+        "python", "IndentationError",
+        re.compile(r"unindent does not match any outer indentation level"),
+        _fix_unindent,
+        "When a block ends, the next line must line up exactly with an earlier "
+        "level of indentation. Line {line} stops in between two levels.",
+        "Use the same number of spaces for every level (4 is the convention) and avoid mixing tabs and spaces.",
+    ),
+    Rule(
+        "python", "NameError",
+        re.compile(
+            r"name '(?P<name>\w+)' is not defined"
+            r"(?:\. Did you mean: '(?P<suggestion>\w+)'\?|\. Did you forget to import '(?P<module>\w+)'\?)?"
+        ),
+        _fix_misspelt_name("python"),
+        "Python does not know any name called '{name}' on line {line}. "
+        "It is most likely a typo or a missing import; the corrected code uses '{suggestion}'.",
+        "Python names are case-sensitive and must be defined (or imported) before they are used.",
+    ),
+    Rule(
+        "c", "error",
+        # Statement and declaration ends only; "expected ';', ',' or ')'" is a parameter list
+        re.compile(r"^expected (?:';'|',' or ';') before '(?P<token>.+?)'"),
+        _fix_gcc_semicolon,
+        "In C every statement must end with a semicolon. The statement on line "
+        "{statement_line} is missing its ';', so the compiler only noticed when it "
+        "reached '{token}' on line {line}.",
+        "When the compiler complains about a line that looks fine, check the end of the line before it.",
+    ),
+    Rule(
+        "c", "error",
+        re.compile(r"'(?P<name>\w+)' undeclared(?: .*?did you mean '(?P<suggestion>\w+)')?"),
+        _fix_misspelt_name("c"),
+        "'{name}' on line {line} was never declared, so the compiler does not "
+        "know what it refers to. It looks like a typo for '{suggestion}'.",
+        "In C every variable must be declared with a type before use, and names are case-sensitive.",
+    ),
+    Rule(
+        "java", "error",
+        re.compile(r"';' expected"),
+        _fix_javac_semicolon,
+        "Java statements end with a semicolon, and the statement on line "
+        "{statement_line} does not have one.",
+        "Every declaration, assignment and method call in Java ends with ';'; blocks in braces do not.",
+    ),
+    Rule(
+        "java", "error",
+        re.compile(r"cannot find symbol"),
+        _fix_javac_symbol,
+        "The compiler cannot find a {what} named '{name}' on line {line}. "
+        "It looks like a typo for '{suggestion}'.",
+        "Java is case-sensitive: 'system' and 'System' are different names. "
+        "Check spelling and that the variable is declared in scope.",
+    ),
+    Rule(
+        "javascript", "ReferenceError",
+        re.compile(r"(?P<name>[\w$]+) is not defined"),
+        _fix_misspelt_name("javascript"),
+        "JavaScript could not find anything called '{name}' when line {line} ran, "
+        "so it threw a ReferenceError. It looks like a typo for '{suggestion}'.",
+        "Declare variables with let or const before using them, and watch the spelling and capitalisation.",
+    ),
+]
+
+_INDEX: dict[tuple[str, str], list[Rule]] = {}
+for _rule in RULES:
+    _INDEX.setdefault((_rule.language, _rule.kind), []).append(_rule)
+
+matched = 0
+fallthrough = 0
+# Fixes that applied but did not pass the check
+rejected = 0
+
+# String, character and template literals, and comments, in C, Java and JavaScript
+_C_LIKE_NOISE = re.compile(
+    r'"""[\s\S]*?"""|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'|`(?:\\.|[^`\\])*`'
+    r"|//[^\n]*|/\*[\s\S]*?\*/"
+)
+_CLOSING = {")": "(", "]": "[", "}": "{"}
+
+
+def _well_formed(language: str, code: str) -> bool:
+    """
+    Whether fixed code passes the check for its language: compile() for
+    Python; for the others every literal and comment is closed and the
+    brackets pair up. Cheap enough to run on every answer.
+    """
+    if language == "python":
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            try:
+                compile(code + "\n", "<string>", "exec", dont_inherit=True)
+                return True
+            except (SyntaxError, ValueError, RecursionError, MemoryError):
+                return False
+    rest = _C_LIKE_NOISE.sub(" ", code)
+    if re.search(r"[\"'`]|/\*", rest):
+        # An unterminated literal or comment
+        return False
+    stack = []
+    for char in re.findall(r"[()\[\]{}]", rest):
+        if char in _CLOSING:
+            if not stack or stack.pop() != _CLOSING[char]:
+                return False
+        else:
+            stack.append(char)
+    return not stack
+
+
+def parse_error(language: str, error: str) -> Diagnostic | None:
+    """The first diagnostic in a compiler or runtime error, if recognised."""
+    parser = _PARSERS.get(language.lower())
+    return parser(error) if parser is not None and error else None
+
+
+def explain_locally(language: str, code: str, error: str) -> dict | None:
+    """
+    Answer a textbook error without the LLM. Returns the explain_error
+    response dict, or None when no rule is confident.
+    """
+    global matched, fallthrough, rejected
+    language = language.lower()
+    diag = parse_error(language, error)
+    if diag is not None:
+        lines = code.split("\n")
+        for rule in _INDEX.get((language, diag.kind), ()):
+            match = rule.pattern.search(diag.message)
+            if match is None:
+                continue
+            applied = rule.fix(lines, diag, match)
+            if applied is None:
+                continue
+            fixed, values = applied
+            if not _well_formed(language, "\n".join(fixed)):
+                rejected += 1
+                continue
+            values = {**{k: v for k, v in match.groupdict().items() if v}, **values, "line": diag.line}
+            matched += 1
+            return {
+                "explanation": rule.explanation.format(**values),
+                "corrected_code": "\n".join(fixed),
+                "learning_tip": rule.tip,
+            }
+    fallthrough += 1
+    return None
+
+
+def rule_stats() -> dict:
+    total = matched + fallthrough
+    return {
+        "rules": len(RULES),
+        "matched": matched,
+        "fallthrough": fallthrough,
+        "rejected_fixes": rejected,
+        "match_ratio": matched / total if total else 0.0,
+    }
@@ -0,0 +1,339 @@
+"""
+Fair scheduling of upstream Groq calls across users.
+
+Every completion, retries included, waits here for one of
+CODESNAP_GROQ_MAX_CONCURRENCY upstream slots. Waiting calls are served by
+priority class first (explain, then chat, then background work such as
+tutor summaries) and, within a class, by weighted fair queuing over users:
+each call is tagged with a virtual finish time, its user's previous tag
+plus its estimated tokens, and the smallest tag goes next. A user with
+twenty calls queued is served in turn with everyone else, not ahead.
+
+Per-user limits are opt-in. With CODESNAP_GROQ_USER_RPM and
+CODESNAP_GROQ_USER_TPM set, each user has two token buckets, one for
+requests and one for estimated tokens (prompt plus max_tokens), refilled
+at those rates per minute; a user with an empty bucket waits without
+holding anyone else up. With CODESNAP_GROQ_USER_MAX_QUEUE set, more
+waiting calls than that from one user are refused with RateLimited. All
+three default to 0 (no limit) because users are not authenticated: the
+key is a self-chosen user id or, for the frontend, which sends none, the
+client's address, which a whole classroom behind one NAT or proxy shares.
+Only turn them on where that key identifies one person. A call whose
+expected wait is above CODESNAP_GROQ_MAX_WAIT is always refused.
+
+Optional process-wide buckets (CODESNAP_GROQ_RPM, CODESNAP_GROQ_TPM; 0 means
+no limit) keep the server under the account's upstream limits, and a 429
+pauses all dispatch for its Retry-After instead of every waiting call
+retrying on its own.
+
+Users are whatever key the route passes: a user id, a session id or the
+client's address. Fair queuing between keys only orders calls, so a client
+inventing keys gains a larger share of the queue but never more than the
+process-wide limits. Token counts are estimates (about four characters per
+token).
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+
+from monitoring.metrics import Histogram
+
+# 0 means no per-user limit; see the module docstring before setting these
+USER_RPM = float(os.getenv("CODESNAP_GROQ_USER_RPM", "0"))
+USER_TPM = float(os.getenv("CODESNAP_GROQ_USER_TPM", "0"))
+USER_MAX_QUEUE = int(os.getenv("CODESNAP_GROQ_USER_MAX_QUEUE", "0"))
+MAX_WAIT = float(os.getenv("CODESNAP_GROQ_MAX_WAIT", "30"))
+GLOBAL_RPM = float(os.getenv("CODESNAP_GROQ_RPM", "0"))
+GLOBAL_TPM = float(os.getenv("CODESNAP_GROQ_TPM", "0"))
+MAX_USERS = int(os.getenv("CODESNAP_GROQ_MAX_USERS", "10000"))
+
+# Highest first
+PRIORITIES = ("explain", "chat", "background")
+
+QUEUE_WAIT = Histogram(
+    "codesnap_groq_queue_seconds", "Time upstream Groq calls waited for the scheduler.", ("priority",)
+)
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // 4 + 1
+
+
+def request_tokens(messages: list[dict], max_tokens: int) -> int:
+    """What a completion may cost: its prompt plus the most it may generate."""
+    return sum(estimate_tokens(message["content"]) for message in messages) + max_tokens
+
+
+class RateLimited(Exception):
+    """A call refused by the scheduler; retry_after is a hint in seconds."""
+
+    def __init__(self, message: str, retry_after: float):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """Refills continuously, up to one minute's worth. A rate of 0 never limits."""
+
+    def __init__(self, per_minute: float):
+        self.rate = per_minute / 60
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def delay(self, amount: float, now: float) -> float:
+        """Seconds until amount can be taken."""
+        if self.rate <= 0:
+            return 0.0
+        self._refill(now)
+        # A call bigger than the bucket waits for a full one rather than forever
+        return max(0.0, (min(amount, self.capacity) - self.level) / self.rate)
+
+    def take(self, amount: float, now: float):
+        if self.rate > 0:
+            self._refill(now)
+            self.level -= min(amount, self.capacity)
+
+
+@dataclass(eq=False)
+class Ticket:
+    user: str
+    priority: int
+    tokens: int
+    # Retries were paid for by the first attempt
+    charge: bool
+    # Virtual finish time for fair queuing within the priority class
+    finish: float
+    enqueued: float
+    future: asyncio.Future
+    dispatched: bool = False
+
+
+class _User:
+    def __init__(self, rpm: float, tpm: float):
+        self.requests = TokenBucket(rpm)
+        self.tokens = TokenBucket(tpm)
+        self.queues: list[deque[Ticket]] = [deque() for _ in PRIORITIES]
+        self.finish = [0.0] * len(PRIORITIES)
+        self.waiting = 0
+
+    def delay(self, ticket: Ticket, now: float) -> float:
+        if not ticket.charge:
+            return 0.0
+        return max(self.requests.delay(1, now), self.tokens.delay(ticket.tokens, now))
+
+
+class FairScheduler:
+    def __init__(self, max_concurrency: int, user_rpm: float = USER_RPM, user_tpm: float = USER_TPM,
+                 user_max_queue: int = USER_MAX_QUEUE, max_wait: float = MAX_WAIT,
+                 global_rpm: float = GLOBAL_RPM, global_tpm: float = GLOBAL_TPM, max_users: int = MAX_USERS):
+        self.max_concurrency = max_concurrency
+        self.user_rpm = user_rpm
+        self.user_tpm = user_tpm
+        self.user_max_queue = user_max_queue
+        self.max_wait = max_wait
+        self.max_users = max_users
+        self.requests = TokenBucket(global_rpm)
+        self.tokens = TokenBucket(global_tpm)
+        self.in_flight = 0
+        self.waiting = 0
+        self.paused_until = 0.0
+        self.pauses = 0
+        self.rejected = 0
+        self.dispatched = {priority: 0 for priority in PRIORITIES}
+        # Moving average of how long a call holds its slot, for wait estimates
+        self.avg_service = 1.0
+        self._vclock = [0.0] * len(PRIORITIES)
+        self._users: OrderedDict[str, _User] = OrderedDict()
+        self._timer: asyncio.TimerHandle | None = None
+
+    def _user(self, key: str) -> _User:
+        state = self._users.get(key)
+        if state is None:
+            state = self._users[key] = _User(self.user_rpm, self.user_tpm)
+            self._forget_idle()
+        else:
+            self._users.move_to_end(key)
+        return state
+
+    def _forget_idle(self):
+        # Least recently used first; a forgotten user starts again with full buckets
+        excess = len(self._users) - self.max_users
+        for key in list(self._users)[:-1]:
+            if excess <= 0:
+                break
+            if not self._users[key].waiting:
+                del self._users[key]
+                excess -= 1
+
+    @asynccontextmanager
+    async def slot(self, user: str, priority: str = "chat", tokens: int = 1, charge: bool = True):
+        """Hold one upstream slot for the duration of a call."""
+        await self._acquire(user, priority, tokens, charge)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            self.avg_service = 0.8 * self.avg_service + 0.2 * (time.monotonic() - started)
+            self.in_flight -= 1
+            self._dispatch()
+
+    async def _acquire(self, user: str, priority: str, tokens: int, charge: bool):
+        klass = PRIORITIES.index(priority)
+        state = self._user(user)
+        finish = max(self._vclock[klass], state.finish[klass]) + tokens
+        if charge:
+            if self.user_max_queue > 0 and state.waiting >= self.user_max_queue:
+                self.rejected += 1
+                raise RateLimited("Too many AI requests waiting, please retry shortly", self.avg_service)
+            _, wait = self._estimate(state, klass, tokens, finish)
+            if wait > self.max_wait:
+                self.rejected += 1
+                raise RateLimited(f"AI requests are rate limited, please retry in {math.ceil(wait)} s", wait)
+
+        now = time.monotonic()
+        ticket = Ticket(user, klass, tokens, charge, finish, now, asyncio.get_running_loop().create_future())
+        state.finish[klass] = finish
+        state.queues[klass].append(ticket)
+        state.waiting += 1
+        self.waiting += 1
+        self._dispatch()
+        try:
+            await ticket.future
+        except asyncio.CancelledError:
+            if ticket.dispatched:
+                # Granted just as the caller went away: hand the slot on
+                self.in_flight -= 1
+            else:
+                state.queues[klass].remove(ticket)
+                state.waiting -= 1
+                self.waiting -= 1
+            self._dispatch()
+            raise
+        QUEUE_WAIT.observe(time.monotonic() - ticket.enqueued, priority)
+
+    def _next(self, now: float) -> tuple[Ticket | None, float | None]:
+        """The ticket to dispatch now, else None and how long until one may be ready."""
+        soonest = None
+        for klass in range(len(PRIORITIES)):
+            best = None
+            for state in self._users.values():
+                if not state.queues[klass]:
+                    continue
+                ticket = state.queues[klass][0]
+                delay = state.delay(ticket, now)
+                if delay > 0:
+                    soonest = delay if soonest is None else min(soonest, delay)
+                elif best is None or ticket.finish < best.finish:
+                    best = ticket
+            if best is not None:
+                # The process-wide budget holds everyone back, in priority order
+                delay = max(self.requests.delay(1, now), self.tokens.delay(best.tokens, now))
+                return (best, None) if delay <= 0 else (None, delay)
+        return None, soonest
+
+    def _dispatch(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        while self.waiting and self.in_flight < self.max_concurrency:
+            now = time.monotonic()
+            if self.paused_until > now:
+                self._wake_in(self.paused_until - now)
+                return
+            ticket, delay = self._next(now)
+            if ticket is None:
+                if delay is not None:
+                    self._wake_in(delay)
+                return
+            state = self._users[ticket.user]
+            state.queues[ticket.priority].popleft()
+            state.waiting -= 1
+            self.waiting -= 1
+            if ticket.charge:
+                state.requests.take(1, now)
+                state.tokens.take(ticket.tokens, now)
+            self.requests.take(1, now)
+            self.tokens.take(ticket.tokens, now)
+            self._vclock[ticket.priority] = ticket.finish
+            self.in_flight += 1
+            self.dispatched[PRIORITIES[ticket.priority]] += 1
+            ticket.dispatched = True
+            ticket.future.set_result(None)
+
+    def _wake_in(self, delay: float):
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def pause(self, seconds: float):
+        """Hold all dispatch, e.g. for the Retry-After of an upstream 429."""
+        until = time.monotonic() + seconds
+        if until > self.paused_until:
+            self.paused_until = until
+            self.pauses += 1
+
+    def _estimate(self, state: _User, klass: int, tokens: int, finish: float,
+                  own: Ticket | None = None) -> tuple[int, float]:
+        """(calls ahead, expected seconds to wait) for a call with this tag."""
+        now = time.monotonic()
+        ahead = sum(
+            1
+            for other in self._users.values()
+            for queued_klass, queue in enumerate(other.queues)
+            for ticket in queue
+            if ticket is not own and (queued_klass < klass or (queued_klass == klass and ticket.finish <= finish))
+        )
+        # Calls ahead drain max_concurrency at a time once the slots are full
+        rounds = max(0, self.in_flight + ahead - self.max_concurrency + 1) / self.max_concurrency
+        wait = max(
+            math.ceil(rounds) * self.avg_service,
+            max(state.requests.delay(1, now), state.tokens.delay(tokens, now)),
+            self.paused_until - now,
+        )
+        return ahead, wait
+
+    def estimate(self, user: str, priority: str = "chat", tokens: int = 1) -> dict:
+        """Queue position and expected wait for a call the user would make now."""
+        klass = PRIORITIES.index(priority)
+        state = self._users.get(user) or _User(self.user_rpm, self.user_tpm)
+        finish = max(self._vclock[klass], state.finish[klass]) + tokens
+        position, wait = self._estimate(state, klass, tokens, finish)
+        return {"position": position, "estimated_wait_ms": round(wait * 1000)}
+
+    def queue(self, user: str) -> list[dict]:
+        """The user's waiting calls, each with its position and expected wait."""
+        state = self._users.get(user)
+        if state is None:
+            return []
+        now = time.monotonic()
+        calls = []
+        for klass, queue in enumerate(state.queues):
+            for ticket in queue:
+                position, wait = self._estimate(state, klass, ticket.tokens, ticket.finish, ticket)
+                calls.append({
+                    "priority": PRIORITIES[klass],
+                    "position": position,
+                    "waited_ms": round((now - ticket.enqueued) * 1000),
+                    "estimated_wait_ms": round(wait * 1000),
+                })
+        return calls
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "users": len(self._users),
+            "paused": self.paused_until > time.monotonic(),
+            "pauses": self.pauses,
+            "rejected": self.rejected,
+            "avg_service_ms": self.avg_service * 1000,
+            "dispatched": dict(self.dispatched),
+        }
@@ -0,0 +1,246 @@
+"""
+Server-side conversation sessions for /api/tutor.
+
+A session keeps the recent turns of one chat so the client sends only its
+new message. It is opened with POST /api/tutor/sessions, which returns a
+random id; holding the id is what makes the conversation yours, so an id
+the server did not issue, or one that expired, is refused (UnknownSession)
+rather than started. Prompts are laid out so consecutive turns share a prefix, which
+is what upstream prompt caching keys on:
+
+    [system prompt (fixed per language)] [summary of older turns] [turns...] [new message]
+
+Between compactions each prompt is the previous one plus two messages.
+Once the turns exceed CODESNAP_TUTOR_HISTORY_TOKENS, everything except the
+last few turns is folded into the summary by a background LLM call (with
+a local extract as fallback), so the next request does not wait for it.
+A hard cap of twice the budget drops the oldest turns immediately if
+compaction falls behind.
+
+Sessions are evicted LRU when idle past the TTL, when there are too many,
+or when their combined text exceeds CODESNAP_TUTOR_SESSIONS_MAX_BYTES.
+Token counts are estimates (about four characters per token).
+"""
+import asyncio
+import logging
+import os
+import secrets
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+
+from ai import groq_client
+from ai.scheduler import estimate_tokens
+
+HISTORY_TOKENS = int(os.getenv("CODESNAP_TUTOR_HISTORY_TOKENS", "1500"))
+KEEP_TURNS = int(os.getenv("CODESNAP_TUTOR_KEEP_TURNS", "4"))
+SESSION_TTL = float(os.getenv("CODESNAP_TUTOR_SESSION_TTL", "3600"))
+MAX_SESSIONS = int(os.getenv("CODESNAP_TUTOR_MAX_SESSIONS", "10000"))
+MAX_BYTES = int(os.getenv("CODESNAP_TUTOR_SESSIONS_MAX_BYTES", str(64 * 1024 * 1024)))
+SUMMARY_MAX_TOKENS = 300
+
+logger = logging.getLogger(__name__)
+
+
+class UnknownSession(LookupError):
+    """A session id this server did not issue, or one that has expired."""
+
+
+@dataclass(eq=False)
+class Turn:
+    role: str
+    content: str
+    tokens: int
+
+
+@dataclass(eq=False)
+class TutorSession:
+    id: str
+    language: str
+    summary: str = ""
+    turns: list[Turn] = field(default_factory=list)
+    last_used: float = field(default_factory=time.monotonic)
+    chars: int = 0
+    # Turns of one session run one at a time, in order
+    lock: asyncio.Lock = field(default_factory=asyncio.Lock)
+    compacting: asyncio.Task | None = None
+
+    def history_tokens(self) -> int:
+        return sum(turn.tokens for turn in self.turns)
+
+    def messages(self, system_prompt: str, message: str) -> list[dict]:
+        messages = [{"role": "system", "content": system_prompt}]
+        if self.summary:
+            messages.append({"role": "system", "content": f"Summary of the conversation so far:\n{self.summary}"})
+        messages.extend({"role": turn.role, "content": turn.content} for turn in self.turns)
+        messages.append({"role": "user", "content": message})
+        return messages
+
+
+def _local_summary(summary: str, turns: list[Turn]) -> str:
+    """Fallback when the LLM cannot summarise: keep what the student asked."""
+    questions = [turn.content.strip().replace("\n", " ")[:200] for turn in turns if turn.role == "user"]
+    lines = [summary] if summary else []
+    lines.extend(f"- The student asked: {question}" for question in questions)
+    return "\n".join(lines)[-4 * SUMMARY_MAX_TOKENS:]
+
+
+async def _summarize(summary: str, turns: list[Turn], user: str) -> str:
+    transcript = "\n\n".join(f"{turn.role.upper()}: {turn.content}" for turn in turns)
+    if summary:
+        transcript = f"EARLIER SUMMARY: {summary}\n\n{transcript}"
+    content = await groq_client.chat_completion(
+        [
+            {
+                "role": "system",
+                "content": "Summarize this tutoring conversation between a student and a programming tutor "
+                           "in at most 150 words. Keep the student's code, errors, identifiers and what has "
+                           "already been explained; drop greetings and repetition.",
+            },
+            {"role": "user", "content": transcript},
+        ],
+        temperature=0.2,
+        max_tokens=SUMMARY_MAX_TOKENS,
+        user=user,
+        # Behind every call someone is waiting on
+        priority="background",
+    )
+    return content.strip()
+
+
+class SessionStore:
+    def __init__(self, history_tokens: int = HISTORY_TOKENS, keep_turns: int = KEEP_TURNS,
+                 ttl: float = SESSION_TTL, max_sessions: int = MAX_SESSIONS, max_bytes: int = MAX_BYTES):
+        self.history_tokens = history_tokens
+        self.keep_turns = keep_turns
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.total_chars = 0
+        self.opened = 0
+        self.turns = 0
+        self.prompt_tokens = 0
+        self.compactions = 0
+        self.compaction_failures = 0
+        self.dropped_turns = 0
+        self.evictions = 0
+        self._sessions: OrderedDict[str, TutorSession] = OrderedDict()
+
+    def open(self, language: str = "general") -> str:
+        """A new, empty session; its id is unguessable."""
+        self._expire()
+        session_id = secrets.token_urlsafe(24)
+        self._sessions[session_id] = TutorSession(session_id, language)
+        self.opened += 1
+        self._shrink()
+        return session_id
+
+    def get(self, session_id: str, language: str) -> TutorSession:
+        """The session with this id. Raises UnknownSession if it was not issued or has expired."""
+        self._expire()
+        session = self._sessions.get(session_id)
+        if session is None:
+            raise UnknownSession(session_id)
+        self._sessions.move_to_end(session_id)
+        session.language = language
+        session.last_used = time.monotonic()
+        return session
+
+    def discard(self, session_id: str) -> bool:
+        session = self._sessions.pop(session_id, None)
+        if session is None:
+            return False
+        self._forget(session)
+        return True
+
+    def count_prompt(self, messages: list[dict]):
+        self.turns += 1
+        self.prompt_tokens += sum(estimate_tokens(m["content"]) for m in messages)
+
+    def record(self, session: TutorSession, message: str, reply: str):
+        """Append one exchange, then keep the history and the store within budget."""
+        for role, content in (("user", message), ("assistant", reply)):
+            session.turns.append(Turn(role, content, estimate_tokens(content)))
+            self._resize(session, len(content))
+
+        # Hard cap: never let the window grow unbounded while a summary is pending
+        while len(session.turns) > self.keep_turns and session.history_tokens() > 2 * self.history_tokens:
+            dropped = session.turns.pop(0)
+            self._resize(session, -len(dropped.content))
+            self.dropped_turns += 1
+
+        if session.history_tokens() > self.history_tokens and session.compacting is None:
+            session.compacting = asyncio.ensure_future(self._compact(session))
+        self._shrink()
+
+    async def _compact(self, session: TutorSession):
+        folded = session.turns[:-self.keep_turns] if self.keep_turns else list(session.turns)
+        try:
+            if not folded:
+                return
+            summary = None
+            if groq_client.configured():
+                try:
+                    summary = await _summarize(session.summary, folded, session.id)
+                except Exception:
+                    logger.warning("Tutor session summary failed; keeping a local extract", exc_info=True)
+                    self.compaction_failures += 1
+            if not summary:
+                summary = _local_summary(session.summary, folded)
+            # Turns appended (or dropped) meanwhile are left as they are
+            gone = set(map(id, folded))
+            kept = [turn for turn in session.turns if id(turn) not in gone]
+            removed = sum(len(turn.content) for turn in session.turns if id(turn) in gone)
+            self._resize(session, len(summary) - len(session.summary) - removed)
+            session.summary = summary
+            session.turns = kept
+            self.compactions += 1
+        finally:
+            session.compacting = None
+
+    def _resize(self, session: TutorSession, delta: int):
+        session.chars += delta
+        if self._sessions.get(session.id) is session:
+            self.total_chars += delta
+
+    def _forget(self, session: TutorSession):
+        self.total_chars -= session.chars
+        if session.compacting is not None:
+            session.compacting.cancel()
+
+    def _expire(self):
+        deadline = time.monotonic() - self.ttl
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if session.last_used >= deadline:
+                break
+            self._evict()
+
+    def _shrink(self):
+        # Never evict the only (current) session
+        while len(self._sessions) > 1 and (
+            len(self._sessions) > self.max_sessions or self.total_chars > self.max_bytes
+        ):
+            self._evict()
+
+    def _evict(self):
+        _, session = self._sessions.popitem(last=False)
+        self._forget(session)
+        self.evictions += 1
+
+    def stats(self) -> dict:
+        return {
+            "sessions": len(self._sessions),
+            "opened": self.opened,
+            "bytes": self.total_chars,
+            "max_bytes": self.max_bytes,
+            "turns": self.turns,
+            "avg_prompt_tokens": self.prompt_tokens / self.turns if self.turns else 0.0,
+            "compactions": self.compactions,
+            "compaction_failures": self.compaction_failures,
+            "dropped_turns": self.dropped_turns,
+            "evictions": self.evictions,
+        }
+
+
+tutor_sessions = SessionStore()
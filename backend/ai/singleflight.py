@@ -0,0 +1,66 @@
+"""
+In-flight request coalescing ("single-flight") for upstream LLM calls.
+
+Concurrent callers asking for the same key share one execution: the first
+caller starts the coroutine as a task and everyone, the first caller
+included, waits on it. Nothing is remembered once the call finishes, so this
+complements rather than replaces the response cache.
+"""
+import asyncio
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: dict[str, _Call] = {}
+        self.executions = 0
+        self.coalesced = 0
+        self.abandoned = 0
+
+    async def do(self, key: str, fn):
+        """
+        Await fn() once per key among concurrent callers and return its
+        result to all of them. If the shared call raises, every waiter sees
+        the same exception. A caller that is cancelled (e.g. the client
+        disconnected) only stops waiting; the shared call is cancelled when
+        its last waiter is gone.
+        """
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _: self._forget(key, call))
+            self.executions += 1
+        else:
+            self.coalesced += 1
+
+        call.waiters += 1
+        try:
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Nobody else wants the answer; stop the upstream call too.
+                self._forget(key, call)
+                call.task.cancel()
+                self.abandoned += 1
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call):
+        # A later flight may already own the key; only remove our own entry.
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    def stats(self) -> dict:
+        return {
+            "executions": self.executions,
+            "coalesced": self.coalesced,
+            "abandoned": self.abandoned,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,236 @@
+"""
+Server-side store for learning activity.
+
+Events arrive in batches from the frontend and are appended to an SQLite
+file (WAL, one transaction per batch). In the same transaction the batch is
+folded into rollups: per user and per class, per UTC day and per ISO week
+(starting Monday), per event kind, an event count and a value sum. Dashboard
+queries read only rollup rows, so their cost depends on the range asked for,
+not on how many raw events exist. A third "member" scope (class and user)
+backs the per-student rows of the instructor view.
+
+Event kinds mirror frontend/src/utils/ActivityTracker.js. The value of an
+event is its minutes for time_spent and 1/0 (correct or not) for
+quiz_answered; other kinds leave it at 0.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timedelta, timezone
+
+from storage.paths import data_path
+
+STORE_PATH = os.getenv("CODESNAP_ANALYTICS_PATH", data_path("analytics.sqlite3"))
+
+EVENT_KINDS = (
+    "code_run",
+    "error_explained",
+    "fix_applied",
+    "tutor_interaction",
+    "quiz_answered",
+    "report_downloaded",
+    "file_created",
+    "file_imported",
+    "time_spent",
+)
+
+# Kinds that count towards a learning streak, as in getLearningStreak()
+STREAK_KINDS = ("code_run", "error_explained", "fix_applied", "tutor_interaction")
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS events ("
+    " id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, class_id TEXT, kind TEXT NOT NULL,"
+    " ts REAL NOT NULL, value REAL NOT NULL, data TEXT)",
+    # Batch ids seen, so a client retrying a batch is not counted twice
+    "CREATE TABLE IF NOT EXISTS batches (batch_id TEXT PRIMARY KEY, received REAL NOT NULL) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS rollups ("
+    " scope TEXT NOT NULL, scope_id TEXT NOT NULL, period TEXT NOT NULL, start TEXT NOT NULL,"
+    " kind TEXT NOT NULL, count INTEGER NOT NULL, value REAL NOT NULL,"
+    " PRIMARY KEY (scope, scope_id, period, start, kind)) WITHOUT ROWID",
+    "CREATE TABLE IF NOT EXISTS class_members ("
+    " class_id TEXT NOT NULL, user_id TEXT NOT NULL, last_seen REAL NOT NULL,"
+    " PRIMARY KEY (class_id, user_id)) WITHOUT ROWID",
+)
+
+_UPSERT_ROLLUP = (
+    "INSERT INTO rollups (scope, scope_id, period, start, kind, count, value) VALUES (?, ?, ?, ?, ?, ?, ?)"
+    " ON CONFLICT (scope, scope_id, period, start, kind)"
+    " DO UPDATE SET count = count + excluded.count, value = value + excluded.value"
+)
+
+
+# Separates class and user in a member scope id (a control character, not expected in ids)
+_MEMBER_SEP = "\x1f"
+
+
+def _day(ts: float) -> date:
+    return datetime.fromtimestamp(ts, timezone.utc).date()
+
+
+def week_start(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def period_starts(period: str, count: int, today: date | None = None) -> list[str]:
+    """The last `count` day or week start dates, oldest first, ending with the current one."""
+    today = today or datetime.now(timezone.utc).date()
+    if period == "week":
+        current = week_start(today)
+        return [(current - timedelta(weeks=i)).isoformat() for i in range(count - 1, -1, -1)]
+    return [(today - timedelta(days=i)).isoformat() for i in range(count - 1, -1, -1)]
+
+
+class AnalyticsStore:
+    def __init__(self, path: str = STORE_PATH):
+        self.path = path
+        self.events = 0
+        self.batches = 0
+        self.duplicates = 0
+        self.ingest_seconds = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+
+    def ingest(self, user_id: str, class_id: str | None, events: list[tuple[str, float, float, dict | None]],
+               batch_id: str | None = None) -> bool:
+        """
+        Append (kind, ts, value, data) events and update the rollups in one
+        transaction. Returns False if batch_id was already ingested.
+        """
+        rollups: Counter = Counter()
+        values: Counter = Counter()
+        rows = []
+        for kind, ts, value, data in events:
+            day = _day(ts)
+            starts = (("day", day.isoformat()), ("week", week_start(day).isoformat()))
+            scopes = (
+                (("user", user_id), ("class", class_id), ("member", class_id + _MEMBER_SEP + user_id))
+                if class_id else (("user", user_id),)
+            )
+            for scope, scope_id in scopes:
+                for period, start in starts:
+                    key = (scope, scope_id, period, start, kind)
+                    rollups[key] += 1
+                    values[key] += value
+            rows.append((user_id, class_id, kind, ts, value, json.dumps(data) if data else None))
+
+        started = time.perf_counter()
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                if batch_id is not None:
+                    seen = self._db.execute(
+                        "INSERT OR IGNORE INTO batches (batch_id, received) VALUES (?, ?)", (batch_id, time.time())
+                    ).rowcount == 0
+                    if seen:
+                        self._db.execute("ROLLBACK")
+                        self.duplicates += 1
+                        return False
+                self._db.executemany(
+                    "INSERT INTO events (user_id, class_id, kind, ts, value, data) VALUES (?, ?, ?, ?, ?, ?)", rows
+                )
+                self._db.executemany(_UPSERT_ROLLUP, [(*key, n, values[key]) for key, n in rollups.items()])
+                if class_id:
+                    self._db.execute(
+                        "INSERT INTO class_members (class_id, user_id, last_seen) VALUES (?, ?, ?)"
+                        " ON CONFLICT (class_id, user_id) DO UPDATE SET last_seen = excluded.last_seen",
+                        (class_id, user_id, time.time()),
+                    )
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.events += len(rows)
+            self.batches += 1
+            self.ingest_seconds += time.perf_counter() - started
+        return True
+
+    def rollups(self, scope: str, scope_id: str, period: str, starts: list[str]) -> dict[str, dict[str, tuple]]:
+        """{start: {kind: (count, value)}} for the given period starts."""
+        if not starts:
+            return {}
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT start, kind, count, value FROM rollups"
+                " WHERE scope = ? AND scope_id = ? AND period = ? AND start BETWEEN ? AND ?",
+                (scope, scope_id, period, starts[0], starts[-1]),
+            ).fetchall()
+        result: dict[str, dict[str, tuple]] = {}
+        for start, kind, count, value in rows:
+            result.setdefault(start, {})[kind] = (count, value)
+        return result
+
+    def members(self, class_id: str) -> list[str]:
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT user_id FROM class_members WHERE class_id = ? ORDER BY user_id", (class_id,)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    def member_totals(self, class_id: str, period: str, starts: list[str]) -> dict[str, dict[str, tuple]]:
+        """{user_id: {kind: (count, value)}} of activity in this class over the range."""
+        if not starts:
+            return {}
+        prefix = class_id + _MEMBER_SEP
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT scope_id, kind, SUM(count), SUM(value) FROM rollups"
+                " WHERE scope = 'member' AND scope_id >= ? AND scope_id < ?"
+                " AND period = ? AND start BETWEEN ? AND ?"
+                " GROUP BY scope_id, kind",
+                (prefix, class_id + chr(ord(_MEMBER_SEP) + 1), period, starts[0], starts[-1]),
+            ).fetchall()
+        result: dict[str, dict[str, tuple]] = {}
+        for scope_id, kind, count, value in rows:
+            result.setdefault(scope_id[len(prefix):], {})[kind] = (count, value)
+        return result
+
+    def active_days(self, user_id: str, since: str) -> set[str]:
+        """Days since `since` on which the user did something that counts towards a streak."""
+        placeholders = ",".join("?" * len(STREAK_KINDS))
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT DISTINCT start FROM rollups WHERE scope = 'user' AND scope_id = ? AND period = 'day'"
+                f" AND start >= ? AND kind IN ({placeholders}) AND count > 0",
+                (user_id, since, *STREAK_KINDS),
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    def stats(self) -> dict:
+        return {
+            "events": self.events,
+            "batches": self.batches,
+            "duplicates": self.duplicates,
+            "events_per_second": self.events / self.ingest_seconds if self.ingest_seconds else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store: AnalyticsStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_analytics_store() -> AnalyticsStore:
+    """Shared store, opened on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = AnalyticsStore()
+    return _store
+
+
+def analytics_stats() -> dict:
+    if _store is None:
+        return {"open": False}
+    return {"open": True, **_store.stats()}
@@ -0,0 +1,142 @@
+"""
+Local stand-in for the Groq chat completions API, for load tests.
+
+Serves POST /openai/v1/chat/completions (streaming and non-streaming) with a
+configurable time-to-first-token and token rate, so backend throughput can
+be measured without network access or API quota. Point the backend at it
+with GROQ_BASE_URL (read by the Groq SDK) and any GROQ_API_KEY:
+
+    python -m bench.fake_groq --port 8900 --latency 0.3 --tokens-per-second 400
+    GROQ_BASE_URL=http://127.0.0.1:8900 GROQ_API_KEY=fake uvicorn main:app
+
+Prompts with a JSON-only system message (as /explain sends) get a JSON
+envelope back; everything else gets prose. Replies are deterministic for a
+given prompt, and latency is jittered with a fixed seed.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import random
+import time
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+app = FastAPI(title="Fake Groq")
+settings = {"latency": 0.3, "jitter": 0.1, "tokens_per_second": 400.0, "reply_tokens": 120, "error_rate": 0.0}
+_random = random.Random(0)
+
+_WORDS = (
+    "the error happens because the variable is used before it is defined so python "
+    "cannot find it when that line runs make sure every name is assigned first and "
+    "check the spelling carefully since names are case sensitive"
+).split()
+
+
+def _reply(messages: list[dict], max_tokens: int) -> str:
+    digest = int(hashlib.sha256(json.dumps(messages).encode()).hexdigest(), 16)
+    count = min(max_tokens, settings["reply_tokens"])
+    words = [_WORDS[(digest + i) % len(_WORDS)] for i in range(count)]
+    if any("JSON" in m.get("content", "") for m in messages if m.get("role") == "system"):
+        third = max(1, count // 3)
+        return json.dumps({
+            "explanation": " ".join(words[:third]),
+            "corrected_code": "print('fixed')\n# " + " ".join(words[third:2 * third]),
+            "learning_tip": " ".join(words[2 * third:]),
+        })
+    return " ".join(words)
+
+
+def _tokens(text: str) -> list[str]:
+    # Roughly one token per word or JSON punctuation run
+    pieces, current = [], ""
+    for ch in text:
+        current += ch
+        if ch in ' ,:{}"':
+            pieces.append(current)
+            current = ""
+    if current:
+        pieces.append(current)
+    return pieces
+
+
+def _usage(prompt: list[dict], completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(m.get("content", "").split()) for m in prompt)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+@app.post("/openai/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    messages = body.get("messages", [])
+    model = body.get("model", "fake")
+    if _random.random() < settings["error_rate"]:
+        return JSONResponse({"error": {"message": "overloaded"}}, status_code=503)
+
+    text = _reply(messages, body.get("max_tokens") or 512)
+    tokens = _tokens(text)
+    per_token = 1.0 / settings["tokens_per_second"] if settings["tokens_per_second"] > 0 else 0.0
+    first_token = max(0.0, settings["latency"] + _random.uniform(-settings["jitter"], settings["jitter"]))
+    created = int(time.time())
+    completion_id = f"chatcmpl-{hashlib.md5(text.encode()).hexdigest()[:12]}"
+
+    if not body.get("stream"):
+        await asyncio.sleep(first_token + per_token * len(tokens))
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": _usage(messages, len(tokens)),
+        }
+
+    async def events():
+        await asyncio.sleep(first_token)
+        for i, token in enumerate(tokens):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+            }
+            if i == len(tokens) - 1:
+                chunk["choices"][0]["finish_reason"] = "stop"
+                chunk["x_groq"] = {"id": completion_id, "usage": _usage(messages, len(tokens))}
+            yield f"data: {json.dumps(chunk)}\n\n"
+            if per_token:
+                await asyncio.sleep(per_token)
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", type=float, default=settings["latency"], help="seconds to first token")
+    parser.add_argument("--jitter", type=float, default=settings["jitter"], help="+/- seconds on the latency")
+    parser.add_argument("--tokens-per-second", type=float, default=settings["tokens_per_second"])
+    parser.add_argument("--reply-tokens", type=int, default=settings["reply_tokens"])
+    parser.add_argument("--error-rate", type=float, default=settings["error_rate"], help="fraction answered with 503")
+    args = parser.parse_args()
+    settings.update(
+        latency=args.latency,
+        jitter=args.jitter,
+        tokens_per_second=args.tokens_per_second,
+        reply_tokens=args.reply_tokens,
+        error_rate=args.error_rate,
+    )
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,283 @@
+"""
+Open-loop load test for the CodeSnap API.
+
+Requests from a scenario (see bench.scenarios) are started at a fixed
+target rate, whether or not earlier ones have finished, so a slow server
+shows up as latency instead of quietly lowering the offered load. Latency is
+measured from each request's scheduled start, which keeps queueing inside
+the client from hiding server stalls.
+
+The result is a JSON baseline with throughput, p50/p95/p99 latency and the
+error rate per endpoint. Compare a new run against a saved one with
+--compare; the exit status is 1 if any endpoint regressed.
+
+Against a running server:
+
+    python -m bench.loadtest --url http://127.0.0.1:8000 --scenario classroom --rps 20 --duration 60 -o baseline.json
+
+Or let it start the fake Groq server and the backend itself:
+
+    python -m bench.loadtest --spawn --scenario llm --rps 50 --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+
+from bench.scenarios import SCENARIOS, Request
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+
+def percentile(sorted_values: list[float], q: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(q / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+
+class Recorder:
+    def __init__(self):
+        # endpoint -> list of (latency seconds, error or None, status)
+        self.samples: dict[str, list[tuple[float, str | None, int]]] = {}
+
+    def add(self, name: str, latency: float, error: str | None, status: int):
+        self.samples.setdefault(name, []).append((latency, error, status))
+
+    def summary(self, elapsed: float) -> dict:
+        endpoints = {}
+        for name, samples in sorted(self.samples.items()):
+            endpoints[name] = _summarize(samples, elapsed)
+        everything = [sample for samples in self.samples.values() for sample in samples]
+        return {"endpoints": endpoints, "total": _summarize(everything, elapsed)}
+
+
+def _summarize(samples: list[tuple[float, str | None, int]], elapsed: float) -> dict:
+    ok = sorted(latency for latency, error, _ in samples if error is None)
+    errors: dict[str, int] = {}
+    statuses: dict[str, int] = {}
+    for _, error, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    failed = sum(errors.values())
+    return {
+        "requests": len(samples),
+        "errors": failed,
+        "error_rate": round(failed / len(samples), 4) if samples else 0.0,
+        "throughput_rps": round(len(ok) / elapsed, 3) if elapsed else 0.0,
+        "latency_ms": {
+            "mean": round(sum(ok) / len(ok) * 1000, 2) if ok else 0.0,
+            "p50": round(percentile(ok, 50) * 1000, 2),
+            "p95": round(percentile(ok, 95) * 1000, 2),
+            "p99": round(percentile(ok, 99) * 1000, 2),
+            "max": round(ok[-1] * 1000, 2) if ok else 0.0,
+        },
+        "status": statuses,
+        "error_kinds": errors,
+    }
+
+
+async def _send(client: httpx.AsyncClient, request: Request, n: int, scheduled: float,
+                recorder: Recorder | None, limit: asyncio.Semaphore):
+    status = 0
+    error = None
+    async with limit:
+        try:
+            response = await client.request(request.method, request.path, json=request.body(n))
+            status = response.status_code
+            if status >= 400:
+                error = f"HTTP {status}"
+            else:
+                error = request.check(status, response.content, response.headers.get("content-type", ""))
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+    if recorder is not None:
+        recorder.add(request.name, time.perf_counter() - scheduled, error, status)
+
+
+async def run_load(url: str, requests: list[Request], rps: float, duration: float, warmup: float,
+                   max_outstanding: int, timeout: float, seed: int) -> dict:
+    """Offer `rps` requests per second for warmup + duration seconds; only the latter is recorded."""
+    rng = random.Random(seed)
+    weights = [r.weight for r in requests]
+    recorder = Recorder()
+    limit = asyncio.Semaphore(max_outstanding)
+    limits = httpx.Limits(max_connections=max_outstanding, max_keepalive_connections=max_outstanding)
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        tasks = []
+        started = time.perf_counter()
+        measured_from = started + warmup
+        end = measured_from + duration
+        n = 0
+        while True:
+            scheduled = started + n / rps
+            if scheduled >= end:
+                break
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            request = rng.choices(requests, weights)[0]
+            target = recorder if scheduled >= measured_from else None
+            tasks.append(asyncio.create_task(_send(client, request, n, scheduled, target, limit)))
+            n += 1
+        await asyncio.gather(*tasks)
+        # Requests still running at `end` count towards the window they were offered in
+        elapsed = max(time.perf_counter(), end) - measured_from
+
+    return recorder.summary(elapsed)
+
+
+def compare(current: dict, baseline: dict, latency_tolerance: float, error_tolerance: float) -> list[str]:
+    """Describe every endpoint whose p95/p99 or error rate got worse than the baseline allows."""
+    regressions = []
+    for name, base in baseline.get("endpoints", {}).items():
+        now = current["endpoints"].get(name)
+        if now is None:
+            continue
+        for q in ("p95", "p99"):
+            before, after = base["latency_ms"][q], now["latency_ms"][q]
+            if before and after > before * (1 + latency_tolerance):
+                regressions.append(f"{name}: {q} {before:.1f}ms -> {after:.1f}ms")
+        if now["error_rate"] > base["error_rate"] + error_tolerance:
+            regressions.append(f"{name}: error rate {base['error_rate']:.2%} -> {now['error_rate']:.2%}")
+    return regressions
+
+
+def _wait_until_up(url: str, deadline: float):
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up")
+
+
+def _spawn(args) -> tuple[list[subprocess.Popen], str]:
+    """Start the fake Groq server and a backend pointed at it; returns (processes, backend url)."""
+    groq_url = f"http://127.0.0.1:{args.groq_port}"
+    fake = subprocess.Popen(
+        [sys.executable, "-m", "bench.fake_groq", "--port", str(args.groq_port),
+         "--latency", str(args.groq_latency), "--tokens-per-second", str(args.groq_tokens_per_second),
+         "--error-rate", str(args.groq_error_rate)],
+        cwd=BACKEND_DIR,
+    )
+    env = {**os.environ, "GROQ_BASE_URL": groq_url, "GROQ_API_KEY": os.environ.get("GROQ_API_KEY", "bench")}
+    backend = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(args.port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL,
+    )
+    processes = [fake, backend]
+    url = f"http://127.0.0.1:{args.port}"
+    try:
+        deadline = time.monotonic() + 30
+        _wait_until_up(f"{groq_url}/docs", deadline)
+        _wait_until_up(f"{url}/api/health", deadline)
+    except RuntimeError:
+        _stop(processes)
+        raise
+    return processes, url
+
+
+def _stop(processes: list[subprocess.Popen]):
+    for process in processes:
+        process.terminate()
+    for process in processes:
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def _git_revision() -> str | None:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.TimeoutExpired):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="backend to load (ignored with --spawn)")
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="classroom")
+    parser.add_argument("--rps", type=float, default=10.0, help="target requests per second")
+    parser.add_argument("--duration", type=float, default=30.0, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5.0, help="unmeasured seconds before the run")
+    parser.add_argument("--max-outstanding", type=int, default=256, help="client-side cap on requests in flight")
+    parser.add_argument("--timeout", type=float, default=30.0, help="per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0, help="seed for the request mix")
+    parser.add_argument("-o", "--output", help="write the JSON result here (default: stdout)")
+    parser.add_argument("--compare", help="baseline JSON to check this run against")
+    parser.add_argument("--latency-tolerance", type=float, default=0.2, help="allowed p95/p99 increase, as a fraction")
+    parser.add_argument("--error-tolerance", type=float, default=0.01, help="allowed error rate increase")
+    spawn = parser.add_argument_group("--spawn: start the fake Groq server and backend")
+    spawn.add_argument("--spawn", action="store_true")
+    spawn.add_argument("--port", type=int, default=8765)
+    spawn.add_argument("--groq-port", type=int, default=8900)
+    spawn.add_argument("--groq-latency", type=float, default=0.3)
+    spawn.add_argument("--groq-tokens-per-second", type=float, default=400.0)
+    spawn.add_argument("--groq-error-rate", type=float, default=0.0)
+    args = parser.parse_args()
+
+    processes: list[subprocess.Popen] = []
+    url = args.url
+    if args.spawn:
+        processes, url = _spawn(args)
+    try:
+        summary = asyncio.run(run_load(
+            url, SCENARIOS[args.scenario], args.rps, args.duration, args.warmup,
+            args.max_outstanding, args.timeout, args.seed,
+        ))
+    finally:
+        _stop(processes)
+
+    result = {
+        "meta": {
+            "scenario": args.scenario,
+            "target_rps": args.rps,
+            "duration_s": args.duration,
+            "warmup_s": args.warmup,
+            "seed": args.seed,
+            "git_revision": _git_revision(),
+            "python": platform.python_version(),
+            "cpus": os.cpu_count(),
+            "fake_groq": {
+                "latency_s": args.groq_latency,
+                "tokens_per_second": args.groq_tokens_per_second,
+                "error_rate": args.groq_error_rate,
+            } if args.spawn else None,
+        },
+        **summary,
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(result, baseline, args.latency_tolerance, args.error_tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+"""
+Request mixes for bench.loadtest.
+
+A scenario is a weighted list of Requests. Each Request builds its JSON body
+from a sequence number, so runs are reproducible, and has a check() that
+turns a 200 response with an error inside it into a failure (a /run that
+reports "Execution failed" is not a success just because the status was 200).
+
+Explain requests come in two kinds: "repeat" bodies hit the explain cache
+or the local rules after the first call, "fresh" bodies carry a unique
+variable name so every call goes upstream (to the fake Groq server).
+"""
+import json
+from dataclasses import dataclass, field
+from typing import Callable
+
+
+@dataclass
+class Request:
+    name: str
+    method: str
+    path: str
+    body: Callable[[int], dict]
+    weight: float = 1.0
+    check: Callable[[int, bytes, str], str | None] = field(default=lambda status, content, media_type: None)
+
+
+def _json_error(key: str, markers: tuple[str, ...]):
+    """Flag a 200 whose JSON `key` contains one of the server-side failure markers."""
+    def check(status: int, content: bytes, media_type: str) -> str | None:
+        try:
+            value = json.loads(content).get(key) or ""
+        except ValueError:
+            return "invalid json"
+        for marker in markers:
+            if marker in value:
+                return marker
+        return None
+
+    return check
+
+
+_RUN_FAILURES = ("Execution failed", "timed out", "is not installed")
+_EXPLAIN_FAILURES = ("Internal AI processing error", "Groq API key not configured")
+_EXPLAIN_CHECK = _json_error("explanation", _EXPLAIN_FAILURES)
+_TUTOR_CHECK = _json_error("reply", ("unavailable", "encountered a problem"))
+
+# Programs print their sequence number so outputs differ but work is the same
+_PROGRAMS = {
+    "python": "total = 0\nfor i in range(1000):\n    total += i\nprint({n}, total)\n",
+    "javascript": "let total = 0;\nfor (let i = 0; i < 1000; i++) total += i;\nconsole.log({n}, total);\n",
+    "java": (
+        "public class Main {{\n"
+        "    public static void main(String[] args) {{\n"
+        "        int total = 0;\n"
+        "        for (int i = 0; i < 1000; i++) total += i;\n"
+        "        System.out.println({n} + \" \" + total);\n"
+        "    }}\n"
+        "}}\n"
+    ),
+    "c": (
+        "#include <stdio.h>\n"
+        "int main(void) {{\n"
+        "    int total = 0;\n"
+        "    for (int i = 0; i < 1000; i++) total += i;\n"
+        "    printf(\"%d %d\\n\", {n}, total);\n"
+        "    return 0;\n"
+        "}}\n"
+    ),
+}
+
+# Java and C recompile on every new source. In the classroom mix they cycle
+# through a few fixed sources, so the compile cache sees realistic repeats.
+_COMPILED_VARIANTS = 8
+
+
+def _run(language: str, weight: float, variants: int | None = None) -> Request:
+    def body(n: int) -> dict:
+        return {"language": language, "code": _PROGRAMS[language].format(n=n % variants if variants else n)}
+
+    return Request(f"run_{language}", "POST", "/api/run", body, weight, _json_error("error", _RUN_FAILURES))
+
+
+def _explain_repeat(n: int) -> dict:
+    return {
+        "language": "python",
+        "code": "print(count)\n",
+        "error": "NameError: name 'count' is not defined",
+    }
+
+
+def _explain_fresh(n: int) -> dict:
+    return {
+        "language": "python",
+        "code": f"def average(values):\n    return sum(values) / len(values)\n\nprint(average(items_{n}))\n",
+        "error": f"Traceback (most recent call last):\n  File \"main.py\", line 4, in <module>\n"
+                 f"TypeError: unsupported operand type(s) for /: 'int' and 'list_{n}'",
+    }
+
+
+def _tutor(n: int) -> dict:
+    topics = ("recursion", "for loops", "pointers", "classes", "exceptions", "closures")
+    return {"message": f"Can you explain {topics[n % len(topics)]} with a short example? (#{n})", "language": "python"}
+
+
+def _report(n: int) -> dict:
+    return {
+        "language": "python",
+        "user_code": f"print(count_{n})\n",
+        "execution_error": f"NameError: name 'count_{n}' is not defined",
+        "ai_explanation": "The variable is used before it is assigned, so Python cannot find it.",
+        "learning_tip": "Assign every name before reading it.",
+        "fixed_code": f"count_{n} = 0\nprint(count_{n})\n",
+        "gamified_questions": ["What does NameError mean?", "How would you fix it?"],
+    }
+
+
+def _report_check(status: int, content: bytes, media_type: str) -> str | None:
+    return None if content else "empty report"
+
+
+SCENARIOS: dict[str, list[Request]] = {
+    # Roughly the traffic of a class working through exercises
+    "classroom": [
+        _run("python", 30),
+        _run("javascript", 10),
+        _run("java", 10, _COMPILED_VARIANTS),
+        _run("c", 5, _COMPILED_VARIANTS),
+        Request("explain_repeat", "POST", "/api/explain", _explain_repeat, 10, _EXPLAIN_CHECK),
+        Request("explain_fresh", "POST", "/api/explain", _explain_fresh, 15, _EXPLAIN_CHECK),
+        Request("tutor", "POST", "/api/tutor", _tutor, 15, _TUTOR_CHECK),
+        Request("report_download", "POST", "/api/report/download", _report, 5, _report_check),
+    ],
+    # Sandbox only, one new program per request in every language
+    "run": [
+        _run("python", 1),
+        _run("javascript", 1),
+        _run("java", 1),
+        _run("c", 1),
+    ],
+    # LLM paths only, all going upstream
+    "llm": [
+        Request("explain_fresh", "POST", "/api/explain", _explain_fresh, 2, _EXPLAIN_CHECK),
+        Request("tutor", "POST", "/api/tutor", _tutor, 1, _TUTOR_CHECK),
+    ],
+    "report": [
+        Request("report_download", "POST", "/api/report/download", _report, 1, _report_check),
+    ],
+}
@@ -0,0 +1,130 @@
+"""
+Cold-start benchmark for the backend.
+
+Measures, over several fresh processes:
+- import: seconds to `import main` in a new interpreter
+- ready: seconds from launching uvicorn until /api/health answers 200
+
+and lists the slowest imports from `python -X importtime`, so it is clear
+what a new worker pays for before it can take traffic.
+
+    python -m bench.startup --runs 5 -o startup.json
+    python -m bench.startup --env CODESNAP_WARMUP=all
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+
+_IMPORT_MAIN = "import time; t = time.perf_counter(); import main; print(time.perf_counter() - t)"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def measure_import(env: dict) -> float:
+    result = subprocess.run(
+        [sys.executable, "-c", _IMPORT_MAIN], cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+
+def measure_ready(env: dict, timeout: float) -> float:
+    port = _free_port()
+    url = f"http://127.0.0.1:{port}/api/health"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        while time.perf_counter() - started < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f"uvicorn exited with {server.returncode}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - started
+            except (urllib.error.URLError, ConnectionError):
+                pass
+            time.sleep(0.005)
+        raise RuntimeError(f"/api/health not ready after {timeout:g}s")
+    finally:
+        server.terminate()
+        try:
+            server.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            server.kill()
+
+
+def slowest_imports(env: dict, top: int) -> list[dict]:
+    """Top-level packages by total import time of their modules, from -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import main"],
+        cwd=BACKEND_DIR, env=env, capture_output=True, text=True, check=True,
+    )
+    totals: dict[str, int] = {}
+    for line in result.stderr.splitlines():
+        # "import time: self [us] | cumulative | imported package"
+        if not line.startswith("import time:") or "imported package" in line:
+            continue
+        # Self times, so a package is not also charged for what it imports
+        own, _, name = line[len("import time:"):].split("|")
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + int(own)
+    ranked = sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+    return [{"package": package, "ms": round(us / 1000, 2)} for package, us in ranked]
+
+
+def _stats(samples: list[float]) -> dict:
+    return {
+        "runs": len(samples),
+        "min_ms": round(min(samples) * 1000, 2),
+        "median_ms": round(statistics.median(samples) * 1000, 2),
+        "max_ms": round(max(samples) * 1000, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30.0, help="seconds to wait for readiness")
+    parser.add_argument("--top", type=int, default=15, help="how many slow imports to list")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="extra environment")
+    parser.add_argument("-o", "--output", help="write the JSON result here (default: stdout)")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    for pair in args.env:
+        key, _, value = pair.partition("=")
+        env[key] = value
+
+    # One unmeasured run so .pyc files exist and the OS page cache is warm
+    measure_import(env)
+    result = {
+        "meta": {"python": sys.version.split()[0], "cpus": os.cpu_count(), "env": args.env},
+        "import": _stats([measure_import(env) for _ in range(args.runs)]),
+        "ready": _stats([measure_ready(env, args.timeout) for _ in range(args.runs)]),
+        "slowest_imports": slowest_imports(env, args.top),
+    }
+    text = json.dumps(result, indent=2)
+    if args.output:
+        Path(args.output).write_text(text + "\n", encoding="utf-8")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+"""
+Where /api/run executes submissions, chosen by CODESNAP_EXECUTION_BACKEND:
+
+    local   (default) in this process, through the engine (sandbox/runner.py)
+    memory  through an in-process broker and executor: the queueing, retry
+            and timeout behaviour of the broker on a single host
+    broker  on executor processes behind a standalone broker at
+            CODESNAP_BROKER_ADDRESS (see dispatch/broker.py)
+
+Every backend raises EngineBusy when a run cannot be admitted, so routes
+answer 503 the same way whichever one is configured.
+"""
+import asyncio
+import itertools
+import logging
+import os
+
+from dispatch.broker import BROKER_ADDRESS, JOB_TIMEOUT, MAX_ATTEMPTS, QUEUE_TIMEOUT, Broker
+from dispatch.executor import EXECUTOR_SLOTS, LANGUAGES, Executor
+from dispatch.protocol import encode_message, open_connection, read_message
+from models.schemas import RunResponse
+from sandbox import runner
+from sandbox.engine import EngineBusy
+
+EXECUTION_BACKEND = os.getenv("CODESNAP_EXECUTION_BACKEND", "local")
+# How long to wait for a reply from a standalone broker before giving up
+REPLY_TIMEOUT = QUEUE_TIMEOUT + JOB_TIMEOUT * MAX_ATTEMPTS + 5
+
+logger = logging.getLogger(__name__)
+
+
+class LocalBackend:
+    name = "local"
+
+    async def run(self, language: str, code: str) -> RunResponse:
+        return await runner.execute(language, code)
+
+    def stats(self) -> dict:
+        return {"backend": self.name}
+
+    async def close(self):
+        pass
+
+
+class MemoryBackend:
+    name = "memory"
+
+    def __init__(self, slots: int = EXECUTOR_SLOTS):
+        self.broker = Broker()
+        self.executor = Executor(lambda message: self.broker.receive(self.link, message))
+        self.link = self.broker.attach("local", slots, LANGUAGES, self.executor.receive, heartbeats=False)
+
+    async def run(self, language: str, code: str) -> RunResponse:
+        return RunResponse(**await self.broker.submit(language, code))
+
+    def stats(self) -> dict:
+        return {"backend": self.name, **self.broker.stats()}
+
+    async def close(self):
+        self.executor.cancel()
+        self.broker.close()
+
+
+class RemoteBackend:
+    """Client of a standalone broker; one connection carries every pending run."""
+
+    name = "broker"
+
+    def __init__(self, address: str = BROKER_ADDRESS):
+        self.address = address
+        self.submitted = 0
+        self.unavailable = 0
+        # Connections to the broker that broke, and why the last one did
+        self.connection_failures = 0
+        self.connection_error: str | None = None
+        self._ids = itertools.count()
+        self._pending: dict[str, asyncio.Future] = {}
+        self._writer: asyncio.StreamWriter | None = None
+        self._reader_task: asyncio.Task | None = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _connection(self) -> asyncio.StreamWriter:
+        async with self._connect_lock:
+            if self._writer is None or self._writer.is_closing():
+                try:
+                    reader, writer = await asyncio.wait_for(open_connection(self.address), 5)
+                except (OSError, asyncio.TimeoutError) as e:
+                    self.unavailable += 1
+                    raise EngineBusy(f"Run broker unavailable: {e}")
+                writer.write(encode_message({"type": "hello", "role": "client"}))
+                self._writer = writer
+                self._reader_task = asyncio.ensure_future(self._read_replies(reader, writer))
+            return self._writer
+
+    async def _read_replies(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while (message := await read_message(reader)) is not None:
+                future = self._pending.pop(str(message.get("id")), None)
+                if future is None or future.done():
+                    continue
+                if message.get("type") == "result":
+                    future.set_result(message.get("result") or {})
+                else:
+                    future.set_exception(EngineBusy(message.get("error") or "Run broker is busy"))
+        except (OSError, ValueError) as e:
+            self.connection_failures += 1
+            self.connection_error = repr(e)
+            logger.warning("Run broker connection to %s failed: %s", self.address, e)
+        finally:
+            writer.close()
+            if self._writer is writer:
+                self._writer = None
+            # The broker dropped these jobs along with the connection
+            for future in self._pending.values():
+                if not future.done():
+                    future.set_exception(EngineBusy("Lost the connection to the run broker"))
+            self._pending.clear()
+
+    async def run(self, language: str, code: str) -> RunResponse:
+        writer = await self._connection()
+        job_id = str(next(self._ids))
+        future = asyncio.get_running_loop().create_future()
+        self._pending[job_id] = future
+        self.submitted += 1
+        try:
+            writer.write(encode_message({"type": "submit", "id": job_id, "language": language, "code": code}))
+            await writer.drain()
+            return RunResponse(**await asyncio.wait_for(future, REPLY_TIMEOUT))
+        except (OSError, asyncio.TimeoutError) as e:
+            self.unavailable += 1
+            raise EngineBusy(f"Run broker unavailable: {str(e) or 'no reply'}")
+        finally:
+            self._pending.pop(job_id, None)
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "address": self.address,
+            "connected": self._writer is not None and not self._writer.is_closing(),
+            "pending": len(self._pending),
+            "submitted": self.submitted,
+            "unavailable": self.unavailable,
+            "connection_failures": self.connection_failures,
+            "connection_error": self.connection_error,
+        }
+
+    async def close(self):
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+
+
+_BACKENDS = {"local": LocalBackend, "memory": MemoryBackend, "broker": RemoteBackend}
+_backend = None
+
+
+def get_execution_backend():
+    """The configured backend, created on first use."""
+    global _backend
+    if _backend is None:
+        factory = _BACKENDS.get(EXECUTION_BACKEND)
+        if factory is None:
+            logger.warning("Unknown execution backend %r, running locally", EXECUTION_BACKEND)
+            factory = LocalBackend
+        _backend = factory()
+    return _backend
+
+
+async def shutdown_execution_backend():
+    global _backend
+    if _backend is not None:
+        await _backend.close()
+        _backend = None
+
+
+def execution_backend_stats() -> dict:
+    if _backend is None:
+        return {"backend": EXECUTION_BACKEND}
+    return _backend.stats()
@@ -0,0 +1,352 @@
+"""
+Job broker between the API and executor processes for /api/run.
+
+API processes submit a (language, code) job and wait for its RunResponse.
+Executors connect, say how many jobs they run at once (their slots) and for
+which languages, and are handed queued jobs while they have a free slot, so
+work is pulled by capacity rather than pushed to a fixed host. A slot is
+only freed by the executor's reply, so a job taken back from a slow
+executor does not let the broker overload it.
+
+Executors send a heartbeat every CODESNAP_BROKER_HEARTBEAT_INTERVAL; one
+silent for CODESNAP_BROKER_HEARTBEAT_TIMEOUT, or whose connection drops, is
+considered lost and its jobs go back to the front of the queue. A job that
+got no reply within CODESNAP_BROKER_JOB_TIMEOUT (plus the heartbeat timeout
+as grace) is taken back the same way. Each job is dispatched at most
+CODESNAP_BROKER_MAX_ATTEMPTS times before it fails with an error, so a
+submission that keeps killing executors cannot take them all down.
+
+Admission is bounded like the local engine: with CODESNAP_BROKER_MAX_QUEUE
+jobs waiting, or when no executor picks a job up within
+CODESNAP_BROKER_QUEUE_TIMEOUT, submit raises EngineBusy (503 on the API).
+
+Runs in the API process (CODESNAP_EXECUTION_BACKEND=memory) or standalone:
+
+    python -m dispatch.broker --listen 127.0.0.1:8765
+    python -m dispatch.executor --broker 127.0.0.1:8765
+    CODESNAP_EXECUTION_BACKEND=broker CODESNAP_BROKER_ADDRESS=127.0.0.1:8765 uvicorn main:app
+"""
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import time
+from collections import deque
+from dataclasses import dataclass
+
+from dispatch.protocol import encode_message, read_message, start_server
+from sandbox.engine import EngineBusy
+
+BROKER_ADDRESS = os.getenv("CODESNAP_BROKER_ADDRESS", "127.0.0.1:8765")
+MAX_QUEUE = int(os.getenv("CODESNAP_BROKER_MAX_QUEUE", "256"))
+QUEUE_TIMEOUT = float(os.getenv("CODESNAP_BROKER_QUEUE_TIMEOUT", "10"))
+JOB_TIMEOUT = float(os.getenv("CODESNAP_BROKER_JOB_TIMEOUT", "30"))
+HEARTBEAT_INTERVAL = float(os.getenv("CODESNAP_BROKER_HEARTBEAT_INTERVAL", "2"))
+HEARTBEAT_TIMEOUT = float(os.getenv("CODESNAP_BROKER_HEARTBEAT_TIMEOUT", "10"))
+MAX_ATTEMPTS = int(os.getenv("CODESNAP_BROKER_MAX_ATTEMPTS", "3"))
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    language: str
+    code: str
+    future: asyncio.Future
+    # Monotonic time after which a queued job is turned away
+    queue_deadline: float
+    attempts: int = 0
+    # Monotonic time by which the current attempt must have replied
+    lease: float = 0.0
+
+
+class WorkerLink:
+    """The broker's view of one executor. send() must not block."""
+
+    def __init__(self, name: str, slots: int, languages: list[str], send, close=None, heartbeats: bool = True):
+        self.name = name
+        self.slots = max(1, slots)
+        self.languages = set(languages)
+        self.send = send
+        self.close = close
+        # In-process executors do not send heartbeats
+        self.heartbeats = heartbeats
+        # Jobs sent without a reply yet, including ones taken back since
+        self.busy = 0
+        self.jobs: dict[str, Job] = {}
+        self.last_seen = time.monotonic()
+
+
+class Broker:
+    def __init__(self, max_queue: int = MAX_QUEUE, queue_timeout: float = QUEUE_TIMEOUT,
+                 job_timeout: float = JOB_TIMEOUT, heartbeat_timeout: float = HEARTBEAT_TIMEOUT,
+                 max_attempts: int = MAX_ATTEMPTS):
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.job_timeout = job_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.max_attempts = max(1, max_attempts)
+        self.submitted = 0
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        self.rejected = 0
+        self.lost_executors = 0
+        self._queue: deque[Job] = deque()
+        self._links: list[WorkerLink] = []
+        self._ids = itertools.count()
+        self._monitor: asyncio.Task | None = None
+
+    async def submit(self, language: str, code: str) -> dict:
+        """Queue one job and wait for its result (a RunResponse as a dict)."""
+        if self._monitor is None:
+            self._monitor = asyncio.ensure_future(self._monitor_loop())
+        if len(self._queue) >= self.max_queue:
+            self.rejected += 1
+            raise EngineBusy("Too many runs in progress, please retry shortly")
+        job = Job(
+            str(next(self._ids)), language, code,
+            asyncio.get_running_loop().create_future(),
+            time.monotonic() + self.queue_timeout,
+        )
+        self.submitted += 1
+        self._queue.append(job)
+        self._dispatch()
+        # A cancelled caller cancels the future; the job is then skipped or its result dropped
+        return await job.future
+
+    def attach(self, name: str, slots: int, languages: list[str], send, close=None,
+               heartbeats: bool = True) -> WorkerLink:
+        link = WorkerLink(name, slots, languages, send, close, heartbeats)
+        self._links.append(link)
+        self._dispatch()
+        return link
+
+    def detach(self, link: WorkerLink, reason: str = "executor lost"):
+        if link not in self._links:
+            return
+        self._links.remove(link)
+        jobs = list(link.jobs.values())
+        link.jobs.clear()
+        for job in reversed(jobs):
+            self._requeue(job, reason)
+        self._dispatch()
+
+    def receive(self, link: WorkerLink, message: dict):
+        """A message from an executor."""
+        link.last_seen = time.monotonic()
+        kind = message.get("type")
+        if kind not in ("result", "busy"):
+            return
+        link.busy = max(0, link.busy - 1)
+        job = link.jobs.pop(str(message.get("id")), None)
+        if job is not None and not job.future.done():
+            if kind == "result":
+                self.completed += 1
+                job.future.set_result(message.get("result") or {})
+            elif job.attempts >= self.max_attempts:
+                self.rejected += 1
+                job.future.set_exception(EngineBusy("Too many runs in progress, please retry shortly"))
+            else:
+                self._requeue(job, "executor busy")
+        self._dispatch()
+
+    def _pick(self, language: str) -> WorkerLink | None:
+        free = [link for link in self._links if link.busy < link.slots and language in link.languages]
+        return min(free, key=lambda link: link.busy / link.slots) if free else None
+
+    def _dispatch(self):
+        waiting = deque()
+        while self._queue:
+            job = self._queue.popleft()
+            if job.future.done():
+                continue
+            link = self._pick(job.language)
+            if link is None:
+                waiting.append(job)
+                continue
+            job.attempts += 1
+            job.lease = time.monotonic() + self.job_timeout + self.heartbeat_timeout
+            link.jobs[job.id] = job
+            link.busy += 1
+            try:
+                link.send({"type": "job", "id": job.id, "language": job.language, "code": job.code,
+                           "timeout": self.job_timeout})
+            except (OSError, RuntimeError):
+                # Jobs queued behind this one are still in self._queue and are
+                # dispatched by the detach below
+                self._queue.extendleft(reversed(waiting))
+                self.lose(link, "executor connection failed")
+                return
+        self._queue = waiting
+
+    def _requeue(self, job: Job, reason: str):
+        if job.future.done():
+            return
+        if job.attempts >= self.max_attempts:
+            self.failed += 1
+            job.future.set_result({"error": f"Execution failed: {reason} ({job.attempts} attempts)"})
+            return
+        self.retried += 1
+        # Retried jobs go first and get a fresh queue budget
+        job.queue_deadline = time.monotonic() + self.queue_timeout
+        self._queue.appendleft(job)
+
+    def lose(self, link: WorkerLink, reason: str):
+        if link not in self._links:
+            return
+        self.lost_executors += 1
+        logger.warning("Run executor %s lost: %s", link.name, reason)
+        if link.close is not None:
+            link.close()
+        self.detach(link, reason)
+
+    async def _monitor_loop(self):
+        while True:
+            await asyncio.sleep(min(1.0, self.heartbeat_timeout / 2))
+            self.check()
+
+    def check(self):
+        """Drop silent executors, take back overdue jobs and expire queued ones."""
+        now = time.monotonic()
+        for link in list(self._links):
+            if link.heartbeats and now - link.last_seen > self.heartbeat_timeout:
+                self.lose(link, "no heartbeat")
+                continue
+            for job in [job for job in link.jobs.values() if job.lease < now]:
+                # The slot stays taken until the executor replies
+                del link.jobs[job.id]
+                self._requeue(job, "executor did not reply in time")
+        waiting = deque()
+        for job in self._queue:
+            if job.future.done():
+                continue
+            if job.queue_deadline < now:
+                self.rejected += 1
+                job.future.set_exception(EngineBusy("Timed out waiting for a free executor"))
+            else:
+                waiting.append(job)
+        self._queue = waiting
+        self._dispatch()
+
+    def stats(self) -> dict:
+        return {
+            "executors": len(self._links),
+            "slots": sum(link.slots for link in self._links),
+            "queued": len(self._queue),
+            "running": sum(len(link.jobs) for link in self._links),
+            "submitted": self.submitted,
+            "completed": self.completed,
+            "retried": self.retried,
+            "failed": self.failed,
+            "rejected": self.rejected,
+            "lost_executors": self.lost_executors,
+        }
+
+    def close(self):
+        if self._monitor is not None:
+            self._monitor.cancel()
+            self._monitor = None
+        for job in self._queue:
+            if not job.future.done():
+                job.future.set_exception(EngineBusy("Run broker is shutting down"))
+        self._queue.clear()
+        for link in list(self._links):
+            self._links.remove(link)
+            for job in link.jobs.values():
+                if not job.future.done():
+                    job.future.set_exception(EngineBusy("Run broker is shutting down"))
+            if link.close is not None:
+                link.close()
+
+
+class BrokerServer:
+    """Serves a Broker to executors and API processes over a socket."""
+
+    def __init__(self, broker: Broker):
+        self.broker = broker
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        def send(message: dict):
+            if writer.is_closing():
+                raise ConnectionResetError("connection closed")
+            writer.write(encode_message(message))
+
+        try:
+            hello = await read_message(reader)
+            if hello is None or hello.get("type") != "hello":
+                return
+            if hello.get("role") == "executor":
+                await self._serve_executor(hello, reader, writer, send)
+            elif hello.get("role") == "client":
+                await self._serve_client(reader, send)
+        except (OSError, ValueError) as e:
+            logger.warning("Run broker connection failed: %s", e)
+        finally:
+            writer.close()
+
+    async def _serve_executor(self, hello: dict, reader, writer, send):
+        link = self.broker.attach(
+            str(hello.get("name") or writer.get_extra_info("peername") or "executor"),
+            int(hello.get("slots") or 1),
+            list(hello.get("languages") or []),
+            send,
+            writer.close,
+        )
+        try:
+            while (message := await read_message(reader)) is not None:
+                self.broker.receive(link, message)
+        finally:
+            self.broker.lose(link, "connection closed")
+
+    async def _serve_client(self, reader, send):
+        tasks: set[asyncio.Task] = set()
+
+        async def run(message: dict):
+            try:
+                result = await self.broker.submit(message["language"], message["code"])
+                reply = {"type": "result", "id": message["id"], "result": result}
+            except EngineBusy as e:
+                reply = {"type": "busy", "id": message["id"], "error": str(e)}
+            try:
+                send(reply)
+            except ConnectionResetError:
+                pass
+
+        try:
+            while (message := await read_message(reader)) is not None:
+                if message.get("type") == "submit":
+                    task = asyncio.ensure_future(run(message))
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
+        finally:
+            # The API process is gone; nobody is waiting for these results
+            for task in tasks:
+                task.cancel()
+
+
+async def serve(address: str):
+    broker = Broker()
+    server = await start_server(BrokerServer(broker).handle, address)
+    print(f"Run broker listening on {address}")
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        broker.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--listen", default=BROKER_ADDRESS, help="host:port, or a Unix socket path")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.listen))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
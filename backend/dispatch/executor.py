@@ -0,0 +1,131 @@
+"""
+Executor process for the run broker (see dispatch/broker.py).
+
+Connects to the broker, offers CODESNAP_EXECUTOR_SLOTS slots and runs the
+jobs it is handed with sandbox/runner.py, the same code the API uses for
+local runs, so each executor has its own engine, interpreter pools and
+workspaces. Heartbeats go out every CODESNAP_BROKER_HEARTBEAT_INTERVAL.
+If the connection drops, jobs still running are abandoned (the broker has
+already handed them to someone else) and it reconnects with backoff.
+
+    python -m dispatch.executor --broker 127.0.0.1:8765 --slots 8
+"""
+import argparse
+import asyncio
+import os
+import socket
+
+from dispatch.broker import BROKER_ADDRESS, HEARTBEAT_INTERVAL
+from dispatch.protocol import encode_message, open_connection, read_message
+from sandbox import runner
+from sandbox.engine import MAX_CONCURRENCY, EngineBusy
+from sandbox.workspaces import shutdown_workspace_pool
+
+EXECUTOR_SLOTS = int(os.getenv("CODESNAP_EXECUTOR_SLOTS", str(MAX_CONCURRENCY)))
+LANGUAGES = list(runner.MISSING_TOOLCHAIN)
+
+
+async def execute(language: str, code: str) -> dict:
+    return (await runner.execute(language, code)).model_dump()
+
+
+class Executor:
+    """Runs jobs from the broker; send() passes replies back and must not block."""
+
+    def __init__(self, send, execute=execute):
+        self.send = send
+        self.execute = execute
+        self._tasks: set[asyncio.Task] = set()
+
+    def receive(self, message: dict):
+        if message.get("type") == "job":
+            task = asyncio.ensure_future(self._run(message))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, job: dict):
+        timeout = float(job.get("timeout") or 30)
+        try:
+            result = await asyncio.wait_for(self.execute(job["language"], job["code"]), timeout)
+        except EngineBusy:
+            self._reply({"type": "busy", "id": job["id"]})
+            return
+        except asyncio.TimeoutError:
+            result = {"error": f"Execution timed out ({timeout:g} seconds)"}
+        except Exception as e:
+            result = {"error": f"Execution failed: {str(e)}"}
+        self._reply({"type": "result", "id": job["id"], "result": result})
+
+    def _reply(self, message: dict):
+        try:
+            self.send(message)
+        except (OSError, RuntimeError):
+            # The broker is gone and has requeued the job
+            pass
+
+    def cancel(self):
+        for task in list(self._tasks):
+            task.cancel()
+
+
+async def _heartbeat(writer: asyncio.StreamWriter):
+    while not writer.is_closing():
+        await asyncio.sleep(HEARTBEAT_INTERVAL)
+        writer.write(encode_message({"type": "heartbeat"}))
+        try:
+            await writer.drain()
+        except OSError:
+            # The read loop sees the same failure and reconnects
+            return
+
+
+async def _session(address: str, name: str, slots: int):
+    reader, writer = await open_connection(address)
+
+    def send(message: dict):
+        if writer.is_closing():
+            raise ConnectionResetError("connection closed")
+        writer.write(encode_message(message))
+
+    executor = Executor(send)
+    send({"type": "hello", "role": "executor", "name": name, "slots": slots, "languages": LANGUAGES})
+    heartbeat = asyncio.ensure_future(_heartbeat(writer))
+    print(f"Executor {name} connected to {address} with {slots} slots")
+    try:
+        while (message := await read_message(reader)) is not None:
+            executor.receive(message)
+    finally:
+        heartbeat.cancel()
+        executor.cancel()
+        writer.close()
+
+
+async def serve(address: str, name: str, slots: int):
+    delay = 0.5
+    while True:
+        try:
+            await _session(address, name, slots)
+            delay = 0.5
+            print(f"Executor {name}: broker closed the connection")
+        except (OSError, ValueError) as e:
+            print(f"Executor {name}: cannot reach broker at {address}: {e}")
+        await asyncio.sleep(delay)
+        delay = min(delay * 2, 10.0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--broker", default=BROKER_ADDRESS, help="host:port, or a Unix socket path")
+    parser.add_argument("--slots", type=int, default=EXECUTOR_SLOTS, help="jobs run at once")
+    parser.add_argument("--name", default=f"{socket.gethostname()}-{os.getpid()}")
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.broker, args.name, args.slots))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        shutdown_workspace_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Wire format between the run broker, its executors and API processes.
+
+Every message is a JSON object sent as a big-endian u32 length followed by
+its UTF-8 bytes. Addresses are "host:port" for TCP or a filesystem path
+(anything containing a "/") for a Unix socket.
+
+    executor -> broker:  hello {role: "executor", name, slots, languages}
+                         heartbeat
+                         result {id, result} | busy {id}
+    broker -> executor:  job {id, language, code, timeout}
+    client -> broker:    hello {role: "client"}
+                         submit {id, language, code}
+    broker -> client:    result {id, result} | busy {id, error}
+
+`result` is a RunResponse as a dict. An executor sends `busy` when its own
+engine turned the job away, and the broker hands the job to someone else;
+a client gets `busy` when the broker itself cannot take the job.
+"""
+import asyncio
+import json
+import os
+import stat
+import struct
+
+MAX_MESSAGE_BYTES = 16 * 1024 * 1024
+
+
+async def read_message(reader: asyncio.StreamReader) -> dict | None:
+    """The next message, or None once the peer has closed the connection."""
+    try:
+        (length,) = struct.unpack("!I", await reader.readexactly(4))
+        if length > MAX_MESSAGE_BYTES:
+            raise ValueError(f"message of {length} bytes exceeds the limit")
+        return json.loads(await reader.readexactly(length))
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def encode_message(message: dict) -> bytes:
+    data = json.dumps(message).encode("utf-8")
+    return struct.pack("!I", len(data)) + data
+
+
+async def write_message(writer: asyncio.StreamWriter, message: dict):
+    writer.write(encode_message(message))
+    await writer.drain()
+
+
+def _is_unix(address: str) -> bool:
+    return "/" in address
+
+
+async def open_connection(address: str) -> tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+    if _is_unix(address):
+        return await asyncio.open_unix_connection(address)
+    host, _, port = address.rpartition(":")
+    return await asyncio.open_connection(host or "127.0.0.1", int(port))
+
+
+async def start_server(handler, address: str) -> asyncio.AbstractServer:
+    if _is_unix(address):
+        # A socket left behind by a previous run would make bind fail
+        if os.path.exists(address) and stat.S_ISSOCK(os.stat(address).st_mode):
+            os.unlink(address)
+        return await asyncio.start_unix_server(handler, address)
+    host, _, port = address.rpartition(":")
+    return await asyncio.start_server(handler, host or "127.0.0.1", int(port))
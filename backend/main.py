@@ -1,3 +1,6 @@
+import asyncio
+import os
+import time
 from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
@@ -9,19 +12,76 @@ from routes.explain import router as explain_router
 from routes.tutor import router as tutor_router
 from routes.run import router as run_router
 from routes.report import router as report_router
+from routes.metrics import router as metrics_router
+from routes.analytics import router as analytics_router
+from routes.workspace import router as workspace_router
+from ai import groq_client
+from reports.pool import get_report_pool, shutdown_report_pool
+from reports.render import init_worker
+from monitoring.metrics import MetricsMiddleware
+from dispatch.backend import shutdown_execution_backend
+from sandbox import precheck
+from sandbox.python_pool import get_pool
+from sandbox.workspaces import get_workspace_pool, shutdown_workspace_pool
 
 
 load_dotenv(".env.local")
 
+# Heavy components load on first use. CODESNAP_WARMUP names the ones to
+# load right after startup instead (comma-separated, or "all"); it runs in
+# the background, so /api/health answers without waiting for it.
+WARMUP = os.getenv("CODESNAP_WARMUP", "")
+
+
+async def _warm_reports():
+    pool = get_report_pool()
+    if pool is None:
+        await asyncio.to_thread(init_worker)
+    else:
+        await pool.warm_up()
+
+
+WARMUP_HOOKS = {
+    "groq": lambda: asyncio.to_thread(groq_client.warm_up),
+    "reports": _warm_reports,
+    "python": lambda: asyncio.to_thread(get_pool),
+    "workspaces": lambda: asyncio.to_thread(get_workspace_pool),
+    "precheck": precheck.warm_up,
+}
+
+
+async def warm_up(names: list[str]):
+    for name in names:
+        hook = WARMUP_HOOKS.get(name)
+        if hook is None:
+            print(f"Unknown warm-up target: {name}")
+            continue
+        started = time.perf_counter()
+        try:
+            await hook()
+        except Exception as e:
+            print(f"Warm-up of {name} failed: {e}")
+            continue
+        print(f"Warmed up {name} in {(time.perf_counter() - started) * 1000:.0f} ms")
+
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Runs on startup
     print("=== REGISTERED ROUTES ===")
     for r in app.routes:
-        print(r.path, r.methods)
+        # WebSocket routes have no methods
+        print(r.path, getattr(r, "methods", None) or "WS")
+    names = list(WARMUP_HOOKS) if WARMUP.strip() == "all" else [n.strip() for n in WARMUP.split(",") if n.strip()]
+    warmup = asyncio.create_task(warm_up(names)) if names else None
     yield
-    # (optional) add shutdown logic here
+    if warmup is not None:
+        warmup.cancel()
+    await groq_client.aclose()
+    await precheck.shutdown_precheck()
+    await shutdown_execution_backend()
+    shutdown_report_pool()
+    shutdown_workspace_pool()
 
 
 app = FastAPI(title="CodeSnap API", version="0.1.0", lifespan=lifespan)
@@ -35,12 +95,17 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+# Outermost, so latency includes CORS handling
+app.add_middleware(MetricsMiddleware)
 
 # ✅ Register routes
 app.include_router(explain_router, prefix="/api")
 app.include_router(tutor_router, prefix="/api")
 app.include_router(run_router, prefix="/api")
 app.include_router(report_router, prefix="/api")
+app.include_router(metrics_router, prefix="/api")
+app.include_router(analytics_router, prefix="/api")
+app.include_router(workspace_router, prefix="/api")
 
 
 @app.get("/")
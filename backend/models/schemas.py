@@ -1,9 +1,33 @@
-from pydantic import BaseModel
+from datetime import datetime
+
+from pydantic import BaseModel, Field, model_validator
+
+
+def _require(model: BaseModel, field: str):
+    """
+    `field` or `<field>_hash` must be sent. Handlers fill the field from
+    the hash (storage.blobs.resolve_hashes); nothing is read here.
+    """
+    if getattr(model, f"{field}_hash") is None and field not in model.model_fields_set:
+        raise ValueError(f"{field} or {field}_hash is required")
+
 
 class ExplainRequest(BaseModel):
     language: str
-    code: str
+    code: str = ""
+    # Blob hash of the code (see /api/workspace), instead of the code itself
+    code_hash: str | None = None
     error: str | None = None
+    # Whose share of the upstream LLM this uses; the client address if unset
+    user_id: str | None = Field(default=None, max_length=128)
+    # Answer relative to the previous explain in this session, as issued by
+    # POST /api/explain/session (ai/explain_sessions.py)
+    session_id: str | None = Field(default=None, max_length=128)
+
+    @model_validator(mode="after")
+    def _require_code(self):
+        _require(self, "code")
+        return self
 
 class ExplainResponse(BaseModel):
     explanation: str
@@ -12,8 +36,129 @@ class ExplainResponse(BaseModel):
 
 class RunRequest(BaseModel):
     language: str
-    code: str
+    code: str = ""
+    # Blob hash of the code (see /api/workspace), instead of the code itself
+    code_hash: str | None = None
+
+    @model_validator(mode="after")
+    def _require_code(self):
+        _require(self, "code")
+        return self
 
 class RunResponse(BaseModel):
     output: str | None = None
-    error: str | None = None
\ No newline at end of file
+    error: str | None = None
+    # Position of a syntax error found before running (1-based)
+    error_line: int | None = None
+    error_column: int | None = None
+    cpu_time_ms: float | None = None
+    peak_memory_kb: int | None = None
+    truncated: bool = False
+
+class RunCase(BaseModel):
+    stdin: str | None = None
+    args: list[str] = []
+
+class RunBatchRequest(BaseModel):
+    language: str
+    code: str = ""
+    code_hash: str | None = None
+    cases: list[RunCase]
+
+    @model_validator(mode="after")
+    def _require_code(self):
+        _require(self, "code")
+        return self
+
+class RunCaseResult(BaseModel):
+    output: str | None = None
+    error: str | None = None
+    exit_code: int | None = None
+    wall_time_ms: float
+    cpu_time_ms: float | None = None
+    peak_memory_kb: int | None = None
+    truncated: bool = False
+
+class RunBatchResponse(BaseModel):
+    error: str | None = None
+    results: list[RunCaseResult] = []
+
+class ReportRequest(BaseModel):
+    language: str
+    user_code: str = ""
+    # Blob hashes (see /api/workspace) instead of user_code / fixed_code
+    user_code_hash: str | None = None
+    execution_output: str | None = None
+    execution_error: str | None = None
+    ai_explanation: str
+    learning_tip: str
+    fixed_code: str | None = None
+    fixed_code_hash: str | None = None
+    gamified_questions: list[str] = []
+
+    class Config:
+        allow_none = True
+
+    @model_validator(mode="after")
+    def _require_code(self):
+        _require(self, "user_code")
+        return self
+
+class BulkReportItem(ReportRequest):
+    # Used for the file name inside the archive, e.g. the student's name
+    name: str | None = None
+
+class ActivityEvent(BaseModel):
+    kind: str
+    # Defaults to the time the batch is received; naive times are UTC
+    ts: datetime | None = None
+    # Minutes for time_spent, 1/0 (correct or not) for quiz_answered
+    value: float = 0
+    data: dict | None = None
+
+class ActivityBatch(BaseModel):
+    user_id: str
+    class_id: str | None = None
+    # Set by the client so a retried batch is not counted twice
+    batch_id: str | None = None
+    events: list[ActivityEvent]
+
+class ActivityIngestResponse(BaseModel):
+    accepted: int
+    duplicate: bool = False
+    errors: list[str] = []
+
+class WorkspaceChange(BaseModel):
+    path: str
+    # The new content in full, as a blob the server already has (hash), or
+    # as line edits [start, end, text] against the blob `base`; `hash`, if
+    # given with edits, is checked against the result.
+    content: str | None = None
+    hash: str | None = None
+    base: str | None = None
+    edits: list[tuple[int, int, str]] | None = None
+    deleted: bool = False
+
+class WorkspaceSyncRequest(BaseModel):
+    user_id: str | None = None
+    # Returned by the sync that created the workspace; required to change it
+    write_token: str | None = Field(default=None, max_length=128)
+    name: str | None = None
+    # The version the changes were made against; 0 for a new workspace
+    base_version: int = 0
+    changes: list[WorkspaceChange] = []
+
+class WorkspaceManifest(BaseModel):
+    id: str
+    name: str
+    version: int
+    # Path -> blob hash
+    files: dict[str, str]
+
+class WorkspaceSyncResponse(WorkspaceManifest):
+    # Paths whose content the server does not have; resend them with content
+    missing: list[str] = []
+    # base_version was stale; nothing was applied and files is the current manifest
+    conflict: bool = False
+    # Only when this sync created the workspace; it is not shown again
+    write_token: str | None = None
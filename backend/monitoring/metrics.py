@@ -0,0 +1,206 @@
+"""
+Minimal Prometheus-style metrics, rendered in the text exposition format.
+
+Counters and histograms are updated inline and cost a dict lookup plus a
+few additions; all updates happen on the event loop thread (or in
+to_thread helpers whose rare races only skew a count). Queue depths, pool
+sizes and cache ratios that components already track are not duplicated:
+stats callbacks registered with register_stats() are read at scrape time.
+"""
+import bisect
+import time
+from contextlib import contextmanager
+from typing import Callable
+
+from starlette.routing import Match
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labelnames: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        _registry.append(self)
+
+    def _header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, labelnames=()):
+        super().__init__(name, help, labelnames)
+        self._values: dict[tuple, float] = {}
+
+    def inc(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_labels(self.labelnames, labels)} {value}")
+        return lines
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, *labels, amount: float = 1):
+        self._values[labels] = self._values.get(labels, 0) - amount
+
+    def set(self, value: float, *labels):
+        self._values[labels] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(buckets)
+        # labels -> [per-bucket counts..., +Inf count, sum]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels):
+        series = self._values.get(labels)
+        if series is None:
+            series = self._values[labels] = [0] * (len(self.buckets) + 2)
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, *labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, *labels)
+
+    def render(self) -> list[str]:
+        lines = self._header()
+        for labels, series in self._values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {series[-1]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+
+_registry: list[_Metric] = []
+_stats_sources: list[tuple[str, Callable[[], dict]]] = []
+
+
+def register_stats(prefix: str, source: Callable[[], dict]):
+    """Expose the numeric leaves of a stats() dict as gauges named prefix_key."""
+    _stats_sources.append((prefix, source))
+
+
+def _flatten(prefix: str, stats: dict, out: list[tuple[str, float]]):
+    for key, value in stats.items():
+        name = f"{prefix}_{key}"
+        if isinstance(value, dict):
+            _flatten(name, value, out)
+        elif isinstance(value, bool):
+            out.append((name, int(value)))
+        elif isinstance(value, (int, float)):
+            out.append((name, value))
+
+
+def render_metrics() -> str:
+    lines: list[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    for prefix, source in _stats_sources:
+        samples: list[tuple[str, float]] = []
+        try:
+            _flatten(prefix, source(), samples)
+        except Exception as e:
+            print(f"Metrics source {prefix} failed: {e}")
+            continue
+        for name, value in samples:
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# --- HTTP middleware -----------------------------------------------------------
+
+HTTP_REQUESTS = Counter(
+    "codesnap_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status")
+)
+HTTP_LATENCY = Histogram(
+    "codesnap_http_request_duration_seconds",
+    "Time from request start until the response body is complete.",
+    ("method", "route"),
+)
+HTTP_IN_FLIGHT = Gauge("codesnap_http_requests_in_flight", "Requests currently being handled.", ("route",))
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware (no BaseHTTPMiddleware task/queue overhead).
+    Routes are labelled by their path template so label cardinality stays
+    bounded; unknown paths are grouped as "unmatched".
+    """
+
+    def __init__(self, app):
+        self.app = app
+        self._routes: dict[str, str] = {}
+
+    def _route(self, scope) -> str:
+        path = scope["path"]
+        route = self._routes.get(path)
+        if route is not None:
+            return route
+        router = scope["app"].router
+        for candidate in router.routes:
+            match, child_scope = candidate.matches(scope)
+            if match is not Match.NONE:
+                route = getattr(candidate, "path", path)
+                if not child_scope.get("path_params") and len(self._routes) < 1024:
+                    self._routes[path] = route
+                return route
+        return "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        route = self._route(scope)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc(route)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            HTTP_IN_FLIGHT.dec(route)
+            HTTP_LATENCY.observe(time.perf_counter() - started, method, route)
+            HTTP_REQUESTS.inc(method, route, str(status))
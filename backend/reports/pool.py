@@ -0,0 +1,123 @@
+"""
+Process pool for report rendering.
+
+ReportLab layout is CPU-bound and holds the GIL, so rendering on the event
+loop (or in a thread) stalls every other request on the worker. Reports are
+rendered in a small pool of processes instead; each worker builds its PDF
+styles once at startup. Admission is bounded: once REPORT_WORKERS jobs are
+rendering and REPORT_MAX_QUEUE more are waiting, new jobs are rejected with
+ReportBusy rather than piling up.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from models.schemas import ReportRequest
+from reports.render import init_worker, render_report
+
+REPORT_WORKERS = int(os.getenv("CODESNAP_REPORT_WORKERS", str(min(4, os.cpu_count() or 1))))
+REPORT_MAX_QUEUE = int(os.getenv("CODESNAP_REPORT_MAX_QUEUE", "32"))
+
+
+class ReportBusy(Exception):
+    """Raised when the render queue is full; routes map it to 503."""
+
+
+class ReportPool:
+    def __init__(self, workers: int = REPORT_WORKERS, max_queue: int = REPORT_MAX_QUEUE):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.pending = 0
+        self.rendered = 0
+        self.rejected = 0
+        self._executor = self._start()
+
+    def _start(self) -> ProcessPoolExecutor:
+        # forkserver: workers do not inherit the server's threads and sockets
+        method = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context(method),
+            initializer=init_worker,
+        )
+
+    def check(self, jobs: int = 1):
+        """Raise ReportBusy unless there is room for `jobs` renders; reserves nothing."""
+        if self.pending + jobs > self.workers + self.max_queue:
+            self.rejected += 1
+            raise ReportBusy("Report renderer is busy, try again shortly")
+
+    def admit(self, jobs: int = 1):
+        """Reserve room for `jobs` renders or raise ReportBusy."""
+        self.check(jobs)
+        self.pending += jobs
+
+    def release(self, jobs: int = 1):
+        self.pending -= jobs
+
+    async def submit(self, data: ReportRequest) -> tuple[bytes, str, str, float]:
+        """Render one admitted report in a worker process."""
+        loop = asyncio.get_running_loop()
+        try:
+            result = await loop.run_in_executor(self._executor, render_report, data)
+        except BrokenProcessPool:
+            # A worker died (OOM, segfault); start a fresh pool for later jobs.
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = self._start()
+            raise
+        self.rendered += 1
+        return result
+
+    async def render(self, data: ReportRequest) -> tuple[bytes, str, str, float]:
+        """Admit and render one report. Raises ReportBusy when the queue is full."""
+        self.admit()
+        try:
+            return await self.submit(data)
+        finally:
+            self.release()
+
+    async def warm_up(self):
+        """Start every worker now; init_worker doubles as a no-op job."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._executor, init_worker) for _ in range(self.workers)))
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "pending": self.pending,
+            "rendered": self.rendered,
+            "rejected": self.rejected,
+        }
+
+
+_pool: ReportPool | None = None
+
+
+def get_report_pool() -> ReportPool | None:
+    """Shared pool, created on first use. None when CODESNAP_REPORT_WORKERS is 0."""
+    global _pool
+    if REPORT_WORKERS <= 0:
+        return None
+    if _pool is None:
+        _pool = ReportPool()
+    return _pool
+
+
+def shutdown_report_pool():
+    """Stop the shared pool if one was ever started."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+def report_pool_stats() -> dict:
+    if _pool is None:
+        return {"enabled": REPORT_WORKERS > 0, "workers": REPORT_WORKERS, "pending": 0}
+    return {"enabled": True, **_pool.stats()}
@@ -0,0 +1,227 @@
+"""
+Report rendering, kept free of web imports so it can run in worker processes.
+
+PDF styles are built once per process (see init_worker) instead of once per
+report. ReportLab itself is imported by the first PDF render, not when this
+module loads, so web workers do not pay for it at startup.
+"""
+from datetime import datetime
+import importlib.util
+import io
+import logging
+import time
+
+from models.schemas import ReportRequest
+
+# Only locate the package here; a failed import later falls back to markdown
+REPORTLAB_AVAILABLE = importlib.util.find_spec("reportlab") is not None
+
+logger = logging.getLogger(__name__)
+
+_STYLES: dict | None = None
+
+# Seconds spent in ReportLab layout by the last generate_pdf_report call
+last_layout_seconds = 0.0
+
+
+def reportlab_available() -> bool:
+    return REPORTLAB_AVAILABLE
+
+
+def _build_styles() -> dict:
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
+    styles = getSampleStyleSheet()
+    return {
+        "title": ParagraphStyle(
+            'CustomTitle',
+            parent=styles['Heading1'],
+            fontSize=18,
+            spaceAfter=30,
+            alignment=1  # Center alignment
+        ),
+        "section": ParagraphStyle(
+            'Section',
+            parent=styles['Heading2'],
+            fontSize=14,
+            spaceAfter=12,
+            textColor='#2D3748'
+        ),
+        "code": ParagraphStyle(
+            'Code',
+            parent=styles['Normal'],
+            fontName='Courier',
+            fontSize=10,
+            leftIndent=20,
+            spaceAfter=12
+        ),
+        "content": styles['Normal'],
+    }
+
+
+def _styles() -> dict:
+    global _STYLES
+    if _STYLES is None:
+        _STYLES = _build_styles()
+    return _STYLES
+
+
+def init_worker():
+    """Process pool initializer: pay for the import and stylesheet before the first job."""
+    global REPORTLAB_AVAILABLE
+    if REPORTLAB_AVAILABLE:
+        try:
+            _styles()
+        except ImportError as e:
+            REPORTLAB_AVAILABLE = False
+            logger.warning("ReportLab not available, reports fall back to Markdown: %s", e)
+
+
+def generate_pdf_report(data: ReportRequest) -> bytes:
+    """Generate a PDF report using reportlab."""
+    global last_layout_seconds
+    from reportlab.lib.pagesizes import letter
+    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Preformatted
+    from reportlab.lib.units import inch
+
+    buffer = io.BytesIO()
+
+    # Create PDF document
+    doc = SimpleDocTemplate(buffer, pagesize=letter)
+    styles = _styles()
+    title_style = styles["title"]
+    section_style = styles["section"]
+    code_style = styles["code"]
+    content_style = styles["content"]
+
+    # Build the PDF content
+    story = []
+
+    # Title
+    story.append(Paragraph("CodeSnap Learning Report", title_style))
+    story.append(Spacer(1, 0.25*inch))
+
+    # Date & Time
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    story.append(Paragraph(f"<b>Date & Time:</b> {current_time}", content_style))
+    story.append(Spacer(1, 0.1*inch))
+
+    # Language
+    story.append(Paragraph(f"<b>Language:</b> {data.language.title()}", content_style))
+    story.append(Spacer(1, 0.2*inch))
+
+    # User Submitted Code
+    story.append(Paragraph("User Submitted Code", section_style))
+    story.append(Preformatted(data.user_code, code_style))
+    story.append(Spacer(1, 0.15*inch))
+
+    # Execution Result
+    story.append(Paragraph("Execution Result", section_style))
+    if data.execution_output:
+        story.append(Paragraph(f"<b>Output:</b>", content_style))
+        story.append(Preformatted(data.execution_output, code_style))
+    if data.execution_error:
+        story.append(Paragraph(f"<b>Error:</b>", content_style))
+        story.append(Preformatted(data.execution_error, code_style))
+    if not data.execution_output and not data.execution_error:
+        story.append(Paragraph("Code executed successfully with no output or errors.", content_style))
+    story.append(Spacer(1, 0.15*inch))
+
+    # AI Explanation
+    story.append(Paragraph("AI Explanation", section_style))
+    story.append(Paragraph(data.ai_explanation, content_style))
+    story.append(Spacer(1, 0.15*inch))
+
+    # Learning Tip
+    story.append(Paragraph("Learning Tip", section_style))
+    story.append(Paragraph(data.learning_tip, content_style))
+    story.append(Spacer(1, 0.15*inch))
+
+    # Fixed Code (if exists)
+    if data.fixed_code:
+        story.append(Paragraph("Fixed Code", section_style))
+        story.append(Preformatted(data.fixed_code, code_style))
+        story.append(Spacer(1, 0.15*inch))
+
+    # Practice Questions
+    if data.gamified_questions:
+        story.append(Paragraph("Practice Questions", section_style))
+        for i, question in enumerate(data.gamified_questions, 1):
+            story.append(Paragraph(f"{i}. {question}", content_style))
+            story.append(Spacer(1, 0.1*inch))
+
+    # Build PDF
+    started = time.perf_counter()
+    doc.build(story)
+    last_layout_seconds = time.perf_counter() - started
+    return buffer.getvalue()
+
+def generate_markdown_report(data: ReportRequest) -> str:
+    """Generate a Markdown report as fallback."""
+    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    markdown = f"""# CodeSnap Learning Report
+
+**Date & Time:** {current_time}
+**Language:** {data.language.title()}
+
+## User Submitted Code
+```python
+{data.user_code}
+```
+
+## Execution Result
+"""
+
+    if data.execution_output:
+        markdown += f"""**Output:**
+```
+{data.execution_output}
+```
+"""
+    if data.execution_error:
+        markdown += f"""**Error:**
+```
+{data.execution_error}
+```
+"""
+    if not data.execution_output and not data.execution_error:
+        markdown += "Code executed successfully with no output or errors.\n\n"
+
+    markdown += f"""## AI Explanation
+{data.ai_explanation}
+
+## Learning Tip
+{data.learning_tip}
+"""
+
+    if data.fixed_code:
+        markdown += f"""## Fixed Code
+```python
+{data.fixed_code}
+```
+"""
+
+    if data.gamified_questions:
+        markdown += """## Practice Questions
+"""
+        for i, question in enumerate(data.gamified_questions, 1):
+            markdown += f"{i}. {question}\n"
+
+    return markdown
+
+
+def render_report(data: ReportRequest) -> tuple[bytes, str, str, float]:
+    """
+    Render PDF when ReportLab is available, else Markdown.
+    Returns (body, media_type, extension, layout_seconds); layout time is
+    passed back because rendering usually happens in a worker process.
+    """
+    global REPORTLAB_AVAILABLE
+    if REPORTLAB_AVAILABLE:
+        try:
+            return generate_pdf_report(data), "application/pdf", "pdf", last_layout_seconds
+        except ImportError as e:
+            REPORTLAB_AVAILABLE = False
+            logger.warning("ReportLab not available, reports fall back to Markdown: %s", e)
+    return generate_markdown_report(data).encode("utf-8"), "text/markdown", "md", 0.0
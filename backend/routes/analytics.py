@@ -0,0 +1,128 @@
+import asyncio
+import os
+from datetime import datetime, timedelta, timezone
+
+from fastapi import APIRouter, HTTPException, Query
+
+from analytics.store import EVENT_KINDS, analytics_stats, get_analytics_store, period_starts
+from models.schemas import ActivityBatch, ActivityIngestResponse
+
+router = APIRouter()
+
+MAX_BATCH_EVENTS = int(os.getenv("CODESNAP_ANALYTICS_MAX_BATCH", "1000"))
+MAX_PERIODS = {"day": 366, "week": 104}
+
+
+@router.get("/analytics/stats")
+async def analytics_store_stats():
+    return analytics_stats()
+
+
+@router.post("/analytics/events", response_model=ActivityIngestResponse)
+async def ingest_events(batch: ActivityBatch):
+    """
+    Record a batch of activity events for one user.
+    Events with an unknown kind are skipped and listed in errors; the rest
+    are stored and rolled up together. A repeated batch_id is acknowledged
+    without being counted again.
+    """
+    if len(batch.events) > MAX_BATCH_EVENTS:
+        raise HTTPException(status_code=413, detail=f"At most {MAX_BATCH_EVENTS} events per batch")
+
+    now = datetime.now(timezone.utc).timestamp()
+    events = []
+    errors = []
+    for number, event in enumerate(batch.events, 1):
+        if event.kind not in EVENT_KINDS:
+            errors.append(f"#{number}: unknown kind {event.kind!r}")
+            continue
+        if event.ts is None:
+            ts = now
+        elif event.ts.tzinfo is None:
+            ts = event.ts.replace(tzinfo=timezone.utc).timestamp()
+        else:
+            ts = event.ts.timestamp()
+        events.append((event.kind, ts, event.value, event.data))
+
+    if not events:
+        return ActivityIngestResponse(accepted=0, errors=errors)
+    stored = await asyncio.to_thread(
+        get_analytics_store().ingest, batch.user_id, batch.class_id, events, batch.batch_id
+    )
+    return ActivityIngestResponse(accepted=len(events) if stored else 0, duplicate=not stored, errors=errors)
+
+
+def _periods(period: str, count: int) -> list[str]:
+    if period not in MAX_PERIODS:
+        raise HTTPException(status_code=400, detail="period must be 'day' or 'week'")
+    if count > MAX_PERIODS[period]:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_PERIODS[period]} {period}s")
+    return period_starts(period, count)
+
+
+def _summary(kinds: dict[str, tuple]) -> dict:
+    return {
+        "counts": {kind: kinds.get(kind, (0, 0))[0] for kind in EVENT_KINDS},
+        "values": {kind: value for kind, (_, value) in kinds.items() if value},
+    }
+
+
+def _buckets(rollups: dict[str, dict[str, tuple]], starts: list[str]) -> tuple[list[dict], dict]:
+    """Per-period summaries (zero-filled) and their totals."""
+    buckets = []
+    totals: dict[str, tuple] = {}
+    for start in starts:
+        kinds = rollups.get(start, {})
+        buckets.append({"start": start, **_summary(kinds)})
+        for kind, (count, value) in kinds.items():
+            total_count, total_value = totals.get(kind, (0, 0))
+            totals[kind] = (total_count + count, total_value + value)
+    return buckets, _summary(totals)
+
+
+def _streak(active: set[str]) -> int:
+    """Consecutive active days ending today; an idle today does not break it."""
+    day = datetime.now(timezone.utc).date()
+    if day.isoformat() not in active:
+        day -= timedelta(days=1)
+    streak = 0
+    while day.isoformat() in active:
+        streak += 1
+        day -= timedelta(days=1)
+    return streak
+
+
+@router.get("/analytics/users/{user_id}")
+async def user_summary(user_id: str, period: str = "day", count: int = Query(7, ge=1)):
+    """
+    Activity of one user over the last `count` days or weeks, read from
+    the precomputed rollups, plus the current learning streak.
+    """
+    starts = _periods(period, count)
+    store = get_analytics_store()
+    rollups = await asyncio.to_thread(store.rollups, "user", user_id, period, starts)
+    since = (datetime.now(timezone.utc).date() - timedelta(days=MAX_PERIODS["day"])).isoformat()
+    active = await asyncio.to_thread(store.active_days, user_id, since)
+    buckets, totals = _buckets(rollups, starts)
+    return {"user_id": user_id, "period": period, "totals": totals, "buckets": buckets, "streak": _streak(active)}
+
+
+@router.get("/analytics/classes/{class_id}")
+async def class_summary(class_id: str, period: str = "week", count: int = Query(4, ge=1)):
+    """
+    Instructor view: class-wide activity over the last `count` weeks or
+    days, and each member's totals over the same range.
+    """
+    starts = _periods(period, count)
+    store = get_analytics_store()
+    rollups = await asyncio.to_thread(store.rollups, "class", class_id, period, starts)
+    members = await asyncio.to_thread(store.members, class_id)
+    member_totals = await asyncio.to_thread(store.member_totals, class_id, period, starts)
+    buckets, totals = _buckets(rollups, starts)
+    return {
+        "class_id": class_id,
+        "period": period,
+        "totals": totals,
+        "buckets": buckets,
+        "members": [{"user_id": user_id, **_summary(member_totals.get(user_id, {}))} for user_id in members],
+    }
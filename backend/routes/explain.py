@@ -1,19 +1,79 @@
-from fastapi import APIRouter, Response
+import asyncio
+import json
 
-from ai.groq_client import explain_error
+from fastapi import APIRouter, HTTPException, Request, Response
+from fastapi.responses import StreamingResponse
+
+from ai.cache import explain_cache
+from ai.explain_sessions import UnknownSession, explain_sessions
+from ai.groq_client import ANONYMOUS, explain_error, explain_error_stream, scheduler, upstream_stats
+from ai.rules import explain_locally, rule_stats
 from models.schemas import ExplainRequest, ExplainResponse
+from storage.blobs import UnknownBlob, resolve_hashes
 
 router = APIRouter()
 
 
+def _requester(user_id: str | None, request: Request) -> str:
+    """Key for the upstream fair-share scheduler"""
+    return user_id or (request.client.host if request.client else ANONYMOUS)
+
+
+async def _resolve_code(req: ExplainRequest):
+    try:
+        await resolve_hashes(req, "code")
+    except UnknownBlob as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+
 @router.options("/explain", include_in_schema=False)
 async def explain_options() -> Response:
     # Empty 204 response for CORS preflight; CORSMiddleware will add headers.
     return Response(status_code=204)
 
 
+@router.get("/explain/stats")
+async def explain_stats():
+    """Local rule hits, cache effectiveness, explain sessions and upstream Groq usage for /explain and /tutor."""
+    return {
+        "rules": rule_stats(),
+        "cache": explain_cache.stats(),
+        "sessions": explain_sessions.stats(),
+        "upstream": upstream_stats(),
+    }
+
+
+def _unknown_session() -> HTTPException:
+    return HTTPException(status_code=404, detail="Unknown or expired explain session; open a new one")
+
+
+@router.post("/explain/session")
+async def open_explain_session():
+    """Start an explain session; send the returned session_id with each explain in it."""
+    return {"session_id": explain_sessions.open()}
+
+
+@router.delete("/explain/session/{session_id}")
+async def end_explain_session(session_id: str):
+    return {"deleted": explain_sessions.discard(session_id)}
+
+
+@router.get("/explain/queue")
+async def explain_queue(request: Request, user_id: str | None = None):
+    """
+    A user's calls waiting for the LLM, with their queue positions and
+    expected waits, and what a new explain or tutor call would face now.
+    """
+    user = _requester(user_id, request)
+    return {
+        "user": user,
+        "waiting": scheduler.queue(user),
+        "next": {priority: scheduler.estimate(user, priority) for priority in ("explain", "chat")},
+    }
+
+
 @router.post("/explain", response_model=ExplainResponse)
-def explain(req: ExplainRequest):
+async def explain(req: ExplainRequest, request: Request):
     """
     Explain a code error using Groq LLM.
     Response format is fixed for the frontend:
@@ -22,8 +82,22 @@ def explain(req: ExplainRequest):
       corrected_code: string,
       learning_tip: string
     }
+    Textbook errors are answered by the local rule library without the LLM.
+    With a session_id (from POST /explain/session), only what changed since
+    the session's previous submission is sent upstream; an unknown or
+    expired one is a 404.
     """
-    result = explain_error(req.language, req.code, req.error or "")
+    await _resolve_code(req)
+    user = _requester(req.user_id, request)
+    if req.session_id:
+        try:
+            result = await explain_sessions.explain(req.session_id, req.language, req.code, req.error or "", user)
+        except UnknownSession:
+            raise _unknown_session()
+    else:
+        result = await asyncio.to_thread(explain_locally, req.language, req.code, req.error or "")
+        if result is None:
+            result = await explain_error(req.language, req.code, req.error or "", user)
 
     # Ensure keys exist and keep response shape stable.
     return {
@@ -34,3 +108,47 @@ def explain(req: ExplainRequest):
             "Try to understand each change in the corrected code and why it fixes the error.",
         ),
     }
+
+
+@router.post("/explain/stream")
+async def explain_stream(req: ExplainRequest, request: Request):
+    """
+    Streaming variant of /explain using Server-Sent Events.
+    A "queued" event with {position, estimated_wait_ms} comes first when the
+    LLM is busy. "field" events carry {field, delta} text as the model
+    writes each part of the answer; the final "done" event carries the same
+    object /explain returns.
+    """
+    await _resolve_code(req)
+    user = _requester(req.user_id, request)
+    if req.session_id:
+        try:
+            explain_sessions.get(req.session_id)
+        except UnknownSession:
+            raise _unknown_session()
+
+    async def answer():
+        if req.session_id:
+            async for event in explain_sessions.explain_stream(
+                req.session_id, req.language, req.code, req.error or "", user
+            ):
+                yield event
+            return
+        local = await asyncio.to_thread(explain_locally, req.language, req.code, req.error or "")
+        if local is None:
+            async for event in explain_error_stream(req.language, req.code, req.error or "", user):
+                yield event
+            return
+        for field, text in local.items():
+            yield "field", {"field": field, "delta": text}
+        yield "done", local
+
+    async def events():
+        async for kind, data in answer():
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,43 @@
+from fastapi import APIRouter, Response
+
+from ai.cache import explain_cache
+from ai.explain_sessions import explain_sessions
+from analytics.store import analytics_stats
+from ai.groq_client import upstream_stats
+from ai.rules import rule_stats
+from dispatch.backend import execution_backend_stats
+from ai.sessions import tutor_sessions
+from monitoring.metrics import register_stats, render_metrics
+from reports.pool import report_pool_stats
+from sandbox.compile_cache import get_compile_cache
+from sandbox.engine import get_engine
+from sandbox.precheck import precheck_stats
+from sandbox.python_pool import pool_stats
+from sandbox.workspaces import workspace_pool_stats
+from storage.blobs import blob_store_stats
+from storage.workspaces import workspace_store_stats
+
+router = APIRouter()
+
+# Queue depths, pool sizes and cache ratios, read from each component at scrape time
+register_stats("codesnap_engine", lambda: get_engine().stats())
+register_stats("codesnap_python_pool", pool_stats)
+register_stats("codesnap_compile_cache", lambda: get_compile_cache().stats())
+register_stats("codesnap_workspaces", workspace_pool_stats)
+register_stats("codesnap_precheck", precheck_stats)
+register_stats("codesnap_execution_backend", execution_backend_stats)
+register_stats("codesnap_explain_cache", explain_cache.stats)
+register_stats("codesnap_explain_rules", rule_stats)
+register_stats("codesnap_explain_sessions", explain_sessions.stats)
+register_stats("codesnap_groq", upstream_stats)
+register_stats("codesnap_tutor", tutor_sessions.stats)
+register_stats("codesnap_report_pool", report_pool_stats)
+register_stats("codesnap_analytics", analytics_stats)
+register_stats("codesnap_workspace_store", workspace_store_stats)
+register_stats("codesnap_blob_store", blob_store_stats)
+
+
+@router.get("/metrics", include_in_schema=False)
+async def metrics() -> Response:
+    """Prometheus text exposition of all CodeSnap metrics."""
+    return Response(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
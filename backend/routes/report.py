@@ -1,231 +1,331 @@
-from fastapi import APIRouter, Response, HTTPException
+import asyncio
+import codecs
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+from fastapi import APIRouter, Request, Response, HTTPException
 from fastapi.responses import StreamingResponse
-from pydantic import BaseModel
 from datetime import datetime
-import io
-
-# Try to import reportlab for PDF generation, fallback to markdown
-try:
-    from reportlab.lib.pagesizes import letter
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Preformatted
-    from reportlab.lib.units import inch
-    REPORTLAB_AVAILABLE = True
-    print("ReportLab available: True")
-except ImportError as e:
-    REPORTLAB_AVAILABLE = False
-    print(f"ReportLab not available: {e}")
+from pydantic import ValidationError
+
+from models.schemas import BulkReportItem, ReportRequest
+from monitoring.metrics import Histogram
+from reports.pool import ReportBusy, get_report_pool, report_pool_stats
+from reports.render import reportlab_available, render_report
+# Re-exported: these used to live in this module
+from reports.render import generate_markdown_report, generate_pdf_report
+from storage.blobs import UnknownBlob, resolve_hashes
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-class ReportRequest(BaseModel):
-    language: str
-    user_code: str
-    execution_output: str | None = None
-    execution_error: str | None = None
-    ai_explanation: str
-    learning_tip: str
-    fixed_code: str | None = None
-    gamified_questions: list[str] = []
+MAX_BULK_REPORTS = int(os.getenv("CODESNAP_REPORT_MAX_BULK", "5000"))
+MAX_BULK_ITEM_BYTES = int(os.getenv("CODESNAP_REPORT_MAX_BULK_ITEM_BYTES", str(4 * 1024 * 1024)))
+# Spooled reports move from memory to a temporary file past this size
+SPOOL_MEMORY_BYTES = 1024 * 1024
 
-    class Config:
-        allow_none = True
+REPORT_LAYOUT = Histogram("codesnap_report_layout_seconds", "ReportLab layout time per report.")
+REPORT_RENDER = Histogram(
+    "codesnap_report_render_seconds", "Render time per report including pool queueing.", ("format",)
+)
 
 @router.options("/report/download", include_in_schema=False)
 async def report_options() -> Response:
     # Empty 204 response for CORS preflight; CORSMiddleware will add headers.
     return Response(status_code=204)
 
-def generate_pdf_report(data: ReportRequest) -> bytes:
-    """Generate a PDF report using reportlab."""
-    try:
-        buffer = io.BytesIO()
-
-        # Create PDF document
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        styles = getSampleStyleSheet()
-
-        # Custom styles
-        title_style = ParagraphStyle(
-            'CustomTitle',
-            parent=styles['Heading1'],
-            fontSize=18,
-            spaceAfter=30,
-            alignment=1  # Center alignment
-        )
+@router.get("/report/stats")
+async def report_stats():
+    return {"reportlab": reportlab_available(), "pool": report_pool_stats()}
 
-        section_style = ParagraphStyle(
-            'Section',
-            parent=styles['Heading2'],
-            fontSize=14,
-            spaceAfter=12,
-            textColor='#2D3748'
-        )
 
-        code_style = ParagraphStyle(
-            'Code',
-            parent=styles['Normal'],
-            fontName='Courier',
-            fontSize=10,
-            leftIndent=20,
-            spaceAfter=12
-        )
-
-        content_style = styles['Normal']
-
-        # Build the PDF content
-        story = []
-
-        # Title
-        story.append(Paragraph("CodeSnap Learning Report", title_style))
-        story.append(Spacer(1, 0.25*inch))
-
-        # Date & Time
-        current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        story.append(Paragraph(f"<b>Date & Time:</b> {current_time}", content_style))
-        story.append(Spacer(1, 0.1*inch))
-
-        # Language
-        story.append(Paragraph(f"<b>Language:</b> {data.language.title()}", content_style))
-        story.append(Spacer(1, 0.2*inch))
-
-        # User Submitted Code
-        story.append(Paragraph("User Submitted Code", section_style))
-        story.append(Preformatted(data.user_code, code_style))
-        story.append(Spacer(1, 0.15*inch))
-
-        # Execution Result
-        story.append(Paragraph("Execution Result", section_style))
-        if data.execution_output:
-            story.append(Paragraph(f"<b>Output:</b>", content_style))
-            story.append(Preformatted(data.execution_output, code_style))
-        if data.execution_error:
-            story.append(Paragraph(f"<b>Error:</b>", content_style))
-            story.append(Preformatted(data.execution_error, code_style))
-        if not data.execution_output and not data.execution_error:
-            story.append(Paragraph("Code executed successfully with no output or errors.", content_style))
-        story.append(Spacer(1, 0.15*inch))
-
-        # AI Explanation
-        story.append(Paragraph("AI Explanation", section_style))
-        story.append(Paragraph(data.ai_explanation, content_style))
-        story.append(Spacer(1, 0.15*inch))
-
-        # Learning Tip
-        story.append(Paragraph("Learning Tip", section_style))
-        story.append(Paragraph(data.learning_tip, content_style))
-        story.append(Spacer(1, 0.15*inch))
-
-        # Fixed Code (if exists)
-        if data.fixed_code:
-            story.append(Paragraph("Fixed Code", section_style))
-            story.append(Preformatted(data.fixed_code, code_style))
-            story.append(Spacer(1, 0.15*inch))
-
-        # Practice Questions
-        if data.gamified_questions:
-            story.append(Paragraph("Practice Questions", section_style))
-            for i, question in enumerate(data.gamified_questions, 1):
-                story.append(Paragraph(f"{i}. {question}", content_style))
-                story.append(Spacer(1, 0.1*inch))
-
-        # Build PDF
-        doc.build(story)
-        buffer.seek(0)
-        return buffer.getvalue()
-    except Exception as e:
-        print(f"Error generating PDF: {e}")
-        raise
+async def _render(data: ReportRequest, pool_admitted: bool = False) -> tuple[bytes, str, str]:
+    pool = get_report_pool()
+    started = time.perf_counter()
+    if pool is None:
+        content, media_type, extension, layout = await asyncio.to_thread(render_report, data)
+    elif pool_admitted:
+        content, media_type, extension, layout = await pool.submit(data)
+    else:
+        content, media_type, extension, layout = await pool.render(data)
+    REPORT_RENDER.observe(time.perf_counter() - started, extension)
+    if layout:
+        REPORT_LAYOUT.observe(layout)
+    return content, media_type, extension
 
-def generate_markdown_report(data: ReportRequest) -> str:
-    """Generate a Markdown report as fallback."""
-    current_time = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
-    markdown = f"""# CodeSnap Learning Report
-
-**Date & Time:** {current_time}
-**Language:** {data.language.title()}
-
-## User Submitted Code
-```python
-{data.user_code}
-```
-
-## Execution Result
-"""
-
-    if data.execution_output:
-        markdown += f"""**Output:**
-```
-{data.execution_output}
-```
-"""
-    if data.execution_error:
-        markdown += f"""**Error:**
-```
-{data.execution_error}
-```
-"""
-    if not data.execution_output and not data.execution_error:
-        markdown += "Code executed successfully with no output or errors.\n\n"
-
-    markdown += f"""## AI Explanation
-{data.ai_explanation}
-
-## Learning Tip
-{data.learning_tip}
-"""
-
-    if data.fixed_code:
-        markdown += f"""## Fixed Code
-```python
-{data.fixed_code}
-```
-"""
-
-    if data.gamified_questions:
-        markdown += """## Practice Questions
-"""
-        for i, question in enumerate(data.gamified_questions, 1):
-            markdown += f"{i}. {question}\n"
-
-    return markdown
 
 @router.post("/report/download")
 async def download_report(data: ReportRequest):
     """
     Generate and download a learning report as PDF or Markdown.
     """
+    try:
+        await resolve_hashes(data, "user_code", "fixed_code")
+    except UnknownBlob as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
     try:
         # Generate timestamp for filename
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         filename = f"codesnap_report_{timestamp}"
 
-        if REPORTLAB_AVAILABLE:
-            # Generate PDF report
-            print("Generating PDF report...")
-            pdf_content = generate_pdf_report(data)
-            print(f"PDF generated, size: {len(pdf_content)} bytes")
-            return StreamingResponse(
-                io.BytesIO(pdf_content),
-                media_type="application/pdf",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}.pdf"
-                }
-            )
-        else:
-            # Fallback to Markdown
-            print("Falling back to Markdown report...")
-            markdown_content = generate_markdown_report(data)
-            print(f"Markdown generated, length: {len(markdown_content)}")
-            return StreamingResponse(
-                io.BytesIO(markdown_content.encode('utf-8')),
-                media_type="text/markdown",
-                headers={
-                    "Content-Disposition": f"attachment; filename={filename}.md"
-                }
-            )
+        # Rendered in a worker process so the event loop stays responsive
+        content, media_type, extension = await _render(data)
+        logger.debug("Report generated (%s), size: %d bytes", extension, len(content))
+        return Response(
+            content=content,
+            media_type=media_type,
+            headers={
+                "Content-Disposition": f"attachment; filename={filename}.{extension}"
+            }
+        )
 
+    except ReportBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
     except Exception as e:
-        print(f"Error generating report: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to generate report: {str(e)}")
\ No newline at end of file
+        logger.exception("Error generating report")
+        raise HTTPException(status_code=500, detail=f"Failed to generate report: {str(e)}")
+
+
+class _ZipSink:
+    """
+    Write-only, unseekable file object for zipfile. zipfile then emits data
+    descriptors instead of seeking back, and whatever it wrote can be handed
+    to the client and dropped.
+    """
+
+    def __init__(self):
+        self._chunks: list[bytes] = []
+
+    def write(self, data) -> int:
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+async def _bulk_values(request: Request):
+    """
+    The entries of the body as they arrive, with their numbers: one per line
+    for NDJSON content types, else the elements of a JSON array, decoded one
+    at a time so the body is never held whole. An entry that is not valid
+    JSON comes back as the ValueError. Raises HTTPException (400) when the
+    body is not an array or an entry outgrows MAX_BULK_ITEM_BYTES.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" in content_type or "jsonl" in content_type:
+        number = 0
+        pending = b""
+        async for chunk in request.stream():
+            lines = (pending + chunk).split(b"\n")
+            pending = lines.pop()
+            if len(pending) > MAX_BULK_ITEM_BYTES:
+                raise HTTPException(status_code=400, detail=f"Report #{number + 1} is too large")
+            for line in lines:
+                number += 1
+                if line.strip():
+                    try:
+                        yield number, json.loads(line)
+                    except ValueError as e:
+                        yield number, e
+        if pending.strip():
+            try:
+                yield number + 1, json.loads(pending)
+            except ValueError as e:
+                yield number + 1, e
+        return
+
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = 0
+    number = 0
+    opened = closed = False
+    # A ',' was read since the last element
+    separated = False
+    chunks = request.stream()
+    while not closed:
+        try:
+            chunk = await anext(chunks)
+            done = False
+        except StopAsyncIteration:
+            chunk, done = b"", True
+        try:
+            buffer = buffer[position:] + text.decode(chunk, final=done)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position == len(buffer):
+                break
+            if not opened:
+                if buffer[position] != "[":
+                    raise HTTPException(status_code=400, detail="Expected a JSON array of reports")
+                opened = True
+                position += 1
+                continue
+            if buffer[position] == "]" and not separated:
+                closed = True
+                break
+            if number and not separated:
+                if buffer[position] != ",":
+                    raise HTTPException(status_code=400, detail="Invalid JSON: expected ',' or ']'")
+                separated = True
+                position += 1
+                continue
+            try:
+                value, position = decoder.raw_decode(buffer, position)
+            except ValueError as e:
+                if done:
+                    raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+                # Most likely cut off mid-element; wait for the rest
+                break
+            number += 1
+            separated = False
+            yield number, value
+        if len(buffer) - position > MAX_BULK_ITEM_BYTES:
+            raise HTTPException(status_code=400, detail=f"Report #{number + 1} is too large")
+        if done and not closed:
+            raise HTTPException(status_code=400, detail="Invalid JSON: the array is not closed")
+
+
+async def _spool_bulk_items(request: Request) -> tuple[tempfile.SpooledTemporaryFile, int, list[str]]:
+    """
+    Validate the reports as they arrive and spool them, one JSON line each,
+    to a file that stays in memory only while small. Returns the file
+    (rewound), how many reports it holds and the invalid entries.
+    """
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MEMORY_BYTES)
+    count = 0
+    errors: list[str] = []
+    try:
+        async for number, raw in _bulk_values(request):
+            if isinstance(raw, ValueError):
+                errors.append(f"#{number}: invalid JSON ({raw})")
+                continue
+            try:
+                item = BulkReportItem.model_validate(raw)
+            except ValidationError as e:
+                errors.append(f"#{number}: {e.errors()[0]['loc']} {e.errors()[0]['msg']}")
+                continue
+            if count >= MAX_BULK_REPORTS:
+                raise HTTPException(status_code=413, detail=f"At most {MAX_BULK_REPORTS} reports per request")
+            count += 1
+            spool.write(json.dumps([number, item.model_dump(mode="json")]).encode("utf-8") + b"\n")
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool, count, errors
+
+
+def _archive_name(number: int, item: BulkReportItem, extension: str) -> str:
+    label = re.sub(r"[^A-Za-z0-9._-]+", "_", item.name or item.language).strip("._") or "report"
+    return f"{number:04d}_{label[:60]}.{extension}"
+
+
+@router.post("/report/bulk")
+async def download_reports_bulk(request: Request):
+    """
+    Render many reports in parallel and stream them back as a ZIP archive.
+    The body is a JSON array of report payloads or NDJSON (one per line,
+    Content-Type: application/x-ndjson); each may carry an optional "name"
+    used for its file name. Entries are validated as they arrive and
+    spooled to a temporary file, then rendered with only a few in flight at
+    once and added as soon as they finish, so memory stays flat however
+    large the batch. Invalid entries are listed in errors.txt.
+    """
+    spool, _, errors = await _spool_bulk_items(request)
+
+    pool = get_report_pool()
+    window = 1
+    if pool is not None:
+        # Two per worker so a finished render is replaced while it is zipped
+        window = min(pool.workers * 2, pool.workers + pool.max_queue)
+        try:
+            pool.check(window)
+        except ReportBusy as e:
+            spool.close()
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    async def archive():
+        # Reserved here, not before the response, so a client that leaves
+        # before the body starts never holds renderer capacity
+        reserved = False
+        if pool is not None:
+            try:
+                pool.admit(window)
+                reserved = True
+            except ReportBusy:
+                # Lost the room to another request since the check; render one
+                # at a time, each admitted on its own
+                pass
+        sink = _ZipSink()
+        zf = zipfile.ZipFile(sink, mode="w")
+        in_flight: dict[asyncio.Future, tuple[int, BulkReportItem]] = {}
+
+        def add(task: asyncio.Future):
+            number, item = in_flight.pop(task)
+            try:
+                content, _, extension = task.result()
+            except Exception as e:
+                logger.exception("Error generating report #%s", number)
+                errors.append(f"#{number}: failed to render ({e})")
+                return
+            info = zipfile.ZipInfo(_archive_name(number, item, extension), datetime.now().timetuple()[:6])
+            # PDFs are already compressed
+            info.compress_type = zipfile.ZIP_STORED if extension == "pdf" else zipfile.ZIP_DEFLATED
+            zf.writestr(info, content)
+
+        try:
+            for line in spool:
+                number, raw = json.loads(line)
+                item = BulkReportItem.model_validate(raw)
+                try:
+                    await resolve_hashes(item, "user_code", "fixed_code")
+                except UnknownBlob as e:
+                    errors.append(f"#{number}: {e}")
+                    continue
+                if len(in_flight) >= (window if reserved else 1):
+                    done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        add(task)
+                    if data := sink.drain():
+                        yield data
+                in_flight[asyncio.ensure_future(_render(item, pool_admitted=reserved))] = (number, item)
+            while in_flight:
+                done, _ = await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    add(task)
+                if data := sink.drain():
+                    yield data
+            if errors:
+                zf.writestr("errors.txt", "\n".join(errors) + "\n")
+            zf.close()
+            yield sink.drain()
+        finally:
+            for task in in_flight:
+                task.cancel()
+            spool.close()
+            if reserved:
+                pool.release(window)
+
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    return StreamingResponse(
+        archive(),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename=codesnap_reports_{timestamp}.zip"},
+    )
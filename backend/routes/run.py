@@ -1,181 +1,280 @@
+import asyncio
+import json
 import os
-import subprocess
-import tempfile
 import shutil
-import re
-from pathlib import Path
-from fastapi import APIRouter, Response
+import subprocess
+from fastapi import APIRouter, HTTPException, Response, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
-from models.schemas import RunRequest, RunResponse
+from dispatch.backend import execution_backend_stats, get_execution_backend
+from models.schemas import (
+    RunBatchRequest,
+    RunBatchResponse,
+    RunCaseResult,
+    RunRequest,
+    RunResponse,
+)
+from sandbox.compile_cache import get_compile_cache
+from sandbox.engine import EngineBusy, get_engine, stream_process
+from sandbox.precheck import Diagnostic, precheck, precheck_stats
+from sandbox.python_pool import pool_stats
+from sandbox.runner import MISSING_TOOLCHAIN, RUN_STAGE, compile_key, prepare, run_case, workspace
+from sandbox.workspaces import workspace_pool_stats
+from storage.blobs import UnknownBlob, resolve_hashes
 
 router = APIRouter()
 
+STREAM_TIMEOUT = float(os.getenv("CODESNAP_RUN_STREAM_TIMEOUT", "10"))
+STREAM_MAX_BYTES = int(os.getenv("CODESNAP_RUN_STREAM_MAX_BYTES", str(256 * 1024)))
+INTERACTIVE_TIMEOUT = float(os.getenv("CODESNAP_RUN_INTERACTIVE_TIMEOUT", "60"))
+MAX_BATCH_CASES = int(os.getenv("CODESNAP_RUN_MAX_BATCH_CASES", "100"))
 
 @router.options("/run", include_in_schema=False)
 async def run_options() -> Response:
     return Response(status_code=204)
 
 
+@router.get("/run/stats")
+async def run_stats():
+    """Expose sandbox internals so operators can size the pools."""
+    return {
+        "engine": get_engine().stats(),
+        "python_pool": pool_stats(),
+        "compile_cache": get_compile_cache().stats(),
+        "workspaces": workspace_pool_stats(),
+        "precheck": precheck_stats(),
+        "execution_backend": execution_backend_stats(),
+    }
+
+
+async def _precheck(language: str, code: str) -> Diagnostic | None:
+    """
+    An error known without running anything: a syntax or compile error
+    found by the pre-check, or the diagnostics of an earlier failed compile
+    of the same source.
+    """
+    if language not in ("java", "c"):
+        return await precheck(language, code)
+    try:
+        _, cache_key = await compile_key(language, code)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    cache = get_compile_cache()
+    failure = cache.failure(cache_key)
+    if failure is not None:
+        return Diagnostic(failure)
+    if cache.has(cache_key):
+        # Compiled before; nothing to check
+        return None
+    diagnostic = await precheck(language, code)
+    if diagnostic is not None:
+        cache.store_failure(cache_key, diagnostic.text)
+    return diagnostic
+
+
+def _rejected(diagnostic: Diagnostic) -> RunResponse:
+    return RunResponse(error=diagnostic.text, error_line=diagnostic.line, error_column=diagnostic.column)
+
+
 @router.post("/run", response_model=RunResponse)
-def run_code(req: RunRequest):
+async def run_code(req: RunRequest):
     """
     Secure code execution sandbox for multiple languages.
-    Runs code in a temporary directory with strict timeouts and cleanup.
+    Runs code in a temporary directory with strict timeouts and cleanup,
+    on this host or on executors behind a broker (CODESNAP_EXECUTION_BACKEND).
+    Admission is bounded by the engine or the broker; overload returns 503.
+    Code with a syntax error that can be found up front is not run at all.
     """
     if req.language not in ["python", "javascript", "java", "c"]:
         return RunResponse(error=f"Unsupported language: {req.language}")
+    try:
+        await resolve_hashes(req, "code")
+    except UnknownBlob as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    diagnostic = await _precheck(req.language, req.code)
+    if diagnostic is not None:
+        return _rejected(diagnostic)
 
-    # Create temporary directory for execution
-    with tempfile.TemporaryDirectory() as temp_dir:
-        try:
-            if req.language == "python":
-                return _run_python(req.code, temp_dir)
-            elif req.language == "javascript":
-                return _run_javascript(req.code, temp_dir)
-            elif req.language == "java":
-                return _run_java(req.code, temp_dir)
-            elif req.language == "c":
-                return _run_c(req.code, temp_dir)
-        except Exception as e:
-            return RunResponse(error=f"Execution failed: {str(e)}")
-
-
-def _run_python(code: str, temp_dir: str) -> RunResponse:
-    """Execute Python code using python -c"""
     try:
-        result = subprocess.run(
-            ["python", "-c", code],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=2,
-            shell=False
-        )
-        return RunResponse(
-            output=result.stdout if result.stdout else None,
-            error=result.stderr if result.stderr else None
-        )
-    except subprocess.TimeoutExpired:
-        return RunResponse(error="Execution timed out (2 seconds)")
-    except FileNotFoundError:
-        return RunResponse(error="Python is not installed")
+        return await get_execution_backend().run(req.language, req.code)
+    except EngineBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
 
-def _run_javascript(code: str, temp_dir: str) -> RunResponse:
-    """Execute JavaScript code using node"""
+@router.post("/run/batch", response_model=RunBatchResponse)
+async def run_batch(req: RunBatchRequest):
+    """
+    Run one program against many stdin/argument cases.
+    The source is compiled once; cases then run in parallel, each in its
+    own directory, bounded by the engine's per-language limit.
+    """
+    if req.language not in ["python", "javascript", "java", "c"]:
+        return RunBatchResponse(error=f"Unsupported language: {req.language}")
+    if len(req.cases) > MAX_BATCH_CASES:
+        return RunBatchResponse(error=f"Too many cases (max {MAX_BATCH_CASES})")
     try:
-        result = subprocess.run(
-            ["node", "-e", code],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=2,
-            shell=False
-        )
-        return RunResponse(
-            output=result.stdout if result.stdout else None,
-            error=result.stderr if result.stderr else None
+        await resolve_hashes(req, "code")
+    except UnknownBlob as e:
+        raise HTTPException(status_code=422, detail=str(e))
+
+    diagnostic = await _precheck(req.language, req.code)
+    if diagnostic is not None:
+        if req.language in ("java", "c"):
+            return RunBatchResponse(error=diagnostic.text)
+        # What every case would have printed, with the interpreter's exit status
+        return RunBatchResponse(
+            results=[RunCaseResult(error=diagnostic.text, exit_code=1, wall_time_ms=0.0) for _ in req.cases]
         )
-    except subprocess.TimeoutExpired:
-        return RunResponse(error="Execution timed out (2 seconds)")
-    except FileNotFoundError:
-        return RunResponse(error="Node.js is not installed")
-
-
-def _extract_java_class_name(code: str) -> str:
-    """Extract the public class name from Java code"""
-    # Look for public class ClassName pattern
-    match = re.search(r'public\s+class\s+(\w+)', code)
-    if match:
-        return match.group(1)
-    # Fallback: look for any class declaration
-    match = re.search(r'class\s+(\w+)', code)
-    if match:
-        return match.group(1)
-    # Last resort: use Main
-    return "Main"
-
-def _run_java(code: str, temp_dir: str) -> RunResponse:
-    """Execute Java code by extracting class name, compiling, and running"""
+
+    engine = get_engine()
     try:
-        # Extract class name from code
-        class_name = _extract_java_class_name(code)
-        filename = f"{class_name}.java"
-
-        # Write code to the appropriate filename
-        java_file = Path(temp_dir) / filename
-        java_file.write_text(code, encoding='utf-8')
-
-        # Compile
-        compile_result = subprocess.run(
-            ["javac", filename],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=2,
-            shell=False
-        )
+        with workspace(req.language) as temp_dir:
+            build_dir = os.path.join(temp_dir, "build")
+            os.mkdir(build_dir)
+            async with engine.slot(req.language):
+                command = await prepare(req.language, req.code, build_dir)
+            if isinstance(command, RunResponse):
+                return RunBatchResponse(error=command.error)
 
-        if compile_result.returncode != 0:
-            return RunResponse(error=compile_result.stderr or "Compilation failed")
-
-        # Execute
-        run_result = subprocess.run(
-            ["java", class_name],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=2,
-            shell=False
-        )
+            results: list[RunCaseResult | None] = [None] * len(req.cases)
+            pending = iter(enumerate(req.cases))
 
-        return RunResponse(
-            output=run_result.stdout if run_result.stdout else None,
-            error=run_result.stderr if run_result.stderr else None
-        )
+            async def worker():
+                for index, case in pending:
+                    case_dir = os.path.join(temp_dir, f"case-{index}")
+                    os.mkdir(case_dir)
+                    # Copies, so one case cannot change the build the others run
+                    for artifact in os.listdir(build_dir):
+                        shutil.copy2(os.path.join(build_dir, artifact), os.path.join(case_dir, artifact))
+                    async with engine.slot(req.language):
+                        with RUN_STAGE.time(req.language, "execute"):
+                            results[index] = await run_case(req.language, req.code, command, case_dir, case)
 
-    except subprocess.TimeoutExpired:
-        return RunResponse(error="Execution timed out (2 seconds)")
-    except FileNotFoundError:
-        return RunResponse(error="Java is not installed")
+            # Only as many workers as the language may run at once, so a big
+            # batch never floods the engine's wait queue.
+            parallelism = min(len(req.cases), engine.language_limits.get(req.language, engine.max_concurrency))
+            workers = [asyncio.create_task(worker()) for _ in range(parallelism)]
+            try:
+                await asyncio.gather(*workers)
+            finally:
+                # One worker failing (EngineBusy) must stop the rest before
+                # the workspace they run in is released
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+            return RunBatchResponse(results=results)
+    except EngineBusy as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
 
-def _run_c(code: str, temp_dir: str) -> RunResponse:
-    """Execute C code by writing to temp.c, compiling, and running"""
+async def _stream_events(req: RunRequest, timeout: float, stdin: asyncio.Queue | None = None):
+    """
+    Shared by the SSE and WebSocket modes. Yields (kind, data) pairs where
+    kind is stdout, stderr, truncated, error or exit.
+    """
+    if req.language not in MISSING_TOOLCHAIN:
+        yield "error", {"error": f"Unsupported language: {req.language}"}
+        return
     try:
-        # Write code to temp.c
-        c_file = Path(temp_dir) / "temp.c"
-        c_file.write_text(code, encoding='utf-8')
-
-        # Compile
-        compile_result = subprocess.run(
-            ["gcc", "temp.c", "-o", "temp"],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=2,
-            shell=False
-        )
+        await resolve_hashes(req, "code")
+    except UnknownBlob as e:
+        yield "error", {"error": str(e)}
+        return
 
-        if compile_result.returncode != 0:
-            return RunResponse(error=compile_result.stderr or "Compilation failed")
-
-        # Execute
-        run_result = subprocess.run(
-            ["./temp"],
-            cwd=temp_dir,
-            capture_output=True,
-            text=True,
-            timeout=2,
-            shell=False
-        )
+    diagnostic = await _precheck(req.language, req.code)
+    if diagnostic is not None:
+        if req.language in ("java", "c"):
+            yield "error", {"error": diagnostic.text}
+        else:
+            # The same events a run of the interpreter would have produced
+            yield "stderr", {"text": diagnostic.text}
+            yield "exit", {"exit_code": 1}
+        return
+
+    try:
+        async with get_engine().slot(req.language):
+            with workspace(req.language) as temp_dir:
+                command = await prepare(req.language, req.code, temp_dir)
+                if isinstance(command, RunResponse):
+                    yield "error", {"error": command.error}
+                    return
+                try:
+                    async for kind, payload in stream_process(command, temp_dir, timeout, STREAM_MAX_BYTES, stdin):
+                        if kind in ("stdout", "stderr"):
+                            yield kind, {"text": payload}
+                        elif kind == "truncated":
+                            yield kind, {"limit_bytes": STREAM_MAX_BYTES}
+                        elif kind == "timeout":
+                            yield "error", {"error": f"Execution timed out ({timeout:g} seconds)"}
+                        else:
+                            yield kind, {"exit_code": payload}
+                except FileNotFoundError:
+                    yield "error", {"error": MISSING_TOOLCHAIN[req.language]}
+    except EngineBusy as e:
+        yield "error", {"error": str(e)}
+
+
+@router.post("/run/stream")
+async def run_code_stream(req: RunRequest):
+    """
+    Streaming variant of /run using Server-Sent Events.
+    Output chunks are forwarded as they are produced and the combined
+    output is capped at CODESNAP_RUN_STREAM_MAX_BYTES.
+    """
+    async def events():
+        async for kind, data in _stream_events(req, STREAM_TIMEOUT):
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
 
-        return RunResponse(
-            output=run_result.stdout if run_result.stdout else None,
-            error=run_result.stderr if run_result.stderr else None
-        )
 
-    except subprocess.TimeoutExpired:
-        return RunResponse(error="Execution timed out (2 seconds)")
-    except FileNotFoundError:
-        return RunResponse(error="GCC is not installed")
\ No newline at end of file
+@router.websocket("/run/ws")
+async def run_code_interactive(ws: WebSocket):
+    """
+    Interactive run over a WebSocket.
+    First message: {"language": ..., "code": ...}. Afterwards the client may
+    send {"type": "stdin", "data": "..."} and {"type": "eof"}. The server
+    sends {"type": kind, ...} messages mirroring the SSE events.
+    """
+    await ws.accept()
+    try:
+        req = RunRequest(**await ws.receive_json())
+    except (ValidationError, ValueError, TypeError):
+        await ws.send_json({"type": "error", "error": "Expected {language, code} as the first message"})
+        await ws.close()
+        return
+    except WebSocketDisconnect:
+        return
+
+    stdin: asyncio.Queue = asyncio.Queue()
+    runner = asyncio.current_task()
+
+    async def read_client():
+        try:
+            while True:
+                message = await ws.receive_json()
+                if message.get("type") == "stdin":
+                    await stdin.put(str(message.get("data", "")))
+                elif message.get("type") == "eof":
+                    await stdin.put(None)
+        except WebSocketDisconnect:
+            # Stops the run; _stream_events kills the process on the way out
+            runner.cancel()
+        except (ValueError, TypeError):
+            await stdin.put(None)
+
+    reader = asyncio.create_task(read_client())
+    try:
+        async for kind, data in _stream_events(req, INTERACTIVE_TIMEOUT, stdin):
+            await ws.send_json({"type": kind, **data})
+        await ws.close()
+    except (asyncio.CancelledError, WebSocketDisconnect):
+        pass
+    finally:
+        reader.cancel()
@@ -1,6 +1,14 @@
-from fastapi import APIRouter
-from pydantic import BaseModel
+import functools
+import json
+import math
+from contextlib import asynccontextmanager
+
+from fastapi import APIRouter, HTTPException, Request
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from ai import groq_client
+from ai.scheduler import RateLimited, request_tokens
+from ai.sessions import TutorSession, UnknownSession, tutor_sessions
 
 router = APIRouter()
 
@@ -8,42 +16,170 @@ router = APIRouter()
 class TutorRequest(BaseModel):
     message: str
     language: str = "general"
+    # Optional, from POST /api/tutor/sessions; turns with the same id share history
+    session_id: str | None = Field(default=None, max_length=128)
+    # Whose share of the upstream LLM this uses; the session, else the client address, if unset
+    user_id: str | None = Field(default=None, max_length=128)
 
 
-@router.post("/tutor")
-def tutor_chat(req: TutorRequest):
-    """
-    Conversational AI tutor endpoint.
-    - Accepts only free-text message + language
-    - Returns plain text in a JSON envelope { "reply": "..." }
-    - Does NOT reuse explain_error logic
-    """
-    if not groq_client.GROQ_API_KEY or groq_client.client is None:
-        return {"reply": "AI tutor is unavailable because GROQ_API_KEY is not configured."}
+UNAVAILABLE_REPLY = "AI tutor is unavailable because GROQ_API_KEY is not configured."
+ERROR_REPLY = "The AI tutor encountered a problem. Please try again in a moment."
+RATE_LIMITED_REPLY = "You're sending messages faster than the AI tutor can answer. Please wait about {seconds} seconds."
+
 
-    system_prompt = f"""You are a friendly programming tutor for beginners.
+@functools.lru_cache(maxsize=64)
+def _system_prompt(language: str) -> str:
+    # Identical text for every turn in a language, so it stays a cacheable prefix
+    return f"""You are a friendly programming tutor for beginners.
 - Be clear and concise; avoid jargon.
 - Support Python, JavaScript, Java, and C.
 - Explain concepts, syntax, logic, common errors, and best practices.
 - Give short examples when helpful.
 - Encourage and keep a positive tone.
-Current language focus: {req.language}
+Current language focus: {language}
 If the user asks something unrelated to programming, briefly steer them back to coding topics."""
 
+
+def _session(req: TutorRequest) -> TutorSession | None:
+    """The turn's session, None for a stateless turn; 404 for an unknown or expired id."""
+    if not req.session_id:
+        return None
     try:
-        completion = groq_client.client.chat.completions.create(
-            model=groq_client.MODEL,
-            messages=[
-                {"role": "system", "content": system_prompt},
-                {"role": "user", "content": req.message},
-            ],
-            temperature=0.6,
-            max_tokens=600,
-            stream=False,
-        )
-        reply_text = completion.choices[0].message.content.strip()
-        return {"reply": reply_text}
+        return tutor_sessions.get(req.session_id, req.language)
+    except UnknownSession:
+        raise HTTPException(status_code=404, detail="Unknown or expired tutor session; open a new one")
+
+
+@asynccontextmanager
+async def _conversation(req: TutorRequest, session: TutorSession | None):
+    """
+    Yields (messages, record) for one turn. In a session the prompt carries
+    its history and record(reply) appends the exchange; without one the
+    turn is stateless and record does nothing.
+    """
+    if session is None:
+        messages = [
+            {"role": "system", "content": _system_prompt(req.language)},
+            {"role": "user", "content": req.message},
+        ]
+        yield messages, lambda reply: None
+        return
+
+    async with session.lock:
+        messages = session.messages(_system_prompt(req.language), req.message)
+        tutor_sessions.count_prompt(messages)
+        yield messages, lambda reply: tutor_sessions.record(session, req.message, reply)
+
+
+def _requester(req: TutorRequest, request: Request) -> str:
+    """Key for the upstream fair-share scheduler"""
+    return req.user_id or req.session_id or (request.client.host if request.client else groq_client.ANONYMOUS)
+
+
+def _rate_limited_reply(e: RateLimited) -> str:
+    return RATE_LIMITED_REPLY.format(seconds=math.ceil(e.retry_after))
+
+
+def _envelope(req: TutorRequest, reply: str) -> dict:
+    if req.session_id:
+        return {"reply": reply, "session_id": req.session_id}
+    return {"reply": reply}
+
+
+@router.get("/tutor/stats")
+async def tutor_stats():
+    return {"sessions": tutor_sessions.stats()}
+
+
+@router.post("/tutor/sessions")
+async def open_tutor_session():
+    """Start a conversation; send the returned session_id with each of its turns."""
+    return {"session_id": tutor_sessions.open()}
+
+
+@router.delete("/tutor/sessions/{session_id}")
+async def end_tutor_session(session_id: str):
+    """Forget a conversation, e.g. when the student starts over."""
+    return {"deleted": tutor_sessions.discard(session_id)}
+
+
+@router.post("/tutor")
+async def tutor_chat(req: TutorRequest, request: Request):
+    """
+    Conversational AI tutor endpoint.
+    - Accepts only free-text message + language, plus an optional session_id
+      (from POST /tutor/sessions; an unknown or expired one is a 404)
+    - Returns plain text in a JSON envelope { "reply": "..." }
+      (with "session_id" echoed back when one was sent)
+    - Does NOT reuse explain_error logic
+    """
+    session = _session(req)
+    if not groq_client.configured():
+        return _envelope(req, UNAVAILABLE_REPLY)
+
+    try:
+        async with _conversation(req, session) as (messages, record):
+            reply_text = (await groq_client.chat_completion(
+                messages,
+                temperature=0.6,
+                max_tokens=600,
+                user=_requester(req, request),
+            )).strip()
+            record(reply_text)
+        return _envelope(req, reply_text)
+    except RateLimited as e:
+        return _envelope(req, _rate_limited_reply(e))
     except Exception as exc:
-        return {
-            "reply": "The AI tutor encountered a problem. Please try again in a moment.",
-        }
\ No newline at end of file
+        return _envelope(req, ERROR_REPLY)
+
+
+@router.post("/tutor/stream")
+async def tutor_chat_stream(req: TutorRequest, request: Request):
+    """
+    Streaming variant of /tutor using Server-Sent Events.
+    A "queued" event with {position, estimated_wait_ms} comes first when the
+    LLM is busy. "token" events carry {delta} text as it is generated; the
+    final "done" event carries the same envelope /tutor returns.
+    """
+    user = _requester(req, request)
+    session = _session(req)
+
+    async def replies():
+        if not groq_client.configured():
+            yield "done", _envelope(req, UNAVAILABLE_REPLY)
+            return
+        parts = []
+        try:
+            async with _conversation(req, session) as (messages, record):
+                queued = groq_client.scheduler.estimate(user, "chat", request_tokens(messages, 600))
+                if queued["estimated_wait_ms"] > 0:
+                    yield "queued", queued
+                async for delta in groq_client.stream_chat_completion(
+                    messages,
+                    temperature=0.6,
+                    max_tokens=600,
+                    user=user,
+                ):
+                    if not parts:
+                        delta = delta.lstrip()
+                        if not delta:
+                            continue
+                    parts.append(delta)
+                    yield "token", {"delta": delta}
+                reply = "".join(parts).strip()
+                record(reply)
+            yield "done", _envelope(req, reply)
+        except RateLimited as e:
+            yield "done", _envelope(req, _rate_limited_reply(e))
+        except Exception:
+            yield "done", _envelope(req, "".join(parts).strip() or ERROR_REPLY)
+
+    async def events():
+        async for kind, data in replies():
+            yield f"event: {kind}\ndata: {json.dumps(data)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
\ No newline at end of file
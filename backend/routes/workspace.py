@@ -0,0 +1,115 @@
+import asyncio
+
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import PlainTextResponse
+
+from models.schemas import WorkspaceChange, WorkspaceManifest, WorkspaceSyncRequest, WorkspaceSyncResponse
+from storage.blobs import BlobTooLarge, apply_edits, blob_store_stats, get_blob_store
+from storage.workspaces import WorkspaceConflict, get_workspace_store, workspace_store_stats
+
+router = APIRouter()
+
+
+@router.get("/workspace/stats")
+async def workspace_stats():
+    return {"workspaces": workspace_store_stats(), "blobs": blob_store_stats()}
+
+
+async def _read(workspace_id: str, user_id: str | None) -> dict:
+    try:
+        manifest = await asyncio.to_thread(get_workspace_store().read, workspace_id, user_id)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="Unknown workspace")
+    return manifest
+
+
+@router.get("/workspace/{workspace_id}/blobs/{digest}", response_class=PlainTextResponse)
+async def get_blob(workspace_id: str, digest: str, user_id: str | None = None):
+    """The content of one of the workspace's files by its hash, for clients missing it locally."""
+    manifest = await _read(workspace_id, user_id)
+    if digest not in manifest["files"].values():
+        raise HTTPException(status_code=404, detail="Unknown blob")
+    content = await asyncio.to_thread(get_blob_store().get, digest)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Unknown blob")
+    # A hash names one content forever, but only its workspace's owner may see it
+    return PlainTextResponse(content, headers={"Cache-Control": "private, max-age=31536000, immutable"})
+
+
+@router.get("/workspace/{workspace_id}", response_model=WorkspaceManifest)
+async def get_workspace(workspace_id: str, user_id: str | None = None):
+    """
+    The workspace's paths and blob hashes; contents come from
+    /workspace/{workspace_id}/blobs. A workspace synced with a user_id is
+    only readable with the same user_id.
+    """
+    return await _read(workspace_id, user_id)
+
+
+def _store_change(change: WorkspaceChange) -> str | None:
+    """The blob hash for a change, storing its content if sent; None if the content is missing."""
+    blobs = get_blob_store()
+    if change.content is not None:
+        return blobs.put(change.content)
+    if change.edits is not None:
+        base = blobs.get(change.base) if change.base else None
+        content = apply_edits(base, change.edits) if base is not None else None
+        if content is None:
+            return None
+        digest = blobs.put(content)
+        if change.hash is not None and digest != change.hash:
+            # The client's base differs from ours; it has to send the file
+            return None
+        return digest
+    if change.hash is not None and blobs.has(change.hash):
+        return change.hash
+    return None
+
+
+def _sync(workspace_id: str, req: WorkspaceSyncRequest) -> dict:
+    changes: dict[str, str | None] = {}
+    missing = []
+    for change in req.changes:
+        if change.deleted:
+            changes[change.path] = None
+            continue
+        digest = _store_change(change)
+        if digest is None:
+            missing.append(change.path)
+        else:
+            changes[change.path] = digest
+
+    store = get_workspace_store()
+    if missing:
+        # All or nothing, so the manifest never points at a half-synced state
+        manifest = store.read(workspace_id, req.user_id) or {"id": workspace_id, "name": "", "version": 0, "files": {}}
+        return {**manifest, "missing": missing}
+    try:
+        return store.commit(workspace_id, req.user_id, req.write_token, req.base_version, req.name, changes)
+    except WorkspaceConflict as e:
+        return {**e.manifest, "conflict": True}
+
+
+@router.post("/workspace/{workspace_id}/sync", response_model=WorkspaceSyncResponse)
+async def sync_workspace(workspace_id: str, req: WorkspaceSyncRequest):
+    """
+    Apply a client's changes since base_version.
+    Each change carries the file's content, the hash of a blob the server
+    already has (a template, or the same file in another workspace), or
+    line edits against a blob, so only new text crosses the wire. Changes
+    the server has no content for are listed in missing and nothing is
+    applied; a stale base_version returns conflict with the current
+    manifest. The sync that creates a workspace returns its write_token,
+    which every later sync must send (403 otherwise). Run, explain and report requests can then name files by
+    hash (code_hash, user_code_hash, fixed_code_hash).
+    """
+    try:
+        return await asyncio.to_thread(_sync, workspace_id, req)
+    except PermissionError as e:
+        raise HTTPException(status_code=403, detail=str(e))
+    except BlobTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
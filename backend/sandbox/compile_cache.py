@@ -0,0 +1,185 @@
+"""
+Content-addressed cache of compiled artifacts for Java and C runs.
+
+Entries are keyed by a hash of language, source, compiler flags and
+toolchain version, stored as one directory per key, and evicted LRU once the
+total size exceeds the configured byte budget.
+
+Compile errors are remembered too, in memory and under the same keys, so
+resubmitting the same broken source returns the compiler's diagnostics
+without running it again.
+"""
+import functools
+import hashlib
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+CACHE_DIR = os.getenv(
+    "CODESNAP_COMPILE_CACHE_DIR",
+    os.path.join(tempfile.gettempdir(), "codesnap-compile-cache"),
+)
+CACHE_MAX_BYTES = int(os.getenv("CODESNAP_COMPILE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+MAX_FAILURES = int(os.getenv("CODESNAP_COMPILE_CACHE_MAX_FAILURES", "1024"))
+
+
+@functools.lru_cache(maxsize=None)
+def toolchain_version(compiler: str) -> str:
+    """
+    Version banner of a compiler, resolved once per process.
+    Raises FileNotFoundError when the compiler is not installed.
+    """
+    flag = "-version" if compiler == "javac" else "--version"
+    result = subprocess.run([compiler, flag], capture_output=True, text=True, timeout=10)
+    banner = (result.stdout or result.stderr).strip()
+    return banner.splitlines()[0] if banner else compiler
+
+
+class CompileCache:
+    def __init__(self, root: str = CACHE_DIR, max_bytes: int = CACHE_MAX_BYTES, max_failures: int = MAX_FAILURES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        self.max_failures = max_failures
+        self.hits = 0
+        self.misses = 0
+        self.failure_hits = 0
+        self.evictions = 0
+        self.total_bytes = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+        self._failures: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        self.root.mkdir(parents=True, exist_ok=True)
+        self._load()
+
+    def _load(self):
+        """Rebuild the LRU index from disk, oldest access first."""
+        found = []
+        for entry in self.root.iterdir():
+            if entry.name.startswith(".") or not entry.is_dir():
+                continue
+            size = sum(f.stat().st_size for f in entry.iterdir() if f.is_file())
+            found.append((entry.stat().st_mtime, entry.name, size))
+        for _, key, size in sorted(found):
+            self._entries[key] = size
+            self.total_bytes += size
+        self._evict()
+
+    @staticmethod
+    def key(language: str, source: str, flags: list[str], toolchain: str) -> str:
+        digest = hashlib.sha256()
+        for part in (language, toolchain, "\0".join(flags), source):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0\0")
+        return digest.hexdigest()
+
+    def fetch(self, key: str, dest_dir: str) -> bool:
+        """
+        Copy cached artifacts into dest_dir. Returns False on a miss.
+        Never hardlinks: the run directory is writable by the submission,
+        and a shared inode would let one run change the build others get.
+        """
+        with self._lock:
+            present = key in self._entries
+            if present:
+                self._entries.move_to_end(key)
+        entry = self.root / key
+        if present:
+            try:
+                for artifact in entry.iterdir():
+                    shutil.copy2(artifact, Path(dest_dir) / artifact.name)
+                os.utime(entry)
+            except OSError:
+                # Evicted by another worker between lookup and copy.
+                present = False
+        with self._lock:
+            if present:
+                self.hits += 1
+            else:
+                self.misses += 1
+        return present
+
+    def store(self, key: str, src_dir: str, names: list[str]):
+        """Copy freshly compiled artifacts from src_dir into the cache."""
+        staging = Path(tempfile.mkdtemp(prefix=".staging-", dir=self.root))
+        try:
+            size = 0
+            for name in names:
+                shutil.copy2(Path(src_dir) / name, staging / name)
+                size += (staging / name).stat().st_size
+            if size > self.max_bytes:
+                return
+            try:
+                staging.rename(self.root / key)
+            except OSError:
+                # Another request stored the same key first.
+                return
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        with self._lock:
+            if key not in self._entries:
+                self._entries[key] = size
+                self.total_bytes += size
+            self._evict()
+
+    def has(self, key: str) -> bool:
+        """Whether a build of this key is cached, without touching its LRU position."""
+        with self._lock:
+            return key in self._entries
+
+    def failure(self, key: str) -> str | None:
+        """Diagnostics of an earlier failed compile of this key, or None."""
+        with self._lock:
+            diagnostics = self._failures.get(key)
+            if diagnostics is not None:
+                self._failures.move_to_end(key)
+                self.failure_hits += 1
+            return diagnostics
+
+    def store_failure(self, key: str, diagnostics: str):
+        if self.max_failures <= 0:
+            return
+        with self._lock:
+            self._failures[key] = diagnostics
+            self._failures.move_to_end(key)
+            while len(self._failures) > self.max_failures:
+                self._failures.popitem(last=False)
+
+    def _evict(self):
+        while self.total_bytes > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+            shutil.rmtree(self.root / key, ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "failure_hits": self.failure_hits,
+                "failures": len(self._failures),
+                "entries": len(self._entries),
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+_cache: CompileCache | None = None
+_cache_lock = threading.Lock()
+
+
+def get_compile_cache() -> CompileCache:
+    global _cache
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                _cache = CompileCache()
+    return _cache
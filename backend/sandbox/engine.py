@@ -0,0 +1,423 @@
+"""
+Asynchronous execution engine for /api/run.
+
+Admission control happens in two stages: a per-language semaphore (so slow
+Java compiles cannot starve Python runs) and a node-wide concurrency cap.
+Requests that would wait once the bounded queue is full are rejected
+immediately instead of piling up behind the threadpool.
+
+Processes run under the rlimits in sandbox/limits.py, in their own process
+group, with output reads capped; run_process reaps the child itself with
+wait4 so it can report the run's CPU time and peak memory. It forks on a
+worker thread: with a preexec_fn, Popen forks the whole server and waits
+for the exec, which must not stall every other request on the loop.
+"""
+import asyncio
+import codecs
+import locale
+import os
+import resource
+import signal
+import subprocess
+from contextlib import asynccontextmanager
+
+from sandbox.limits import DEFAULT_LIMITS, RunLimits, truncation_marker
+from sandbox.python_pool import ProcessResult, decode_output, peak_memory_kb
+
+MAX_CONCURRENCY = int(os.getenv("CODESNAP_RUN_MAX_CONCURRENCY", str((os.cpu_count() or 1) * 2)))
+MAX_QUEUE = int(os.getenv("CODESNAP_RUN_MAX_QUEUE", "64"))
+QUEUE_TIMEOUT = float(os.getenv("CODESNAP_RUN_QUEUE_TIMEOUT", "10"))
+HWM_SAMPLE_INTERVAL = 0.01
+
+
+def _language_limits() -> dict[str, int]:
+    """
+    Per-language caps, overridable as CODESNAP_RUN_LANGUAGE_LIMITS="java=2,c=4".
+    Compiled languages default to half of the node cap.
+    """
+    half = max(1, MAX_CONCURRENCY // 2)
+    limits = {"python": MAX_CONCURRENCY, "javascript": MAX_CONCURRENCY, "java": half, "c": half}
+    for item in os.getenv("CODESNAP_RUN_LANGUAGE_LIMITS", "").split(","):
+        if "=" in item:
+            language, value = item.split("=", 1)
+            limits[language.strip()] = max(1, int(value))
+    return limits
+
+
+class EngineBusy(Exception):
+    """Raised when a run cannot be admitted; routes map it to 503."""
+
+
+def _hwm_kb(pid: int) -> int | None:
+    """Peak RSS of the process's current image (VmHWM), None once it has exited."""
+    try:
+        with open(f"/proc/{pid}/status", "rb") as status:
+            for line in status:
+                if line.startswith(b"VmHWM:"):
+                    return int(line.split()[1])
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+
+async def _sample_hwm(pid: int, peak: list[int]):
+    """Keep peak at [highest VmHWM seen, samples taken] while the process runs."""
+    while (hwm := _hwm_kb(pid)) is not None:
+        peak[0] = max(peak[0], hwm)
+        peak[1] += 1
+        await asyncio.sleep(HWM_SAMPLE_INTERVAL)
+
+
+class ExecutionEngine:
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, max_queue: int = MAX_QUEUE,
+                 language_limits: dict[str, int] | None = None, queue_timeout: float = QUEUE_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.language_limits = language_limits or _language_limits()
+        self._global = asyncio.Semaphore(max_concurrency)
+        self._languages = {
+            language: asyncio.Semaphore(limit) for language, limit in self.language_limits.items()
+        }
+        self.waiting = 0
+        self.running = 0
+        self.rejected = 0
+
+    @asynccontextmanager
+    async def slot(self, language: str):
+        """Hold a language slot and a node slot for the duration of one run."""
+        language_sem = self._languages.get(language) or self._global
+        # Counters change synchronously, so this check cannot race other admissions.
+        if self.running + self.waiting >= self.max_concurrency + self.max_queue:
+            self.rejected += 1
+            raise EngineBusy("Too many runs in progress, please retry shortly")
+
+        self.waiting += 1
+        sems = [self._global] if language_sem is self._global else [language_sem, self._global]
+        acquired = []
+        admitted = False
+        try:
+            for sem in sems:
+                await asyncio.wait_for(sem.acquire(), timeout=self.queue_timeout)
+                acquired.append(sem)
+            admitted = True
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise EngineBusy("Timed out waiting for a free execution slot")
+        finally:
+            self.waiting -= 1
+            # Timed out or cancelled while waiting: give back what was taken
+            if not admitted:
+                for sem in acquired:
+                    sem.release()
+
+        self.running += 1
+        try:
+            yield
+        finally:
+            self.running -= 1
+            for sem in reversed(acquired):
+                sem.release()
+
+    def stats(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "max_queue": self.max_queue,
+            "language_limits": self.language_limits,
+            "running": self.running,
+            "waiting": self.waiting,
+            "rejected": self.rejected,
+        }
+
+
+def _kill_group(proc: subprocess.Popen | asyncio.subprocess.Process):
+    try:
+        os.killpg(proc.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        pass
+
+
+async def _reap(pid: int):
+    """
+    wait4 the child without blocking the loop (a pidfd where available,
+    else a thread). Returns (returncode, rusage).
+    """
+    try:
+        pidfd = os.pidfd_open(pid)
+    except (AttributeError, OSError):
+        _, status, usage = await asyncio.to_thread(os.wait4, pid, 0)
+        return os.waitstatus_to_exitcode(status), usage
+    loop = asyncio.get_running_loop()
+    exited = loop.create_future()
+    loop.add_reader(pidfd, lambda: exited.done() or exited.set_result(None))
+    try:
+        await asyncio.shield(exited)
+    finally:
+        loop.remove_reader(pidfd)
+        os.close(pidfd)
+    _, status, usage = os.wait4(pid, 0)
+    return os.waitstatus_to_exitcode(status), usage
+
+
+# Children of spawns whose caller was cancelled, being killed and reaped
+_abandoned: set[asyncio.Task] = set()
+
+
+async def _abandon(proc: subprocess.Popen):
+    _kill_group(proc)
+    for pipe in (proc.stdin, proc.stdout, proc.stderr):
+        if pipe is not None:
+            pipe.close()
+    proc.returncode, _ = await _reap(proc.pid)
+
+
+async def _spawn(args: list[str], **kwargs) -> subprocess.Popen:
+    """subprocess.Popen on a worker thread, off the event loop."""
+    spawn = asyncio.ensure_future(asyncio.to_thread(subprocess.Popen, args, **kwargs))
+    try:
+        return await asyncio.shield(spawn)
+    except asyncio.CancelledError:
+        # The fork goes ahead regardless; never leave that child running
+        def abandon(done: asyncio.Future):
+            if not done.cancelled() and done.exception() is None:
+                task = asyncio.ensure_future(_abandon(done.result()))
+                _abandoned.add(task)
+                task.add_done_callback(_abandoned.discard)
+
+        spawn.add_done_callback(abandon)
+        raise
+
+
+async def run_process(args: list[str], cwd: str, timeout: float, stdin: str | None = None,
+                      limits: RunLimits = DEFAULT_LIMITS) -> ProcessResult:
+    """
+    Async counterpart of subprocess.run(..., capture_output=True, text=True)
+    under `limits`. Each of stdout and stderr is capped at
+    limits.max_output_bytes; once either overflows the process group is
+    killed and a truncation marker is appended. Raises
+    subprocess.TimeoutExpired after killing the process group, and
+    FileNotFoundError when the executable is missing.
+
+    Peak memory: Linux carries the spawning process's RSS high-water mark
+    into the child at exec, so wait4's ru_maxrss is only the program's own
+    peak when it exceeds the server's. Otherwise the VmHWM sampled from
+    /proc while it ran is used, or None if it exited too quickly for the
+    first sample (taken right after exec) to be followed by another.
+    """
+    spawn_floor = peak_memory_kb(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    proc = await _spawn(
+        args,
+        cwd=cwd,
+        stdin=subprocess.PIPE if stdin is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=limits.preexec(args[0]),
+    )
+    loop = asyncio.get_running_loop()
+    out_fd, err_fd = proc.stdout.fileno(), proc.stderr.fileno()
+    buffers = {out_fd: bytearray(), err_fd: bytearray()}
+    open_fds = set(buffers)
+    outputs_done = loop.create_future()
+    overflowed = set()
+
+    def close_reader(fd: int):
+        loop.remove_reader(fd)
+        open_fds.discard(fd)
+        if not open_fds and not outputs_done.done():
+            outputs_done.set_result(None)
+
+    def on_readable(fd: int):
+        try:
+            chunk = os.read(fd, 65536)
+        except BlockingIOError:
+            return
+        if not chunk:
+            close_reader(fd)
+            return
+        buffer = buffers[fd]
+        room = limits.max_output_bytes - len(buffer)
+        buffer += chunk[:max(room, 0)]
+        if len(chunk) > room:
+            # Stop reading; the process would only keep producing more.
+            overflowed.add(fd)
+            _kill_group(proc)
+            for other in list(open_fds):
+                close_reader(other)
+
+    for fd in buffers:
+        os.set_blocking(fd, False)
+        loop.add_reader(fd, on_readable, fd)
+
+    pending = stdin.encode("utf-8") if stdin else b""
+
+    def on_writable():
+        nonlocal pending
+        try:
+            written = os.write(proc.stdin.fileno(), pending[:65536])
+        except BlockingIOError:
+            return
+        except (BrokenPipeError, ConnectionResetError):
+            written = len(pending)
+        pending = pending[written:]
+        if not pending:
+            loop.remove_writer(proc.stdin.fileno())
+            proc.stdin.close()
+
+    if proc.stdin is not None:
+        if pending:
+            os.set_blocking(proc.stdin.fileno(), False)
+            loop.add_writer(proc.stdin.fileno(), on_writable)
+        else:
+            proc.stdin.close()
+
+    sampled = [0, 0]
+    sampler = asyncio.ensure_future(_sample_hwm(proc.pid, sampled))
+    reaped = asyncio.ensure_future(_reap(proc.pid))
+    # Background processes it leaves behind would hold the pipes open
+    reaped.add_done_callback(lambda _: _kill_group(proc))
+    timed_out = False
+    try:
+        await asyncio.wait_for(asyncio.shield(asyncio.gather(outputs_done, reaped)), timeout=timeout)
+    except asyncio.TimeoutError:
+        timed_out = True
+    except asyncio.CancelledError:
+        # Client went away; never leave the child running.
+        _kill_group(proc)
+        sampler.cancel()
+        proc.returncode, _ = await reaped
+        raise
+    finally:
+        # Also takes down anything the program left running in its group
+        _kill_group(proc)
+        for fd in list(open_fds):
+            close_reader(fd)
+        if proc.stdin is not None and not proc.stdin.closed:
+            loop.remove_writer(proc.stdin.fileno())
+            proc.stdin.close()
+        proc.stdout.close()
+        proc.stderr.close()
+
+    returncode, usage = await reaped
+    # Popen must not try to reap the pid again
+    proc.returncode = returncode
+    sampler.cancel()
+    if timed_out:
+        raise subprocess.TimeoutExpired(args, timeout)
+
+    peak = peak_memory_kb(usage.ru_maxrss)
+    if peak <= spawn_floor:
+        peak = sampled[0] if sampled[1] > 1 else None
+    stdout, stderr = (
+        decode_output(bytes(buffers[fd])) + (truncation_marker(limits.max_output_bytes) if fd in overflowed else "")
+        for fd in (out_fd, err_fd)
+    )
+    return ProcessResult(
+        returncode,
+        stdout,
+        stderr,
+        cpu_time=usage.ru_utime + usage.ru_stime,
+        peak_memory_kb=peak,
+        truncated=bool(overflowed),
+    )
+
+
+async def stream_process(args: list[str], cwd: str, timeout: float, max_bytes: int,
+                         stdin: asyncio.Queue | None = None, limits: RunLimits = DEFAULT_LIMITS):
+    """
+    Run a process and yield (kind, payload) events as output is produced:
+    ("stdout" | "stderr", text), ("truncated", None) once max_bytes of
+    combined output have been forwarded, ("timeout", None), and finally
+    ("exit", returncode) when the process ends on its own.
+
+    `stdin` is an optional queue of strings fed to the process as they
+    arrive; None in the queue closes the pipe. Without it stdin is at EOF.
+    The process runs under `limits`, and its process group is killed if
+    the consumer stops iterating.
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *args,
+        cwd=cwd,
+        stdin=asyncio.subprocess.PIPE,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE,
+        start_new_session=True,
+        preexec_fn=limits.preexec(args[0]),
+    )
+    events: asyncio.Queue = asyncio.Queue(maxsize=16)
+    closing = False
+
+    async def pump(stream: asyncio.StreamReader, kind: str):
+        # Keeps reading (and discarding) after the consumer is done, so the
+        # pipe reaches EOF and proc.wait() can complete.
+        while chunk := await stream.read(4096):
+            if not closing:
+                await events.put((kind, chunk))
+        if not closing:
+            await events.put((kind, None))
+
+    async def feed():
+        try:
+            while stdin is not None and (text := await stdin.get()) is not None:
+                proc.stdin.write(text.encode("utf-8"))
+                await proc.stdin.drain()
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        finally:
+            proc.stdin.close()
+
+    pumps = [
+        asyncio.create_task(pump(proc.stdout, "stdout")),
+        asyncio.create_task(pump(proc.stderr, "stderr")),
+    ]
+    feeder = asyncio.create_task(feed())
+    encoding = locale.getpreferredencoding(False)
+    decoders = {kind: codecs.getincrementaldecoder(encoding)(errors="replace") for kind in ("stdout", "stderr")}
+    deadline = asyncio.get_running_loop().time() + timeout
+    remaining_bytes = max_bytes
+    open_streams = 2
+    try:
+        while open_streams:
+            try:
+                kind, chunk = await asyncio.wait_for(events.get(), deadline - asyncio.get_running_loop().time())
+            except asyncio.TimeoutError:
+                yield "timeout", None
+                return
+            if chunk is None:
+                open_streams -= 1
+                tail = decoders[kind].decode(b"", final=True)
+                if tail:
+                    yield kind, tail
+                continue
+            if len(chunk) > remaining_bytes:
+                text = decoders[kind].decode(chunk[:remaining_bytes], final=True)
+                if text:
+                    yield kind, text
+                yield "truncated", None
+                return
+            remaining_bytes -= len(chunk)
+            text = decoders[kind].decode(chunk)
+            if text:
+                yield kind, text
+        yield "exit", await proc.wait()
+    finally:
+        closing = True
+        feeder.cancel()
+        # Also takes down anything the program left running in its group
+        _kill_group(proc)
+        # Unblock pumps waiting on a full queue
+        while not events.empty():
+            events.get_nowait()
+        await asyncio.gather(*pumps, return_exceptions=True)
+        await proc.wait()
+
+
+_engine: ExecutionEngine | None = None
+
+
+def get_engine() -> ExecutionEngine:
+    """Shared engine, created lazily so its semaphores bind to the serving loop."""
+    global _engine
+    if _engine is None:
+        _engine = ExecutionEngine()
+    return _engine
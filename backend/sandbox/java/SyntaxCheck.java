@@ -0,0 +1,177 @@
+import javax.tools.Diagnostic;
+import javax.tools.DiagnosticCollector;
+import javax.tools.FileObject;
+import javax.tools.ForwardingJavaFileManager;
+import javax.tools.JavaCompiler;
+import javax.tools.JavaFileObject;
+import javax.tools.SimpleJavaFileObject;
+import javax.tools.StandardJavaFileManager;
+import javax.tools.ToolProvider;
+import java.io.BufferedInputStream;
+import java.io.BufferedOutputStream;
+import java.io.DataInputStream;
+import java.io.DataOutputStream;
+import java.io.EOFException;
+import java.io.IOException;
+import java.io.OutputStream;
+import java.net.URI;
+import java.nio.charset.StandardCharsets;
+import java.util.List;
+import java.util.Locale;
+
+/**
+ * Resident compile checker for CodeSnap Java submissions.
+ *
+ * Reads requests from stdin, each a class name and a source as big-endian
+ * u32 lengths followed by UTF-8 bytes, and answers each with a u32 status
+ * (0 compiled, 1 errors) and the diagnostics, formatted as the javac
+ * command line prints them for ClassName.java. Sources are compiled in
+ * memory with annotation processing off; class files are discarded and
+ * nothing is ever loaded or run, so submissions have no way to reach this
+ * process. Sends HANDSHAKE once javac is warm. See sandbox/precheck.py.
+ */
+public final class SyntaxCheck {
+    static final int HANDSHAKE = 0x43535943;
+    static final List<String> OPTIONS = List.of("-proc:none", "-implicit:none");
+
+    private SyntaxCheck() {
+    }
+
+    public static void main(String[] args) throws IOException {
+        DataInputStream in = new DataInputStream(new BufferedInputStream(System.in));
+        DataOutputStream out = new DataOutputStream(new BufferedOutputStream(System.out));
+        JavaCompiler compiler = ToolProvider.getSystemJavaCompiler();
+        if (compiler == null) {
+            System.err.println("SyntaxCheck: no system Java compiler (is this a JRE?)");
+            System.exit(2);
+        }
+        StandardJavaFileManager standard = compiler.getStandardFileManager(null, Locale.ROOT, StandardCharsets.UTF_8);
+        DiscardingFileManager files = new DiscardingFileManager(standard);
+
+        // Warm up javac so the first real check does not pay for it
+        compile(compiler, files, "Warmup", "class Warmup { public static void main(String[] a) {} }");
+        out.writeInt(HANDSHAKE);
+        out.flush();
+
+        while (true) {
+            String className;
+            try {
+                className = readString(in);
+            } catch (EOFException e) {
+                return;
+            }
+            String source = readString(in);
+            String errors = compile(compiler, files, className, source);
+            out.writeInt(errors == null ? 0 : 1);
+            byte[] text = (errors == null ? "" : errors).getBytes(StandardCharsets.UTF_8);
+            out.writeInt(text.length);
+            out.write(text);
+            out.flush();
+        }
+    }
+
+    /** null when the source compiles, else the diagnostics as javac prints them. */
+    private static String compile(JavaCompiler compiler, DiscardingFileManager files, String className,
+                                  String source) {
+        DiagnosticCollector<JavaFileObject> diagnostics = new DiagnosticCollector<>();
+        boolean ok = compiler.getTask(null, files, diagnostics, OPTIONS, null,
+                List.of(new SourceFile(className, source))).call();
+        return ok ? null : formatDiagnostics(diagnostics.getDiagnostics(), className + ".java", source);
+    }
+
+    /** Render diagnostics the way the javac command line prints them. */
+    static String formatDiagnostics(List<Diagnostic<? extends JavaFileObject>> diagnostics, String fileName,
+                                    String source) {
+        String[] lines = source.split("\r?\n", -1);
+        StringBuilder text = new StringBuilder();
+        int errors = 0;
+        int warnings = 0;
+        for (Diagnostic<? extends JavaFileObject> d : diagnostics) {
+            String message = d.getMessage(Locale.ROOT);
+            String label;
+            switch (d.getKind()) {
+                case ERROR:
+                    label = "error: ";
+                    errors++;
+                    break;
+                case WARNING:
+                case MANDATORY_WARNING:
+                    label = "warning: ";
+                    warnings++;
+                    break;
+                default:
+                    text.append("Note: ").append(message).append('\n');
+                    continue;
+            }
+            String[] parts = message.split("\n", 2);
+            long line = d.getLineNumber();
+            if (line != Diagnostic.NOPOS) {
+                text.append(fileName).append(':').append(line).append(": ");
+            }
+            text.append(label).append(parts[0]).append('\n');
+            if (line != Diagnostic.NOPOS && line <= lines.length) {
+                String sourceLine = lines[(int) line - 1];
+                text.append(sourceLine).append('\n');
+                long column = d.getColumnNumber();
+                for (int i = 0; i < column - 1 && i < sourceLine.length(); i++) {
+                    text.append(sourceLine.charAt(i) == '\t' ? '\t' : ' ');
+                }
+                text.append("^\n");
+            }
+            if (parts.length > 1) {
+                text.append(parts[1]).append('\n');
+            }
+        }
+        if (errors > 0) {
+            text.append(errors).append(errors == 1 ? " error\n" : " errors\n");
+        }
+        if (warnings > 0) {
+            text.append(warnings).append(warnings == 1 ? " warning\n" : " warnings\n");
+        }
+        return text.toString();
+    }
+
+    private static String readString(DataInputStream in) throws IOException {
+        byte[] data = new byte[in.readInt()];
+        in.readFully(data);
+        return new String(data, StandardCharsets.UTF_8);
+    }
+
+    private static final class SourceFile extends SimpleJavaFileObject {
+        private final String code;
+
+        SourceFile(String className, String code) {
+            super(URI.create("string:///" + className + Kind.SOURCE.extension), Kind.SOURCE);
+            this.code = code;
+        }
+
+        @Override
+        public CharSequence getCharContent(boolean ignoreEncodingErrors) {
+            return code;
+        }
+    }
+
+    /** Class files go nowhere; only the diagnostics matter. */
+    private static final class DiscardingFileManager extends ForwardingJavaFileManager<StandardJavaFileManager> {
+        DiscardingFileManager(StandardJavaFileManager standard) {
+            super(standard);
+        }
+
+        @Override
+        public JavaFileObject getJavaFileForOutput(Location location, String className, JavaFileObject.Kind kind,
+                                                   FileObject sibling) {
+            URI uri = URI.create("mem:///" + className.replace('.', '/') + kind.extension);
+            return new SimpleJavaFileObject(uri, kind) {
+                @Override
+                public OutputStream openOutputStream() {
+                    return OutputStream.nullOutputStream();
+                }
+            };
+        }
+
+        @Override
+        public void close() {
+            // Shared by every check for the life of the process
+        }
+    }
+}
@@ -0,0 +1,42 @@
+/**
+ * Resident syntax checker for CodeSnap JavaScript submissions.
+ *
+ * Reads sources from stdin, each a big-endian u32 length followed by UTF-8
+ * bytes, and answers each with one JSON line on stdout:
+ * {"ok": true} or {"ok": false, "message": ..., "text": ...}, where text is
+ * the decorated error (location, source line, caret, message) exactly as
+ * `node -e` prints it before the stack trace. Sources are only compiled as
+ * a script with vm.Script, never run. See sandbox/precheck.py.
+ */
+"use strict";
+
+const vm = require("vm");
+
+function check(source) {
+  try {
+    new vm.Script(source, { filename: "[eval]" });
+    return { ok: true };
+  } catch (e) {
+    if (!(e instanceof SyntaxError)) {
+      return { ok: true };
+    }
+    const stack = String(e.stack);
+    const at = stack.indexOf("\n    at ");
+    return { ok: false, message: e.message, text: at < 0 ? stack : stack.slice(0, at) };
+  }
+}
+
+let pending = Buffer.alloc(0);
+process.stdin.on("data", (chunk) => {
+  pending = Buffer.concat([pending, chunk]);
+  while (pending.length >= 4) {
+    const length = pending.readUInt32BE(0);
+    if (pending.length < 4 + length) {
+      break;
+    }
+    const source = pending.subarray(4, 4 + length).toString("utf8");
+    pending = pending.subarray(4 + length);
+    process.stdout.write(JSON.stringify(check(source)) + "\n");
+  }
+});
+process.stdin.on("end", () => process.exit(0));
@@ -0,0 +1,102 @@
+"""
+Kernel-enforced resource limits for sandboxed runs.
+
+Every compile and run process gets rlimits set between fork and exec:
+address space (or data segment, see below), CPU seconds, process count,
+largest file it may write, and no core dumps. It is also started in its own
+session so a timeout or truncation kills the whole process group, including
+anything it forked.
+
+The JVM and V8 reserve large virtual ranges up front that they never touch,
+so for java/javac and node the memory cap applies to RLIMIT_DATA (memory
+actually made writable) instead of RLIMIT_AS; java additionally gets a heap
+cap so its initial heap fits. RLIMIT_NPROC counts every process and thread
+of the user the server runs as, so size it with the server's own threads in
+mind (it does not apply to root).
+"""
+import os
+import resource
+import signal
+from dataclasses import dataclass
+
+MEMORY_MB = int(os.getenv("CODESNAP_RUN_MEMORY_MB", "512"))
+CPU_SECONDS = int(os.getenv("CODESNAP_RUN_CPU_SECONDS", "5"))
+MAX_PROCESSES = int(os.getenv("CODESNAP_RUN_MAX_PROCESSES", "256"))
+MAX_FILE_MB = int(os.getenv("CODESNAP_RUN_MAX_FILE_MB", "16"))
+MAX_OUTPUT_BYTES = int(os.getenv("CODESNAP_RUN_MAX_OUTPUT_BYTES", str(64 * 1024)))
+
+_DATA_LIMITED = ("java", "javac", "node")
+
+
+@dataclass(frozen=True)
+class RunLimits:
+    memory_mb: int = MEMORY_MB
+    cpu_seconds: int = CPU_SECONDS
+    max_processes: int = MAX_PROCESSES
+    max_file_mb: int = MAX_FILE_MB
+    max_output_bytes: int = MAX_OUTPUT_BYTES
+
+    def rlimits(self, executable: str) -> list[tuple[int, tuple[int, int]]]:
+        """(resource, (soft, hard)) pairs for one command; a limit of 0 means unlimited."""
+        limits = [(resource.RLIMIT_CORE, (0, 0))]
+        if self.memory_mb > 0:
+            memory = self.memory_mb * 1024 * 1024
+            kind = resource.RLIMIT_DATA if os.path.basename(executable) in _DATA_LIMITED else resource.RLIMIT_AS
+            limits.append((kind, (memory, memory)))
+        if self.cpu_seconds > 0:
+            # SIGXCPU at the soft limit, SIGKILL a second later
+            limits.append((resource.RLIMIT_CPU, (self.cpu_seconds, self.cpu_seconds + 1)))
+        if self.max_processes > 0:
+            limits.append((resource.RLIMIT_NPROC, (self.max_processes, self.max_processes)))
+        if self.max_file_mb > 0:
+            size = self.max_file_mb * 1024 * 1024
+            limits.append((resource.RLIMIT_FSIZE, (size, size)))
+        return limits
+
+    def preexec(self, executable: str):
+        """
+        A preexec_fn applying the limits in the child. The list is built
+        here, in the parent, so the child only makes setrlimit calls.
+        """
+        limits = self.rlimits(executable)
+
+        def apply():
+            for kind, value in limits:
+                try:
+                    resource.setrlimit(kind, value)
+                except (ValueError, OSError):
+                    # Never raise a limit above an existing hard limit
+                    soft, hard = resource.getrlimit(kind)
+                    if hard != resource.RLIM_INFINITY:
+                        resource.setrlimit(kind, (min(value[0], hard), hard))
+
+        return apply
+
+    def java_heap_flag(self, launcher: str = "java") -> list[str]:
+        """Heap cap so the JVM's initial heap fits under RLIMIT_DATA."""
+        if self.memory_mb <= 0:
+            return []
+        flag = f"-Xmx{max(64, self.memory_mb // 2)}m"
+        return [f"-J{flag}"] if launcher == "javac" else [flag]
+
+
+DEFAULT_LIMITS = RunLimits()
+
+
+def describe_exit(returncode: int | None, limits: RunLimits, cpu_time: float | None = None) -> str | None:
+    """Explain exits caused by a limit (signals from the kernel), else None."""
+    if returncode is None or returncode >= 0:
+        return None
+    sig = -returncode
+    # SIGKILL at the hard CPU limit, if the program ignored SIGXCPU
+    if sig == signal.SIGXCPU or (
+        sig == signal.SIGKILL and limits.cpu_seconds > 0 and cpu_time is not None and cpu_time >= limits.cpu_seconds
+    ):
+        return f"CPU time limit exceeded ({limits.cpu_seconds} seconds)"
+    if sig == signal.SIGXFSZ:
+        return f"File size limit exceeded ({limits.max_file_mb} MB)"
+    return None
+
+
+def truncation_marker(limit: int) -> str:
+    return f"\n... output truncated (limit {limit} bytes)"
@@ -0,0 +1,425 @@
+"""
+Syntax pre-check for /api/run, before a workspace or process is used.
+
+Python is parsed in-process with compile(), the same parser `python -c`
+uses, and the error (with any SyntaxWarnings before it) is formatted the way
+the interpreter prints it. That is only done when the sandbox's `python` is
+the server's own version.
+
+JavaScript goes to one resident node process (sandbox/js/syntax_check.js)
+that compiles the source as a script with vm.Script. The stack trace `node
+-e` prints after the message comes from node's internals and is the same
+for every syntax error, so it is captured once from a real `node -e` run.
+Errors that make node retry the source as an ES module are left to the real
+run, since the module parse decides what it prints.
+
+Java goes to one resident JVM (sandbox/java/SyntaxCheck.java) that
+compiles the source in memory with the JDK's compiler API and answers with
+the diagnostics formatted as the javac command line prints them. Nothing it
+compiles is loaded or run, and class files are discarded. Checks are not
+queued: while one is in flight, or while the JVM (re)starts, the run just
+compiles as usual.
+
+C gets no pre-check. gcc has no resident mode, so checking would cost a
+process per submission, about what the real compile costs; repeated broken
+sources are answered from the failure entries of sandbox/compile_cache.py.
+
+Resident checkers start in the background. A failed start is retried after
+CODESNAP_RUN_PRECHECK_RETRY_MIN seconds, doubling up to
+CODESNAP_RUN_PRECHECK_RETRY_MAX, and a checker that stops answering is
+replaced on the next check.
+
+A None result means "no error found, or unknown": callers run the code as
+usual.
+"""
+import asyncio
+import json
+import os
+import platform
+import re
+import shutil
+import struct
+import subprocess
+import tempfile
+import time
+import warnings
+from dataclasses import dataclass, replace
+from pathlib import Path
+
+from sandbox.compile_cache import toolchain_version
+from sandbox.limits import DEFAULT_LIMITS
+from sandbox.runner import _extract_java_class_name
+
+PRECHECK = os.getenv("CODESNAP_RUN_PRECHECK", "1") != "0"
+CHECK_TIMEOUT = float(os.getenv("CODESNAP_RUN_PRECHECK_TIMEOUT", "1"))
+JAVA_CHECK_TIMEOUT = float(os.getenv("CODESNAP_RUN_PRECHECK_JAVA_TIMEOUT", "2"))
+JAVA_START_TIMEOUT = float(os.getenv("CODESNAP_RUN_PRECHECK_JAVA_START_TIMEOUT", "20"))
+JAVA_MAX_CHECKS = int(os.getenv("CODESNAP_RUN_PRECHECK_JAVA_MAX_CHECKS", "500"))
+RETRY_MIN = float(os.getenv("CODESNAP_RUN_PRECHECK_RETRY_MIN", "1"))
+RETRY_MAX = float(os.getenv("CODESNAP_RUN_PRECHECK_RETRY_MAX", "60"))
+
+CHECKER_SOURCE = Path(__file__).parent / "js" / "syntax_check.js"
+JAVA_CHECKER_SOURCE = Path(__file__).parent / "java" / "SyntaxCheck.java"
+_JAVA_HANDSHAKE = 0x43535943
+
+# node >= 20.10 re-evaluates the source as an ES module after these errors
+_ESM_RETRY_MESSAGES = (
+    "Cannot use import statement outside a module",
+    "Unexpected token 'export'",
+    "Cannot use 'import.meta' outside a module",
+    "await is only valid in async functions and the top level bodies of modules",
+    "Identifier 'module' has already been declared",
+    "Identifier 'exports' has already been declared",
+    "Identifier 'require' has already been declared",
+    "Identifier '__filename' has already been declared",
+    "Identifier '__dirname' has already been declared",
+)
+
+
+@dataclass
+class Diagnostic:
+    text: str
+    line: int | None = None
+    column: int | None = None
+
+
+_counts = {language: {"checks": 0, "rejected": 0} for language in ("python", "javascript", "java")}
+
+
+def _python_matches_sandbox() -> bool:
+    try:
+        return toolchain_version("python") == f"Python {platform.python_version()}"
+    except (OSError, subprocess.SubprocessError):
+        return False
+
+
+def _format_syntax_error(e: SyntaxError) -> str:
+    """
+    As the interpreter's own display prints it, which differs from the
+    traceback module: leading tabs are stripped too, the caret is padded
+    with spaces, and indentation errors get a single caret.
+    """
+    lines = [f'  File "{e.filename}", line {e.lineno}\n']
+    if e.text is not None:
+        text = e.text.rstrip("\n")
+        source = text.lstrip(" \t\f")
+        lines.append(f"    {source}\n")
+        if e.offset is not None:
+            end = e.end_offset
+            if isinstance(e, IndentationError) or end in (None, 0, -1) or end == e.offset:
+                end = e.offset + 1
+            column = e.offset - (len(text) - len(source))
+            if column >= 1:
+                lines.append("    " + " " * (column - 1) + "^" * (end - e.offset) + "\n")
+    lines.append(f"{type(e).__name__}: {e.msg}\n")
+    return "".join(lines)
+
+
+def check_python(code: str) -> Diagnostic | None:
+    if not _python_matches_sandbox():
+        return None
+    with warnings.catch_warnings(record=True) as caught:
+        # The interpreter's default filters hide the DeprecationWarnings
+        # the compiler raises (invalid escapes before 3.12); only
+        # SyntaxWarnings reach the user
+        warnings.simplefilter("ignore")
+        warnings.simplefilter("always", SyntaxWarning)
+        try:
+            # python -c appends a newline before compiling
+            compile(code + "\n", "<string>", "exec", dont_inherit=True)
+            return None
+        except SyntaxError as e:
+            error = e
+        except (ValueError, RecursionError, MemoryError):
+            # Null bytes or pathological nesting: leave it to the real run
+            return None
+
+    shown = []
+    for warning in caught:
+        text = warnings.formatwarning(warning.message, warning.category, warning.filename, warning.lineno)
+        # Printed once per location, as under the default filter
+        if text not in shown:
+            shown.append(text)
+    return Diagnostic("".join(shown) + _format_syntax_error(error), error.lineno, error.offset)
+
+
+class _NodeChecker:
+    def __init__(self, proc: asyncio.subprocess.Process, trailer: str):
+        self.proc = proc
+        self.trailer = trailer
+        self.lock = asyncio.Lock()
+
+    @classmethod
+    async def start(cls) -> "_NodeChecker":
+        # What `node -e` prints after the error message: stack frames and version
+        probe = await asyncio.create_subprocess_exec(
+            "node", "-e", "(",
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        _, stderr = await asyncio.wait_for(probe.communicate(), 10)
+        output = stderr.decode("utf-8", errors="replace")
+        at = output.find("\n    at ")
+        if "SyntaxError: " not in output or at < 0:
+            raise RuntimeError("unexpected `node -e` output")
+        proc = await asyncio.create_subprocess_exec(
+            "node", str(CHECKER_SOURCE),
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+        )
+        return cls(proc, output[at:])
+
+    async def check(self, code: str) -> dict:
+        source = code.encode("utf-8", errors="surrogatepass")
+        async with self.lock:
+            self.proc.stdin.write(struct.pack("!I", len(source)) + source)
+            await self.proc.stdin.drain()
+            line = await asyncio.wait_for(self.proc.stdout.readline(), CHECK_TIMEOUT)
+        if not line:
+            raise ConnectionError("syntax checker exited")
+        return json.loads(line)
+
+    async def close(self):
+        if self.proc.returncode is None:
+            self.proc.kill()
+        await self.proc.wait()
+
+
+
+class _JavaChecker:
+    def __init__(self, proc: asyncio.subprocess.Process):
+        self.proc = proc
+        self.lock = asyncio.Lock()
+        self.checks = 0
+
+    @classmethod
+    async def start(cls) -> "_JavaChecker":
+        classes = await asyncio.to_thread(_build_java_checker)
+        # Its memory is capped like a compile's; CPU is not, as it lives on
+        limits = replace(DEFAULT_LIMITS, cpu_seconds=0)
+        proc = await asyncio.create_subprocess_exec(
+            "java", *limits.java_heap_flag(), "-XX:+UseSerialGC", "-Xshare:auto", "-cp", classes, "SyntaxCheck",
+            stdin=asyncio.subprocess.PIPE,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.DEVNULL,
+            cwd=classes,
+            preexec_fn=limits.preexec("java"),
+            start_new_session=True,
+        )
+        try:
+            handshake = await asyncio.wait_for(proc.stdout.readexactly(4), JAVA_START_TIMEOUT)
+            if struct.unpack("!I", handshake)[0] != _JAVA_HANDSHAKE:
+                raise RuntimeError("unexpected SyntaxCheck handshake")
+        except BaseException:
+            proc.kill()
+            await proc.wait()
+            raise
+        return cls(proc)
+
+    async def _exchange(self, class_name: bytes, source: bytes) -> str | None:
+        self.proc.stdin.write(struct.pack("!I", len(class_name)) + class_name + struct.pack("!I", len(source)) + source)
+        await self.proc.stdin.drain()
+        status, length = struct.unpack("!II", await self.proc.stdout.readexactly(8))
+        text = await self.proc.stdout.readexactly(length)
+        return text.decode("utf-8", errors="replace") if status else None
+
+    async def check(self, class_name: str, code: str) -> str | None:
+        """javac's diagnostics for the source saved as class_name.java, or None if it compiles."""
+        async with self.lock:
+            self.checks += 1
+            return await asyncio.wait_for(
+                self._exchange(class_name.encode("utf-8"), code.encode("utf-8", errors="surrogatepass")),
+                JAVA_CHECK_TIMEOUT,
+            )
+
+    async def close(self):
+        if self.proc.returncode is None:
+            self.proc.kill()
+        await self.proc.wait()
+
+
+_java_classes: str | None = None
+
+
+def _build_java_checker() -> str:
+    """Compile SyntaxCheck.java once per process, into a private directory."""
+    global _java_classes
+    if _java_classes is None:
+        classes = tempfile.mkdtemp(prefix="codesnap-syntax-check-")
+        try:
+            subprocess.run(["javac", "-d", classes, str(JAVA_CHECKER_SOURCE)],
+                           capture_output=True, timeout=60, check=True)
+        except BaseException:
+            shutil.rmtree(classes, ignore_errors=True)
+            raise
+        _java_classes = classes
+    return _java_classes
+
+
+class _Resident:
+    """
+    One resident checker process. It is (re)started in the background, so
+    no request waits for a start; a start that fails is retried after a
+    delay that doubles up to RETRY_MAX and resets once a start succeeds.
+    """
+    def __init__(self, start):
+        self._start = start
+        self.checker = None
+        self.failures = 0
+        self.error: str | None = None
+        self._delay = 0.0
+        self._retry_at = 0.0
+        self._starting: asyncio.Task | None = None
+
+    def get(self):
+        """The running checker, or None while there is none."""
+        if self.checker is not None and self.checker.proc.returncode is None:
+            return self.checker
+        if self._starting is None and time.monotonic() >= self._retry_at:
+            self._starting = asyncio.create_task(self._restart())
+        return None
+
+    async def wait(self):
+        """Start the checker if needed and wait for it."""
+        self.get()
+        if self._starting is not None:
+            await asyncio.shield(self._starting)
+
+    async def _restart(self):
+        try:
+            if self.checker is not None:
+                # Reap the one that exited
+                await self.checker.close()
+                self.checker = None
+            try:
+                self.checker = await self._start()
+            except (OSError, RuntimeError, EOFError, subprocess.SubprocessError, asyncio.TimeoutError) as e:
+                self.failures += 1
+                self._delay = min(RETRY_MAX, self._delay * 2 or RETRY_MIN)
+                self._retry_at = time.monotonic() + self._delay
+                self.error = f"start failed, retrying in {self._delay:g}s: {e!r}"
+            else:
+                self._delay = 0.0
+        finally:
+            self._starting = None
+
+    async def discard(self, checker, error: BaseException | None = None):
+        """Stop a checker; the next get() starts a fresh one."""
+        if error is not None:
+            self.failures += 1
+            self.error = f"failed: {error!r}"
+        if self.checker is checker:
+            self.checker = None
+        await checker.close()
+
+    async def close(self):
+        if self._starting is not None:
+            self._starting.cancel()
+            try:
+                await self._starting
+            except asyncio.CancelledError:
+                pass
+        if self.checker is not None:
+            await self.checker.close()
+            self.checker = None
+
+
+_node = _Resident(_NodeChecker.start)
+_java = _Resident(_JavaChecker.start)
+
+
+def _javascript_diagnostic(text: str) -> Diagnostic:
+    # "[eval]:LINE", the source line, then the caret line
+    lines = text.split("\n")
+    line = column = None
+    if lines[0].startswith("[eval]:") and lines[0][len("[eval]:"):].isdigit():
+        line = int(lines[0][len("[eval]:"):])
+    if len(lines) > 2 and "^" in lines[2]:
+        column = lines[2].index("^") + 1
+    return Diagnostic(text, line, column)
+
+
+async def check_javascript(code: str) -> Diagnostic | None:
+    checker = _node.get()
+    if checker is None:
+        return None
+    try:
+        result = await checker.check(code)
+    except (OSError, ConnectionError, ValueError, asyncio.TimeoutError) as e:
+        # A reply may still be in flight; start a fresh checker next time
+        await _node.discard(checker, e)
+        return None
+    if result.get("ok") or result.get("message") in _ESM_RETRY_MESSAGES:
+        return None
+    return _javascript_diagnostic(result["text"] + checker.trailer)
+
+
+async def check_java(code: str) -> Diagnostic | None:
+    checker = _java.get()
+    if checker is None:
+        return None
+    if checker.lock.locked():
+        # One check at a time; rather than queue behind it, let javac decide
+        return None
+    if checker.checks >= JAVA_MAX_CHECKS:
+        # javac's caches only grow, so recycle the process now and then
+        await _java.discard(checker)
+        _java.get()
+        return None
+    try:
+        text = await checker.check(_extract_java_class_name(code), code)
+    except (OSError, EOFError, asyncio.TimeoutError) as e:
+        await _java.discard(checker, e)
+        return None
+    if text is None:
+        return None
+    # "Main.java:LINE: error: ..."
+    match = re.match(r"[^:\n]+\.java:(\d+): error:", text)
+    return Diagnostic(text, int(match.group(1)) if match else None)
+
+
+async def precheck(language: str, code: str) -> Diagnostic | None:
+    """The error the real run would report before running anything, or None to run the code."""
+    if not PRECHECK or language not in _counts:
+        return None
+    counts = _counts[language]
+    counts["checks"] += 1
+    if language == "python":
+        # Parsing a large submission takes a while; keep it off the event loop
+        diagnostic = await asyncio.to_thread(check_python, code)
+    elif language == "java":
+        diagnostic = await check_java(code)
+    else:
+        diagnostic = await check_javascript(code)
+    if diagnostic is not None:
+        counts["rejected"] += 1
+    return diagnostic
+
+
+async def warm_up():
+    await asyncio.to_thread(_python_matches_sandbox)
+    await _node.wait()
+    await _java.wait()
+
+
+async def shutdown_precheck():
+    global _java_classes
+    await _node.close()
+    await _java.close()
+    if _java_classes is not None:
+        shutil.rmtree(_java_classes, ignore_errors=True)
+        _java_classes = None
+
+
+def precheck_stats() -> dict:
+    return {
+        "enabled": PRECHECK,
+        **{language: dict(counts) for language, counts in _counts.items()},
+        "javascript_checker_failures": _node.failures,
+        "javascript_checker_error": _node.error,
+        "java_checker_failures": _java.failures,
+        "java_checker_error": _java.error,
+        "java_checker_checks": _java.checker.checks if _java.checker is not None else 0,
+    }
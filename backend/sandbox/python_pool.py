@@ -0,0 +1,364 @@
+"""
+Warm interpreter pool for Python runs.
+
+Each pool worker is a long-lived "zygote" interpreter that has already paid
+for startup and site imports. For every submission the zygote forks a fresh
+child, so no state leaks between runs, and the child executes the code the
+same way `python -c` would. Zygotes are recycled after a configurable number
+of runs.
+
+The child applies the run's rlimits and starts its own session before
+executing anything; the zygote reaps it with wait4 and reports its CPU time
+and peak memory. A forked child starts from the small zygote rather than
+the server, so its ru_maxrss is its own.
+"""
+import json
+import locale
+import os
+import queue
+import selectors
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+from sandbox.limits import DEFAULT_LIMITS, RunLimits, truncation_marker
+
+POOL_SIZE = int(os.getenv("CODESNAP_PY_POOL_SIZE", str(min(4, os.cpu_count() or 1))))
+RECYCLE_AFTER = int(os.getenv("CODESNAP_PY_POOL_RECYCLE_AFTER", "100"))
+ACQUIRE_TIMEOUT = float(os.getenv("CODESNAP_PY_POOL_ACQUIRE_TIMEOUT", "0.5"))
+
+# Runs inside each zygote. Kept free of pool imports so the forked child
+# starts from a near-pristine interpreter, just like `python -c`.
+_BOOTSTRAP = r"""
+import json, os, socket, struct, sys
+
+def _recv_exact(sock, n, buf=b""):
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            sys.exit(0)
+        buf += chunk
+    return buf
+
+def _child(sock, job, fds):
+    import resource
+    sock.close()
+    for target, fd in enumerate(fds):
+        os.dup2(fd, target)
+        os.close(fd)
+    os.setsid()
+    for kind, soft, hard in job["rlimits"]:
+        try:
+            resource.setrlimit(kind, (soft, hard))
+        except (ValueError, OSError):
+            # Never raise a limit above an existing hard limit
+            current = resource.getrlimit(kind)[1]
+            if current != resource.RLIM_INFINITY:
+                resource.setrlimit(kind, (min(soft, current), current))
+    os.chdir(job["cwd"])
+    sys.argv = ["-c"] + job["args"]
+    main = type(sys)("__main__")
+    sys.modules["__main__"] = main
+    try:
+        # python -c appends a newline too, which shows in some syntax errors
+        exec(compile(job["code"] + "\n", "<string>", "exec"), main.__dict__)
+    except SystemExit:
+        raise
+    except BaseException:
+        etype, value, tb = sys.exc_info()
+        sys.excepthook(etype, value.with_traceback(tb.tb_next), tb.tb_next)
+        sys.exit(1)
+    sys.exit(0)
+
+def _serve(sock):
+    while True:
+        header, fds, _, _ = socket.recv_fds(sock, 4, 3)
+        if not header:
+            return
+        (length,) = struct.unpack("!I", _recv_exact(sock, 4, header))
+        job = json.loads(_recv_exact(sock, length))
+        pid = os.fork()
+        if pid == 0:
+            _child(sock, job, fds)
+        for fd in fds:
+            os.close(fd)
+        sock.sendall(json.dumps({"pid": pid}).encode() + b"\n")
+        _, status, usage = os.wait4(pid, 0)
+        reply = {
+            "status": os.waitstatus_to_exitcode(status),
+            "cpu": usage.ru_utime + usage.ru_stime,
+            "maxrss": usage.ru_maxrss,
+        }
+        sock.sendall(json.dumps(reply).encode() + b"\n")
+
+_serve(socket.socket(fileno=int(sys.argv[1])))
+"""
+
+
+class PoolUnavailable(Exception):
+    """Raised when no warm worker could take the job; callers fall back to a cold spawn."""
+
+
+@dataclass
+class ProcessResult:
+    returncode: int
+    stdout: str
+    stderr: str
+    cpu_time: float | None = None
+    peak_memory_kb: int | None = None
+    truncated: bool = False
+
+
+def peak_memory_kb(maxrss: int) -> int:
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    return maxrss // 1024 if sys.platform == "darwin" else maxrss
+
+
+def _kill_child(pid: int):
+    """Kill the child's process group, or the child itself if it has not called setsid yet."""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        try:
+            os.kill(pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+
+class _Zygote:
+    def __init__(self):
+        parent_sock, child_sock = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            self.proc = subprocess.Popen(
+                ["python", "-c", _BOOTSTRAP, str(child_sock.fileno())],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                pass_fds=(child_sock.fileno(),),
+            )
+        finally:
+            child_sock.close()
+        self.sock = parent_sock
+        self.reader = parent_sock.makefile("rb")
+        self.uses = 0
+
+    def submit(self, job: dict, fds: tuple[int, int, int]):
+        payload = json.dumps(job).encode("utf-8")
+        header = struct.pack("!I", len(payload))
+        socket.send_fds(self.sock, [header], list(fds))
+        self.sock.sendall(payload)
+
+    def read_message(self, timeout: float) -> dict:
+        self.sock.settimeout(timeout)
+        line = self.reader.readline()
+        if not line:
+            raise PoolUnavailable("Python worker exited unexpectedly")
+        return json.loads(line)
+
+    def close(self):
+        try:
+            self.reader.close()
+            self.sock.close()
+        finally:
+            if self.proc.poll() is None:
+                self.proc.kill()
+            self.proc.wait()
+
+
+class PythonPool:
+    """Fixed-size pool of warm Python zygotes."""
+
+    def __init__(self, size: int = POOL_SIZE, recycle_after: int = RECYCLE_AFTER):
+        self.size = size
+        self.recycle_after = recycle_after
+        self._idle: queue.Queue[_Zygote] = queue.Queue()
+        for _ in range(size):
+            self._idle.put(_Zygote())
+
+    def run(self, code: str, cwd: str, timeout: float, stdin: str | None = None, args: list[str] | None = None,
+            limits: RunLimits = DEFAULT_LIMITS) -> ProcessResult:
+        """
+        Execute `code` in a forked child of a warm worker, under `limits`.
+        Output is decoded like `subprocess.run(..., text=True)` and capped
+        like engine.run_process. Raises subprocess.TimeoutExpired on
+        timeout and PoolUnavailable if no worker could take the job.
+        """
+        try:
+            zygote = self._idle.get(timeout=ACQUIRE_TIMEOUT)
+        except queue.Empty:
+            raise PoolUnavailable("No idle Python worker")
+
+        healthy = False
+        try:
+            result = self._run_on(zygote, code, cwd, timeout, stdin, args or [], limits)
+            healthy = True
+            return result
+        finally:
+            zygote.uses += 1
+            if healthy and zygote.uses < self.recycle_after:
+                self._idle.put(zygote)
+            else:
+                # Replace off the request path; the old zygote is reaped there too.
+                threading.Thread(target=self._replace, args=(zygote,), daemon=True).start()
+
+    def _replace(self, zygote: _Zygote):
+        zygote.close()
+        self._idle.put(_Zygote())
+
+    def _run_on(self, zygote: _Zygote, code, cwd, timeout, stdin, args, limits):
+        deadline = time.monotonic() + timeout
+        r_in, w_in = os.pipe()
+        r_out, w_out = os.pipe()
+        r_err, w_err = os.pipe()
+        try:
+            rlimits = [(kind, *value) for kind, value in limits.rlimits("python")]
+            zygote.submit({"code": code, "cwd": cwd, "args": args, "rlimits": rlimits}, (r_in, w_out, w_err))
+        except OSError as e:
+            for fd in (w_in, r_out, r_err):
+                os.close(fd)
+            raise PoolUnavailable(str(e))
+        finally:
+            # The zygote holds its own copies now.
+            for fd in (r_in, w_out, w_err):
+                os.close(fd)
+
+        pid = None
+        try:
+            try:
+                pid = zygote.read_message(timeout)["pid"]
+            except BaseException:
+                for fd in (w_in, r_out, r_err):
+                    os.close(fd)
+                raise
+            stdout, stderr, timed_out, overflowed = _communicate(
+                w_in, stdin, r_out, r_err, deadline, limits.max_output_bytes,
+                exited_fd=zygote.sock.fileno(), on_exit=lambda: _kill_child(pid),
+            )
+            # Also takes down anything the program left running in its group
+            _kill_child(pid)
+            exited = zygote.read_message(timeout)
+            status = exited["status"]
+        except (OSError, ValueError, KeyError) as e:
+            if pid is not None:
+                _kill_child(pid)
+            raise PoolUnavailable(str(e))
+
+        if timed_out:
+            raise subprocess.TimeoutExpired(["python", "-c", code], timeout)
+        marker = truncation_marker(limits.max_output_bytes)
+        return ProcessResult(
+            status,
+            decode_output(stdout) + (marker if r_out in overflowed else ""),
+            decode_output(stderr) + (marker if r_err in overflowed else ""),
+            cpu_time=exited.get("cpu"),
+            peak_memory_kb=peak_memory_kb(exited["maxrss"]) if "maxrss" in exited else None,
+            truncated=bool(overflowed),
+        )
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+def _communicate(w_in: int, stdin: str | None, r_out: int, r_err: int, deadline: float, max_bytes: int,
+                 exited_fd: int | None = None, on_exit=None):
+    """
+    Feed stdin and drain stdout/stderr until EOF, the deadline, or either
+    stream exceeding max_bytes. Returns (stdout, stderr, timed_out,
+    overflowed read fds). Takes ownership of all three descriptors and
+    closes them. on_exit is called once exited_fd (the zygote socket,
+    which reports the child's exit) becomes readable.
+    """
+    buffers = {r_out: bytearray(), r_err: bytearray()}
+    pending = (stdin or "").encode("utf-8")
+    sel = selectors.DefaultSelector()
+    sel.register(r_out, selectors.EVENT_READ)
+    sel.register(r_err, selectors.EVENT_READ)
+    if exited_fd is not None:
+        sel.register(exited_fd, selectors.EVENT_READ)
+    if pending:
+        os.set_blocking(w_in, False)
+        sel.register(w_in, selectors.EVENT_WRITE)
+    else:
+        os.close(w_in)
+        w_in = None
+
+    try:
+        open_readers = 2
+        while open_readers:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return bytes(buffers[r_out]), bytes(buffers[r_err]), True, set()
+            for key, _ in sel.select(remaining):
+                fd = key.fd
+                if fd == exited_fd:
+                    # Background processes it leaves behind would hold the pipes open
+                    sel.unregister(exited_fd)
+                    on_exit()
+                    continue
+                if fd == w_in:
+                    try:
+                        written = os.write(w_in, pending[:65536])
+                    except BrokenPipeError:
+                        written = len(pending)
+                    pending = pending[written:]
+                    if not pending:
+                        sel.unregister(w_in)
+                        os.close(w_in)
+                        w_in = None
+                    continue
+                chunk = os.read(fd, 65536)
+                if not chunk:
+                    sel.unregister(fd)
+                    open_readers -= 1
+                    continue
+                room = max_bytes - len(buffers[fd])
+                buffers[fd] += chunk[:max(room, 0)]
+                if len(chunk) > room:
+                    # Stop reading; the caller kills the child
+                    return bytes(buffers[r_out]), bytes(buffers[r_err]), False, {fd}
+        return bytes(buffers[r_out]), bytes(buffers[r_err]), False, set()
+    finally:
+        sel.close()
+        for fd in (w_in, r_out, r_err):
+            if fd is not None:
+                os.close(fd)
+
+
+def decode_output(data: bytes) -> str:
+    """Decode child output the way subprocess text mode does."""
+    text = data.decode(locale.getpreferredencoding(False), errors="replace")
+    return text.replace("\r\n", "\n").replace("\r", "\n")
+
+
+_pool: PythonPool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> PythonPool | None:
+    """Return the shared pool, starting it on first use. None when disabled or unsupported."""
+    global _pool
+    if POOL_SIZE <= 0 or not hasattr(os, "fork") or not hasattr(socket, "send_fds"):
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = PythonPool()
+    return _pool
+
+
+def pool_stats() -> dict:
+    return {
+        "enabled": _pool is not None,
+        "size": POOL_SIZE,
+        "recycle_after": RECYCLE_AFTER,
+        "idle": _pool._idle.qsize() if _pool is not None else 0,
+    }
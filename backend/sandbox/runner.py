@@ -0,0 +1,326 @@
+"""
+Per-language execution of /api/run submissions on this host.
+
+Shared by the API (the local execution backend, batch and streaming runs)
+and by dispatch executors, which run jobs pulled from a broker; nothing
+here depends on the web framework.
+"""
+import asyncio
+import re
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from models.schemas import RunCase, RunCaseResult, RunResponse
+from monitoring.metrics import Histogram
+from sandbox.compile_cache import get_compile_cache, toolchain_version
+from sandbox.engine import ProcessResult, get_engine, run_process
+from sandbox.limits import DEFAULT_LIMITS, describe_exit
+from sandbox.python_pool import PoolUnavailable, get_pool
+from sandbox.workspaces import get_workspace_pool
+
+MISSING_TOOLCHAIN = {
+    "python": "Python is not installed",
+    "javascript": "Node.js is not installed",
+    "java": "Java is not installed",
+    "c": "GCC is not installed",
+}
+
+
+RUN_STAGE = Histogram(
+    "codesnap_run_stage_seconds",
+    "Time spent per /run stage (setup, compile, execute, cleanup).",
+    ("language", "stage"),
+)
+
+
+@contextmanager
+def workspace(language: str):
+    """
+    Empty directory for one run, with setup and cleanup timed. Comes from
+    the workspace pool, which deletes it in the background afterwards; a
+    TemporaryDirectory when the pool is disabled.
+    """
+    pool = get_workspace_pool()
+    if pool is None:
+        with RUN_STAGE.time(language, "setup"):
+            workspace = tempfile.TemporaryDirectory()
+        try:
+            yield workspace.name
+        finally:
+            with RUN_STAGE.time(language, "cleanup"):
+                workspace.cleanup()
+        return
+
+    with RUN_STAGE.time(language, "setup"):
+        workspace = pool.acquire()
+    try:
+        yield workspace.path
+    finally:
+        with RUN_STAGE.time(language, "cleanup"):
+            pool.release(workspace)
+
+
+def error_text(result: ProcessResult) -> str | None:
+    """stderr, plus a note when the process was stopped by a resource limit"""
+    limit = describe_exit(result.returncode, DEFAULT_LIMITS, result.cpu_time)
+    if limit is None:
+        return result.stderr or None
+    return f"{result.stderr.rstrip()}\n{limit}" if result.stderr else limit
+
+
+def usage(result: ProcessResult) -> dict:
+    return {
+        "cpu_time_ms": round(result.cpu_time * 1000, 3) if result.cpu_time is not None else None,
+        "peak_memory_kb": result.peak_memory_kb,
+        "truncated": result.truncated,
+    }
+
+
+def _response(result: ProcessResult) -> RunResponse:
+    return RunResponse(output=result.stdout or None, error=error_text(result), **usage(result))
+
+
+async def execute(language: str, code: str) -> RunResponse:
+    """
+    Run one submission here: admission through the engine, a workspace,
+    then the language's runner. Raises EngineBusy on overload; any other
+    failure becomes the response's error.
+    """
+    if language not in MISSING_TOOLCHAIN:
+        return RunResponse(error=f"Unsupported language: {language}")
+
+    async with get_engine().slot(language):
+        # Create temporary directory for execution
+        with workspace(language) as temp_dir:
+            try:
+                if language == "python":
+                    return await _run_python(code, temp_dir)
+                elif language == "javascript":
+                    return await _run_javascript(code, temp_dir)
+                elif language == "java":
+                    return await _run_java(code, temp_dir)
+                elif language == "c":
+                    return await _run_c(code, temp_dir)
+            except Exception as e:
+                return RunResponse(error=f"Execution failed: {str(e)}")
+
+
+async def run_case(language: str, code: str, command: list[str], case_dir: str, case: RunCase) -> RunCaseResult:
+    """Execute a prepared command for one batch case"""
+    started = time.perf_counter()
+    result = error = None
+    try:
+        pool = await asyncio.to_thread(get_pool) if language == "python" else None
+        if pool is not None:
+            try:
+                result = await asyncio.to_thread(pool.run, code, case_dir, 2, case.stdin, case.args)
+            except PoolUnavailable:
+                pass
+        if result is None:
+            result = await run_process(command + case.args, cwd=case_dir, timeout=2, stdin=case.stdin or "")
+    except subprocess.TimeoutExpired:
+        error = "Execution timed out (2 seconds)"
+    except FileNotFoundError:
+        error = MISSING_TOOLCHAIN[language]
+    wall_time_ms = round((time.perf_counter() - started) * 1000, 3)
+    if result is None:
+        return RunCaseResult(error=error, wall_time_ms=wall_time_ms)
+    return RunCaseResult(
+        output=result.stdout or None,
+        error=error_text(result),
+        exit_code=result.returncode,
+        wall_time_ms=wall_time_ms,
+        **usage(result),
+    )
+
+
+async def _run_python(code: str, temp_dir: str) -> RunResponse:
+    """Execute Python code in a warm pool worker, falling back to python -c"""
+    pool = await asyncio.to_thread(get_pool)
+    if pool is not None:
+        try:
+            with RUN_STAGE.time("python", "execute"):
+                result = await asyncio.to_thread(pool.run, code, temp_dir, 2)
+            return _response(result)
+        except subprocess.TimeoutExpired:
+            return RunResponse(error="Execution timed out (2 seconds)")
+        except PoolUnavailable:
+            pass
+
+    try:
+        with RUN_STAGE.time("python", "execute"):
+            result = await run_process(["python", "-c", code], cwd=temp_dir, timeout=2)
+        return _response(result)
+    except subprocess.TimeoutExpired:
+        return RunResponse(error="Execution timed out (2 seconds)")
+    except FileNotFoundError:
+        return RunResponse(error="Python is not installed")
+
+
+async def _run_javascript(code: str, temp_dir: str) -> RunResponse:
+    """Execute JavaScript code using node"""
+    try:
+        with RUN_STAGE.time("javascript", "execute"):
+            result = await run_process(["node", "-e", code], cwd=temp_dir, timeout=2)
+        return _response(result)
+    except subprocess.TimeoutExpired:
+        return RunResponse(error="Execution timed out (2 seconds)")
+    except FileNotFoundError:
+        return RunResponse(error="Node.js is not installed")
+
+
+def _extract_java_class_name(code: str) -> str:
+    """Extract the public class name from Java code"""
+    # Look for public class ClassName pattern
+    match = re.search(r'public\s+class\s+(\w+)', code)
+    if match:
+        return match.group(1)
+    # Fallback: look for any class declaration
+    match = re.search(r'class\s+(\w+)', code)
+    if match:
+        return match.group(1)
+    # Last resort: use Main
+    return "Main"
+
+def _jvm_startup_flags(launcher: str = "java") -> list[str]:
+    """
+    A fresh JVM per compile and run is the isolation boundary, so make it
+    start fast: C1 only, the serial collector and the class data archive.
+    """
+    flags = ["-XX:TieredStopAtLevel=1", "-XX:+UseSerialGC", "-Xshare:auto"]
+    return [f"-J{flag}" for flag in flags] if launcher == "javac" else flags
+
+
+async def compile_key(language: str, code: str) -> tuple[list[str], str]:
+    """Compiler command and compile-cache key for Java or C source"""
+    if language == "java":
+        compiler = "javac"
+        compile_cmd = [
+            "javac", *DEFAULT_LIMITS.java_heap_flag("javac"), *_jvm_startup_flags("javac"),
+            f"{_extract_java_class_name(code)}.java",
+        ]
+    else:
+        compiler = "gcc"
+        compile_cmd = ["gcc", "temp.c", "-o", "temp"]
+    version = await asyncio.to_thread(toolchain_version, compiler)
+    return compile_cmd, get_compile_cache().key(language, code, compile_cmd, version)
+
+
+# A diagnostic the compiler reported against the source:
+# "temp.c:3:5: error: ..." from gcc, "Main.java:3: error: ..." from javac
+_SOURCE_ERROR = re.compile(r"^[^:\n]+:\d+:(?:\d+:)? (?:fatal )?error: ", re.MULTILINE)
+
+
+def _compile_failed(cache_key: str, result: ProcessResult) -> RunResponse:
+    error = error_text(result) or "Compilation failed"
+    # Only the compiler's verdict on the source is worth remembering. A
+    # signal or limit, a crash, running out of memory or a linker failure
+    # says nothing about the next attempt
+    if result.returncode > 0 and not result.truncated and _SOURCE_ERROR.search(result.stderr or ""):
+        get_compile_cache().store_failure(cache_key, error)
+    return RunResponse(error=error)
+
+
+async def _compile_java(code: str, temp_dir: str) -> list[str] | RunResponse:
+    """Write and compile Java sources; returns the run command or the compile error"""
+    # Extract class name from code
+    class_name = _extract_java_class_name(code)
+    filename = f"{class_name}.java"
+
+    # Write code to the appropriate filename
+    java_file = Path(temp_dir) / filename
+    java_file.write_text(code, encoding='utf-8')
+
+    # Compile, unless an identical build is already cached
+    compile_cmd, cache_key = await compile_key("java", code)
+    cache = get_compile_cache()
+    if not cache.fetch(cache_key, temp_dir):
+        with RUN_STAGE.time("java", "compile"):
+            compile_result = await run_process(compile_cmd, cwd=temp_dir, timeout=2)
+
+        if compile_result.returncode != 0:
+            return _compile_failed(cache_key, compile_result)
+
+        class_files = [p.name for p in Path(temp_dir).glob("*.class")]
+        cache.store(cache_key, temp_dir, class_files)
+
+    return ["java", *DEFAULT_LIMITS.java_heap_flag(), *_jvm_startup_flags(), class_name]
+
+
+async def _run_java(code: str, temp_dir: str) -> RunResponse:
+    """Execute Java code with javac + java in temp_dir"""
+    try:
+        command = await _compile_java(code, temp_dir)
+        if isinstance(command, RunResponse):
+            return command
+
+        # Execute
+        with RUN_STAGE.time("java", "execute"):
+            run_result = await run_process(command, cwd=temp_dir, timeout=2)
+
+        return _response(run_result)
+
+    except subprocess.TimeoutExpired:
+        return RunResponse(error="Execution timed out (2 seconds)")
+    except FileNotFoundError:
+        return RunResponse(error="Java is not installed")
+
+
+async def _compile_c(code: str, temp_dir: str) -> list[str] | RunResponse:
+    """Write temp.c and compile it; returns the run command or the compile error"""
+    # Write code to temp.c
+    c_file = Path(temp_dir) / "temp.c"
+    c_file.write_text(code, encoding='utf-8')
+
+    # Compile, unless an identical build is already cached
+    compile_cmd, cache_key = await compile_key("c", code)
+    cache = get_compile_cache()
+    if not cache.fetch(cache_key, temp_dir):
+        with RUN_STAGE.time("c", "compile"):
+            compile_result = await run_process(compile_cmd, cwd=temp_dir, timeout=2)
+
+        if compile_result.returncode != 0:
+            return _compile_failed(cache_key, compile_result)
+
+        cache.store(cache_key, temp_dir, ["temp"])
+
+    return ["./temp"]
+
+
+async def _run_c(code: str, temp_dir: str) -> RunResponse:
+    """Execute C code by writing to temp.c, compiling, and running"""
+    try:
+        command = await _compile_c(code, temp_dir)
+        if isinstance(command, RunResponse):
+            return command
+
+        # Execute
+        with RUN_STAGE.time("c", "execute"):
+            run_result = await run_process(command, cwd=temp_dir, timeout=2)
+
+        return _response(run_result)
+
+    except subprocess.TimeoutExpired:
+        return RunResponse(error="Execution timed out (2 seconds)")
+    except FileNotFoundError:
+        return RunResponse(error="GCC is not installed")
+
+
+async def prepare(language: str, code: str, temp_dir: str) -> list[str] | RunResponse:
+    """Build the command that executes `code`, compiling first where needed"""
+    try:
+        if language == "python":
+            # Unbuffered so output reaches streaming clients as it is printed
+            return ["python", "-u", "-c", code]
+        elif language == "javascript":
+            return ["node", "-e", code]
+        elif language == "java":
+            return await _compile_java(code, temp_dir)
+        return await _compile_c(code, temp_dir)
+    except subprocess.TimeoutExpired:
+        return RunResponse(error="Execution timed out (2 seconds)")
+    except FileNotFoundError:
+        return RunResponse(error=MISSING_TOOLCHAIN[language])
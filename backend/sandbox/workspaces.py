@@ -0,0 +1,239 @@
+"""
+Pool of pre-created workspace directories for runs.
+
+A run checks out an empty directory created ahead of time instead of
+creating a TemporaryDirectory, and hands it back when done; deleting it
+happens on a background thread, off the request path. Directories live on
+tmpfs (/dev/shm) when it is available, so neither step touches the disk.
+
+A directory is used by one run only. A process that outlived its run may
+still hold it open, so it is never wiped and handed to the next run: every
+checkout gets a directory made by a fresh mkdir, and the old one is deleted.
+
+The background thread keeps a number of spare directories ready, starting
+at CODESNAP_WORKSPACE_MIN_IDLE. When nothing idle is left the run pays for
+one mkdir and the spare target grows by one, up to
+CODESNAP_WORKSPACE_MAX_IDLE (0 disables the pool). After
+CODESNAP_WORKSPACE_IDLE_TTL without such a miss the target steps back down,
+and directories idle past the TTL are removed down to it.
+"""
+import itertools
+import os
+import queue
+import shutil
+import stat
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+
+
+def _default_root() -> str:
+    base = "/dev/shm" if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK) else tempfile.gettempdir()
+    return os.path.join(base, "codesnap-workspaces")
+
+
+WORKSPACE_ROOT = os.getenv("CODESNAP_WORKSPACE_ROOT") or _default_root()
+MIN_IDLE = int(os.getenv("CODESNAP_WORKSPACE_MIN_IDLE", "4"))
+MAX_IDLE = int(os.getenv("CODESNAP_WORKSPACE_MAX_IDLE", "64"))
+IDLE_TTL = float(os.getenv("CODESNAP_WORKSPACE_IDLE_TTL", "60"))
+
+_CLOSE = object()
+
+
+@dataclass(eq=False)
+class Workspace:
+    path: str
+    # When it last went idle (monotonic)
+    idle_since: float = 0.0
+
+
+def _retry_writable(func, path, _):
+    # A run may have removed write or search permission from its directories
+    os.chmod(os.path.dirname(path), stat.S_IRWXU)
+    func(path)
+
+
+def _stale_pools(root: str) -> list[str]:
+    """Pool directories left behind by server processes that no longer exist."""
+    stale = []
+    for name in os.listdir(root):
+        parts = name.split("-")
+        if len(parts) < 3 or parts[0] != "pool" or not parts[1].isdigit():
+            continue
+        try:
+            os.kill(int(parts[1]), 0)
+        except ProcessLookupError:
+            stale.append(os.path.join(root, name))
+        except PermissionError:
+            pass
+    return stale
+
+
+class WorkspacePool:
+    def __init__(self, root: str = WORKSPACE_ROOT, min_idle: int = MIN_IDLE, max_idle: int = MAX_IDLE,
+                 idle_ttl: float = IDLE_TTL):
+        os.makedirs(root, exist_ok=True)
+        stale = _stale_pools(root)
+        # One directory per server process, so workers sharing the root never collide
+        self.root = tempfile.mkdtemp(prefix=f"pool-{os.getpid()}-", dir=root)
+        self.min_idle = min(min_idle, max_idle)
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.target = self.min_idle
+        self.in_use = 0
+        self.created = 0
+        self.create_failures = 0
+        self.hits = 0
+        self.misses = 0
+        self.removed = 0
+        self.remove_failures = 0
+        self.remove_seconds = 0.0
+        self._last_miss = 0.0
+        # LIFO: the newest spare is handed out first, the oldest expire
+        self._idle: list[Workspace] = []
+        self._slots = itertools.count()
+        self._lock = threading.Lock()
+        self._dirty: queue.Queue = queue.Queue()
+        self._cleaner = threading.Thread(target=self._clean_loop, args=(stale,), daemon=True, name="workspaces")
+        self._cleaner.start()
+
+    def _create(self) -> Workspace:
+        path = os.path.join(self.root, str(next(self._slots)))
+        os.mkdir(path, stat.S_IRWXU)
+        with self._lock:
+            self.created += 1
+        return Workspace(path)
+
+    def acquire(self) -> Workspace:
+        """An empty directory for one run. Only creates one if none is idle."""
+        with self._lock:
+            workspace = self._idle.pop() if self._idle else None
+            self.in_use += 1
+            if workspace is not None:
+                self.hits += 1
+            else:
+                self.misses += 1
+                self.target = min(self.max_idle, self.target + 1)
+                self._last_miss = time.monotonic()
+        if workspace is None:
+            try:
+                workspace = self._create()
+            except BaseException:
+                with self._lock:
+                    self.in_use -= 1
+                raise
+            # Let the cleaner provision spares ahead of the next burst
+            self._dirty.put(None)
+        return workspace
+
+    def release(self, workspace: Workspace):
+        """Hand a directory back; it is deleted in the background, never reused."""
+        with self._lock:
+            self.in_use -= 1
+        self._dirty.put(workspace)
+
+    def _clean_loop(self, stale: list[str]):
+        for path in stale:
+            shutil.rmtree(path, ignore_errors=True)
+        self._rebalance()
+        while True:
+            try:
+                item = self._dirty.get(timeout=max(self.idle_ttl / 2, 1.0))
+            except queue.Empty:
+                item = None
+            if item is _CLOSE:
+                return
+            if item is not None:
+                self._remove(item)
+            self._rebalance()
+
+    def _rebalance(self):
+        """Top the idle list up to the target, and expire directories idle past the TTL."""
+        deadline = time.monotonic() - self.idle_ttl
+        expired = []
+        with self._lock:
+            if self.target > self.min_idle and self._last_miss < deadline:
+                self.target -= 1
+                # Restart the clock for the next step down
+                self._last_miss = time.monotonic()
+            while len(self._idle) > self.target and self._idle[0].idle_since < deadline:
+                expired.append(self._idle.pop(0))
+            missing = self.target - len(self._idle)
+        for workspace in expired:
+            self._remove(workspace)
+        for _ in range(missing):
+            try:
+                workspace = self._create()
+            except OSError:
+                # acquire() creates its own and raises if this keeps failing
+                with self._lock:
+                    self.create_failures += 1
+                return
+            workspace.idle_since = time.monotonic()
+            with self._lock:
+                self._idle.append(workspace)
+
+    def _remove(self, workspace: Workspace):
+        started = time.perf_counter()
+        try:
+            shutil.rmtree(workspace.path, onerror=_retry_writable)
+            failed = False
+        except OSError:
+            # Nothing hands this path out again, so a leftover only costs space
+            failed = True
+        with self._lock:
+            self.removed += 1
+            self.remove_failures += failed
+            self.remove_seconds += time.perf_counter() - started
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "root": self.root,
+                "idle": len(self._idle),
+                "target_idle": self.target,
+                "in_use": self.in_use,
+                "created": self.created,
+                "create_failures": self.create_failures,
+                "hits": self.hits,
+                "misses": self.misses,
+                "removed": self.removed,
+                "remove_failures": self.remove_failures,
+                "pending_removals": self._dirty.qsize(),
+                "avg_remove_ms": self.remove_seconds / self.removed * 1000 if self.removed else 0.0,
+            }
+
+    def close(self):
+        self._dirty.put(_CLOSE)
+        self._cleaner.join(timeout=10)
+        shutil.rmtree(self.root, ignore_errors=True)
+
+
+_pool: WorkspacePool | None = None
+_pool_lock = threading.Lock()
+
+
+def get_workspace_pool() -> WorkspacePool | None:
+    """Shared pool, created on first use. None when disabled."""
+    global _pool
+    if MAX_IDLE <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = WorkspacePool()
+    return _pool
+
+
+def shutdown_workspace_pool():
+    global _pool
+    if _pool is not None:
+        _pool.close()
+        _pool = None
+
+
+def workspace_pool_stats() -> dict:
+    if _pool is None:
+        return {"enabled": False, "max_idle": MAX_IDLE}
+    return {"enabled": True, **_pool.stats()}
@@ -0,0 +1,198 @@
+"""
+Content-addressed store for workspace file contents.
+
+A blob is the UTF-8 text of one file, named by its SHA-256 and kept once on
+local disk however many users or workspaces hold it (starter templates are
+the same everywhere). Blobs are immutable: writes go to a temporary file
+renamed into place, so concurrent writers of the same content are harmless
+and a reader never sees a partial blob. Recently read blobs are kept in
+memory up to CODESNAP_BLOB_CACHE_BYTES.
+
+New versions of a file can arrive as line edits against a blob the server
+already has (see apply_edits), so an edit to a long file costs the changed
+lines, not the file.
+
+Requests may name a synced file by hash instead of sending it (code_hash
+and the like); handlers fill those in with resolve_hashes before use.
+"""
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import threading
+from collections import OrderedDict
+
+from storage.paths import data_path
+
+BLOB_PATH = os.getenv("CODESNAP_BLOB_PATH", data_path("blobs"))
+MAX_BLOB_BYTES = int(os.getenv("CODESNAP_BLOB_MAX_BYTES", str(1024 * 1024)))
+CACHE_BYTES = int(os.getenv("CODESNAP_BLOB_CACHE_BYTES", str(16 * 1024 * 1024)))
+
+_HASH = re.compile(r"[0-9a-f]{64}")
+
+
+class BlobTooLarge(ValueError):
+    pass
+
+
+class UnknownBlob(ValueError):
+    pass
+
+
+def blob_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def apply_edits(base: str, edits: list[tuple[int, int, str]]) -> str | None:
+    """
+    base with each (start, end, text) applied: lines start..end-1 of base
+    (0-based, split on "\\n") replaced by the lines of text, or removed when
+    text is empty. Edits refer to base's line numbers, must not overlap and
+    may come in any order. None if one is out of range or they overlap.
+    """
+    lines = base.split("\n")
+    result = []
+    position = 0
+    for start, end, text in sorted(edits, key=lambda edit: (edit[0], edit[1])):
+        if start < position or end < start or end > len(lines):
+            return None
+        result.extend(lines[position:start])
+        if text:
+            result.extend(text.split("\n"))
+        position = end
+    result.extend(lines[position:])
+    return "\n".join(result)
+
+
+class BlobStore:
+    def __init__(self, root: str = BLOB_PATH, max_blob_bytes: int = MAX_BLOB_BYTES,
+                 cache_bytes: int = CACHE_BYTES):
+        self.root = root
+        self.max_blob_bytes = max_blob_bytes
+        self.cache_bytes = cache_bytes
+        self.written = 0
+        self.bytes_written = 0
+        self.deduplicated = 0
+        self.hits = 0
+        self.misses = 0
+        self._cached = 0
+        self._cache: OrderedDict[str, str] = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def _path(self, digest: str) -> str:
+        return os.path.join(self.root, digest[:2], digest[2:])
+
+    def _remember(self, digest: str, content: str):
+        size = len(content)
+        if size > self.cache_bytes:
+            return
+        with self._lock:
+            if digest in self._cache:
+                self._cache.move_to_end(digest)
+                return
+            self._cache[digest] = content
+            self._cached += size
+            while self._cached > self.cache_bytes:
+                _, evicted = self._cache.popitem(last=False)
+                self._cached -= len(evicted)
+
+    def has(self, digest: str) -> bool:
+        if not _HASH.fullmatch(digest):
+            return False
+        return digest in self._cache or os.path.exists(self._path(digest))
+
+    def missing(self, digests) -> list[str]:
+        return [digest for digest in digests if not self.has(digest)]
+
+    def put(self, content: str) -> str:
+        """Store content (if not already there) and return its hash."""
+        data = content.encode("utf-8")
+        if len(data) > self.max_blob_bytes:
+            raise BlobTooLarge(f"File of {len(data)} bytes exceeds the limit of {self.max_blob_bytes}")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if digest in self._cache or os.path.exists(path):
+            self.deduplicated += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(data)
+                os.replace(temp, path)
+            except BaseException:
+                os.unlink(temp)
+                raise
+            self.written += 1
+            self.bytes_written += len(data)
+        self._remember(digest, content)
+        return digest
+
+    def get(self, digest: str) -> str | None:
+        """The content with this hash, or None if the store does not have it."""
+        if not _HASH.fullmatch(digest):
+            return None
+        with self._lock:
+            content = self._cache.get(digest)
+            if content is not None:
+                self._cache.move_to_end(digest)
+        if content is not None:
+            self.hits += 1
+            return content
+        self.misses += 1
+        try:
+            with open(self._path(digest), "rb") as f:
+                content = f.read().decode("utf-8")
+        except FileNotFoundError:
+            return None
+        self._remember(digest, content)
+        return content
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "written": self.written,
+            "bytes_written": self.bytes_written,
+            "deduplicated": self.deduplicated,
+            "cache_entries": len(self._cache),
+            "cache_bytes": self._cached,
+            "cache_hit_ratio": self.hits / lookups if lookups else 0.0,
+        }
+
+
+_store: BlobStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """Shared store, opened on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = BlobStore()
+    return _store
+
+
+def blob_store_stats() -> dict:
+    if _store is None:
+        return {"open": False}
+    return {"open": True, **_store.stats()}
+
+
+async def resolve_hashes(request, *fields: str):
+    """
+    Set each of `fields` on request from the blob named by its `<field>_hash`,
+    where one is given. Reads happen off the event loop. Raises UnknownBlob
+    for a hash the store does not have.
+    """
+    for field in fields:
+        digest = getattr(request, f"{field}_hash")
+        if digest is None:
+            continue
+        content = await asyncio.to_thread(get_blob_store().get, digest)
+        if content is None:
+            raise UnknownBlob(f"Unknown {field}_hash {digest}; sync the file first")
+        setattr(request, field, content)
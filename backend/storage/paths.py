@@ -0,0 +1,18 @@
+"""
+Where durable server data lives by default.
+
+Workspaces, their blobs and learning activity have to survive a restart and
+a cleaned /tmp, so they default to CODESNAP_DATA_DIR ($XDG_DATA_HOME/codesnap,
+usually ~/.local/share/codesnap) rather than the temporary directory. Each
+store's own path variable still overrides this.
+"""
+import os
+
+DATA_DIR = os.getenv("CODESNAP_DATA_DIR") or os.path.join(
+    os.getenv("XDG_DATA_HOME") or os.path.join(os.path.expanduser("~"), ".local", "share"),
+    "codesnap",
+)
+
+
+def data_path(name: str) -> str:
+    return os.path.join(DATA_DIR, name)
@@ -0,0 +1,203 @@
+"""
+Server-side workspaces: which file paths a workspace has and the blob
+(storage/blobs.py) each one currently holds.
+
+A workspace is a manifest of {path: blob hash} with a version number in
+SQLite. Clients sync by sending the paths that changed since the version
+they last saw; a change whose base version is not the current one is
+refused as a conflict, with the current manifest, so the client can merge
+and retry instead of overwriting someone else's edits. Contents never go
+through this store, so a manifest read costs the same for a five-line
+starter file as for a long program.
+
+Changing a workspace takes its write token. The sync that creates a
+workspace gets a random one back, once; only its SHA-256 is stored, and
+every later sync has to send the token. Workspaces created before write
+tokens existed have none and are read-only; their files can be synced into
+a new workspace by hash without resending any content.
+
+A workspace synced with a user_id can only be read with that user_id,
+through its manifest or its files. One synced without is readable by anyone
+who knows its id.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from storage.paths import data_path
+
+STORE_PATH = os.getenv("CODESNAP_WORKSPACE_PATH", data_path("workspaces.sqlite3"))
+MAX_FILES = int(os.getenv("CODESNAP_WORKSPACE_MAX_FILES", "500"))
+
+_SCHEMA = (
+    "CREATE TABLE IF NOT EXISTS workspaces ("
+    " id TEXT PRIMARY KEY, owner TEXT, name TEXT NOT NULL, version INTEGER NOT NULL, updated REAL NOT NULL,"
+    " write_token TEXT)",
+    "CREATE TABLE IF NOT EXISTS files ("
+    " workspace_id TEXT NOT NULL, path TEXT NOT NULL, blob TEXT NOT NULL,"
+    " PRIMARY KEY (workspace_id, path)) WITHOUT ROWID",
+)
+
+
+def _token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+class WorkspaceConflict(Exception):
+    def __init__(self, manifest: dict):
+        super().__init__(f"Workspace is at version {manifest['version']}")
+        self.manifest = manifest
+
+
+class WorkspaceStore:
+    def __init__(self, path: str = STORE_PATH, max_files: int = MAX_FILES):
+        self.path = path
+        self.max_files = max_files
+        self.syncs = 0
+        self.changes = 0
+        self.conflicts = 0
+        self.refused = 0
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=5)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in _SCHEMA:
+            self._db.execute(statement)
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(workspaces)")}
+        if "write_token" not in columns:
+            # Existing workspaces get no token, so they stay read-only
+            self._db.execute("ALTER TABLE workspaces ADD COLUMN write_token TEXT")
+
+    def _manifest(self, workspace_id: str) -> dict | None:
+        row = self._db.execute(
+            "SELECT owner, name, version FROM workspaces WHERE id = ?", (workspace_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        files = self._db.execute(
+            "SELECT path, blob FROM files WHERE workspace_id = ? ORDER BY path", (workspace_id,)
+        ).fetchall()
+        return {"id": workspace_id, "owner": row[0], "name": row[1], "version": row[2], "files": dict(files)}
+
+    def manifest(self, workspace_id: str) -> dict | None:
+        """{id, owner, name, version, files: {path: blob hash}}, or None for an unknown workspace."""
+        with self._lock:
+            return self._manifest(workspace_id)
+
+    def read(self, workspace_id: str, owner: str | None) -> dict | None:
+        """manifest() for `owner`. Raises PermissionError if it belongs to another owner."""
+        manifest = self.manifest(workspace_id)
+        if manifest is not None and manifest["owner"] and owner != manifest["owner"]:
+            raise PermissionError("This workspace belongs to another user")
+        return manifest
+
+    def _authorize(self, workspace_id: str, write_token: str | None):
+        row = self._db.execute("SELECT write_token FROM workspaces WHERE id = ?", (workspace_id,)).fetchone()
+        if row[0] is None:
+            raise PermissionError("This workspace is read-only; sync its files into a new one")
+        if write_token is None or not hmac.compare_digest(row[0], _token_digest(write_token)):
+            raise PermissionError("This workspace's write_token is required to change it")
+
+    def commit(self, workspace_id: str, owner: str | None, write_token: str | None, base_version: int,
+               name: str | None, changes: dict[str, str | None]) -> dict:
+        """
+        Apply {path: blob hash, or None to delete} on top of base_version (0
+        for a new workspace) and return the new manifest; when this creates
+        the workspace, with its new write_token. Raises WorkspaceConflict if
+        the workspace has moved on, PermissionError without its write token,
+        ValueError if it would hold too many files.
+        """
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                current = self._manifest(workspace_id)
+                version = current["version"] if current is not None else 0
+                if current is not None:
+                    try:
+                        self._authorize(workspace_id, write_token)
+                    except PermissionError:
+                        self.refused += 1
+                        raise
+                if base_version != version:
+                    self.conflicts += 1
+                    raise WorkspaceConflict(current or {
+                        "id": workspace_id, "owner": None, "name": "", "version": 0, "files": {},
+                    })
+                files = dict(current["files"]) if current is not None else {}
+                for path, blob in changes.items():
+                    if blob is None:
+                        files.pop(path, None)
+                    else:
+                        files[path] = blob
+                if len(files) > self.max_files:
+                    raise ValueError(f"At most {self.max_files} files per workspace")
+
+                token = secrets.token_urlsafe(24) if current is None else None
+                self._db.execute(
+                    "INSERT INTO workspaces (id, owner, name, version, updated, write_token) VALUES (?, ?, ?, ?, ?, ?)"
+                    " ON CONFLICT (id) DO UPDATE SET name = excluded.name, version = excluded.version,"
+                    " updated = excluded.updated",
+                    (workspace_id, owner, name or (current["name"] if current else "My Learning Workspace"),
+                     version + 1, time.time(), _token_digest(token) if token is not None else None),
+                )
+                deleted = [(workspace_id, path) for path, blob in changes.items() if blob is None]
+                stored = [(workspace_id, path, blob) for path, blob in changes.items() if blob is not None]
+                self._db.executemany("DELETE FROM files WHERE workspace_id = ? AND path = ?", deleted)
+                self._db.executemany(
+                    "INSERT INTO files (workspace_id, path, blob) VALUES (?, ?, ?)"
+                    " ON CONFLICT (workspace_id, path) DO UPDATE SET blob = excluded.blob",
+                    stored,
+                )
+                manifest = self._manifest(workspace_id)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+            self.syncs += 1
+            self.changes += len(changes)
+            return {**manifest, "write_token": token} if token is not None else manifest
+
+    def stats(self) -> dict:
+        with self._lock:
+            workspaces = self._db.execute("SELECT COUNT(*) FROM workspaces").fetchone()[0]
+            files, blobs = self._db.execute("SELECT COUNT(*), COUNT(DISTINCT blob) FROM files").fetchone()
+        return {
+            "workspaces": workspaces,
+            "files": files,
+            "distinct_blobs": blobs,
+            # Files per stored copy of their content
+            "dedup_ratio": files / blobs if blobs else 0.0,
+            "syncs": self.syncs,
+            "changes": self.changes,
+            "conflicts": self.conflicts,
+            "refused": self.refused,
+        }
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_store: WorkspaceStore | None = None
+_store_lock = threading.Lock()
+
+
+def get_workspace_store() -> WorkspaceStore:
+    """Shared store, opened on first use."""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = WorkspaceStore()
+    return _store
+
+
+def workspace_store_stats() -> dict:
+    if _store is None:
+        return {"open": False}
+    return {"open": True, **_store.stats()}